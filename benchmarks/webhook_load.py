@@ -0,0 +1,282 @@
+"""
+Load test of the webhook and notifications Lambdas with synthetic WhatsApp traffic.
+
+The handlers run in-process against the in-memory backend of the layer
+(BOT_BACKEND=memory, modules/memory.py), with a simulated latency per downstream service. Each scenario runs in its own
+process and reports throughput, p50/p95/p99 latency and the downstream calls.
+
+Usage:
+    python benchmarks/webhook_load.py [--scenario all|signup_wave|bidding_war|notification_storm]
+                                      [--users 500] [--concurrency 50] [--latency-scale 1.0] [--json]
+"""
+import argparse
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, 'lambdas', 'cc-prod-bot-layer', 'python')
+SCENARIOS = ['signup_wave', 'bidding_war', 'notification_storm']
+
+# Typical round trip of each downstream service from Lambda, in seconds
+BASE_LATENCY = {
+    'dynamodb': 0.006,
+    'sns': 0.015,
+    's3': 0.030,
+    'sqs': 0.010,
+    'graph': 0.120,
+}
+
+def configure_environment():
+    now = datetime.now(timezone.utc)
+    defaults = {
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'MIN_BID': '1000000',
+        'MIN_BID_DIFFERENCE': '50000',
+        'MAX_BID': '100000000',
+        'PROPERTY_ADDRESS': 'Calle 1 # 2-3',
+        'TERMS_AND_CONDITIONS': 's3://cc-prod-bot/terms.pdf',
+        'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:cc-prod-bot',
+        'WHATSAPP_PHONE_NUMBER_ID': '000000000',
+        'WHATSAPP_ACCESS_TOKEN': 'token',
+        # The auction is in its last five minutes
+        'INITIAL_HOUR': (now - timedelta(hours=2)).isoformat(),
+        'FINAL_HOUR': (now + timedelta(minutes=5)).isoformat(),
+        'SIGNUP_INITIAL_HOUR': (now - timedelta(days=2)).isoformat(),
+        'SIGNUP_FINAL_HOUR': (now + timedelta(minutes=5)).isoformat(),
+        'NOTIFICATION_MODE': 'batch',
+        'BOT_BACKEND': 'memory',
+        # Embedded metric records would be mixed with the --json output
+        'METRICS_ENABLED': 'false',
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, LAYER)
+
+def load_lambda(name):
+    path = os.path.join(ROOT, 'lambdas', name, 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# ---------------------------------------------------------------------------
+# Synthetic payloads
+# ---------------------------------------------------------------------------
+
+def phone(index):
+    return f"57300{index:07d}"
+
+def base_message(sender, kind):
+    return {
+        'from': sender,
+        'id': f"wamid.{uuid.uuid4().hex}",
+        'timestamp': str(int(time.time())),
+        'type': kind,
+    }
+
+def text_message(sender, body):
+    return {**base_message(sender, 'text'), 'text': {'body': body}}
+
+def button_reply(sender, button_id):
+    return {
+        **base_message(sender, 'interactive'),
+        'interactive': {'type': 'button_reply', 'button_reply': {'id': button_id, 'title': button_id}}
+    }
+
+def document_message(sender):
+    return {
+        **base_message(sender, 'document'),
+        'document': {
+            'id': uuid.uuid4().hex[:16],
+            'mime_type': 'application/pdf',
+            'filename': 'Formato de Oferta.pdf',
+            # Base64 SHA-256 of the file, as sent by the Cloud API
+            'sha256': base64.b64encode(hashlib.sha256(memory.MEDIA_CONTENT).digest()).decode()
+        }
+    }
+
+def status_update(recipient, status):
+    return {
+        'id': f"wamid.{uuid.uuid4().hex}",
+        'status': status,
+        'timestamp': str(int(time.time())),
+        'recipient_id': recipient
+    }
+
+def webhook_event(messages=(), statuses=()):
+    value = {'messaging_product': 'whatsapp', 'metadata': {'phone_number_id': os.environ['WHATSAPP_PHONE_NUMBER_ID']}}
+    if messages:
+        value['messages'] = list(messages)
+    if statuses:
+        value['statuses'] = list(statuses)
+    body = {
+        'object': 'whatsapp_business_account',
+        'entry': [{'id': '0', 'changes': [{'field': 'messages', 'value': value}]}]
+    }
+    return {
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps(body)
+    }
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+def seed_verified_users(backend, count, subscribed=False):
+    table = backend['dynamodb'].Table('cc-prod-bot-user')
+    for index in range(count):
+        table.put_item(Item={
+            'phone': phone(index),
+            'verified': True,
+            'terms_document': [],
+            'status': None,
+            'created_at': str(int(time.time()) - 86400),
+            'last_message': str(int(time.time())),
+            'sns_subscription': 'batch' if subscribed else None
+        })
+    # Seeding is not part of the measured traffic
+    memory.calls.clear()
+
+def timed(handler, event):
+    started = time.perf_counter()
+    response = handler(event, None)
+    elapsed = time.perf_counter() - started
+    if response.get('statusCode') != 200:
+        raise RuntimeError(f"Handler failed: {response}")
+    return elapsed
+
+def run_sessions(sessions, concurrency):
+    # Each session is a list of (handler, event) processed in order, like a single
+    # user; different sessions run concurrently, like concurrent Lambda invocations
+    def run(session):
+        return [timed(handler, event) for handler, event in session]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return [latency for latencies in executor.map(run, sessions) for latency in latencies]
+
+def signup_wave(backend, users, concurrency):
+    webhook = load_lambda('cc-prod-bot-webhook').lambda_handler
+    sessions = [
+        [
+            (webhook, webhook_event([text_message(phone(index), "Hola")])),
+            (webhook, webhook_event([document_message(phone(index))])),
+            (webhook, webhook_event(statuses=[status_update(phone(index), 'delivered')])),
+        ]
+        for index in range(users)
+    ]
+    return run_sessions(sessions, concurrency)
+
+def bidding_war(backend, users, concurrency):
+    seed_verified_users(backend, users)
+    webhook = load_lambda('cc-prod-bot-webhook').lambda_handler
+    sessions = [
+        [
+            (webhook, webhook_event([text_message(phone(index), "Hola")])),
+            (webhook, webhook_event([button_reply(phone(index), 'offer')])),
+            (webhook, webhook_event(statuses=[status_update(phone(index), 'read')])),
+            (webhook, webhook_event([button_reply(phone(index), 'confirm_offer')])),
+        ]
+        for index in range(users)
+    ]
+    return run_sessions(sessions, concurrency)
+
+def notification_storm(backend, users, concurrency):
+    seed_verified_users(backend, users, subscribed=True)
+    notifications = load_lambda('cc-prod-bot-notifications').lambda_handler
+    sns = backend['sns']
+    sns.subscribe(TopicArn=os.environ['SNS_TOPIC_ARN'], Protocol='lambda', Endpoint='cc-prod-bot-notifications')
+    sns.register_handler('cc-prod-bot-notifications', notifications)
+    memory.calls.clear()
+
+    latencies = []
+    for bid in range(20):
+        sns.publish(
+            TopicArn=os.environ['SNS_TOPIC_ARN'],
+            Message=json.dumps({'amount': f"${1000000 + bid * 50000:,}".replace(",", "."), 'phone': phone(bid)}),
+            Subject='Nueva oferta registrada'
+        )
+        started = time.perf_counter()
+        sns.drain()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_scenario(name, users, concurrency, latency_scale):
+    configure_environment()
+    global memory
+    from modules import memory
+    for service, latency in BASE_LATENCY.items():
+        memory.LATENCY[service] = latency * latency_scale
+    backend = memory.reset()
+    # Terms document attached to the signup messages
+    bucket, key = os.environ['TERMS_AND_CONDITIONS'].replace("s3://", "").split("/", 1)
+    backend['s3'].objects[(bucket, key)] = {'Body': memory.MEDIA_CONTENT}
+
+    started = time.perf_counter()
+    latencies = globals()[name](backend, users, concurrency)
+    duration = time.perf_counter() - started
+    return {
+        'scenario': name,
+        'requests': len(latencies),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+        'calls': dict(sorted(memory.calls.items())),
+    }
+
+def print_report(results):
+    print(f"{'scenario':<20}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for result in results:
+        print(f"{result['scenario']:<20}{result['requests']:>9}{result['throughput_rps']:>9}"
+              f"{result['p50_ms']:>9}{result['p95_ms']:>9}{result['p99_ms']:>9}")
+    for result in results:
+        print(f"\n{result['scenario']} downstream calls:")
+        for call, count in result['calls'].items():
+            print(f"  {call:<36}{count:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default='all', choices=['all'] + SCENARIOS)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="Multiplier of the simulated downstream latency (0 disables it)")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    if args.scenario != 'all':
+        results = [run_scenario(args.scenario, args.users, args.concurrency, args.latency_scale)]
+    else:
+        # Every scenario runs in a fresh process, so module caches do not leak between them
+        results = []
+        for scenario in SCENARIOS:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--scenario', scenario, '--users', str(args.users),
+                 '--concurrency', str(args.concurrency), '--latency-scale', str(args.latency_scale), '--json'],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.extend(json.loads(output))
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_report(results)
+
+if __name__ == '__main__':
+    main()
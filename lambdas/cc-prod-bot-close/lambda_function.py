@@ -0,0 +1,28 @@
+import json
+import logging
+from modules.close import close_auction
+from modules.delivery import flush_sent
+from modules.metrics import start_invocation, emit_summary
+from modules.logs import LOG_LEVEL, configure_logging, sample_invocation
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+configure_logging()
+
+def lambda_handler(event, context):
+    # Invoked by a one-time EventBridge schedule shortly before FINAL_HOUR (e.g. one
+    # minute), so the users are loaded in advance and the close happens at the deadline.
+    # The function timeout must cover the lead time plus the announcements
+    start_invocation("close")
+    sample_invocation()
+    try:
+        summary = close_auction(wait=True)
+    finally:
+        # Sent messages still buffered for delivery tracking
+        flush_sent()
+        emit_summary()
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'status': 'success', 'summary': summary})
+    }
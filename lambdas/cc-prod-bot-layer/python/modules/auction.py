@@ -1,23 +1,20 @@
-import boto3
 import logging
 import os
 from datetime import datetime
 import pytz
-from boto3.dynamodb.conditions import Key
-from modules.whatsapp import send_whatsapp_message
-from modules.sns import add_subscription, remove_subscription, publish_message
+from modules.whatsapp import MessageTemplate, send_message_template
+from modules.money import format_as_money
+from modules.sns import add_subscription, remove_subscription
+from modules.notifications import queue_offer_notification
+from modules.bids import get_highest_bid, commit_bid, get_cache_stats, get_top_bids, get_bid_position
 from decimal import Decimal
-import uuid
+from modules.fsm import StateMachine, Turn, get_event, ANY
+from modules.metrics import measure
+from modules.logs import LOG_LEVEL, mask_phone
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-user_table = dynamodb.Table('cc-prod-bot-user')
-bid_table = dynamodb.Table('cc-prod-bot-bid')
-state_table = dynamodb.Table('cc-prod-bot-state')
+logger.setLevel(LOG_LEVEL)
 
 MIN_BID = float(os.environ.get("MIN_BID"))
 MIN_BID_DIFFERENCE = float(os.environ.get("MIN_BID_DIFFERENCE"))
@@ -29,34 +26,80 @@ timezone = pytz.timezone('America/Bogota')
 INITIAL_HOUR = datetime.fromisoformat(os.environ.get("INITIAL_HOUR")).astimezone(timezone)
 FINAL_HOUR = datetime.fromisoformat(os.environ.get("FINAL_HOUR")).astimezone(timezone)
 
-def proccess_auction(message, user):
+# Catálogo de mensajes, precompilados al importar el módulo
+AUCTION_NOT_STARTED = MessageTemplate(f"La subasta aún no ha comenzado. Estará disponible el {INITIAL_HOUR.strftime('%Y-%m-%d a las %H:%M')}.")
+AUCTION_ENDED = MessageTemplate("La subasta ha concluido. Agradecemos su interés.")
+OFFER_NOT_HIGHEST = MessageTemplate("Su oferta de @@draft_bid@@ no es la más alta. La oferta más alta es de @@highest_offer@@. Por favor, realice una nueva oferta.")
+OFFER_OUT_OF_RANGE = MessageTemplate(f"Su oferta de @@draft_bid@@ no es válida. Debe estar entre {format_as_money(MIN_BID)} y {format_as_money(MAX_BID)}.")
+OFFER_REGISTERED = MessageTemplate("Su oferta de @@draft_bid@@ ha sido registrada. ¡Buena suerte!")
+CONFIRM_BUTTONS = [
+    {"id": "confirm_offer", "text": "Sí"},
+    {"id": "cancel_offer", "text": "No"}
+]
+CONFIRM_DRAFT_OFFER = MessageTemplate("¿Desea confirmar su oferta de @@draft_bid@@?", buttons=CONFIRM_BUTTONS)
+CONFIRM_NEXT_OFFER = MessageTemplate("¿Esta seguro que desea ofertar @@next_offer@@?", buttons=CONFIRM_BUTTONS)
+SUBSCRIPTION_FAILED = MessageTemplate("No se pudo habilitar la suscripción a las notificaciones. Por favor, inténtelo más tarde.")
+NOTIFICATIONS_ENABLED = MessageTemplate("Las notificaciones han sido habilitadas. ¡Buena suerte!")
+UNSUBSCRIPTION_FAILED = MessageTemplate("No se pudo deshabilitar la suscripción a las notificaciones. Por favor, inténtelo más tarde.")
+NOTIFICATIONS_DISABLED = MessageTemplate("Las notificaciones han sido deshabilitadas. ¡Buena suerte!")
+MANAGE_NOTIFICATIONS = MessageTemplate(
+    "¿Desea recibir notificaciones cuando haya nuevas ofertas?",
+    buttons=[
+        {"id": "enable_notifications", "text": "Sí"},
+        {"id": "disable_notifications", "text": "No"}
+    ]
+)
+ALREADY_HIGHEST = MessageTemplate("Usted es el oferente más alto. ¡Buena suerte!")
+MENU_HIGHEST_BIDDER = MessageTemplate(
+    "Usted es el oferente más alto. ¡Buena suerte! ¿Desea configurar próximas notificaciones?",
+    buttons=[
+        {"id": "manage_notifications", "text": "Notificaciones"},
+        {"id": "ranking", "text": "Posiciones"}
+    ]
+)
+MENU_BUTTONS = [
+    {"id": "offer", "text": "Ofertar"},
+    {"id": "manage_notifications", "text": "Notificaciones"},
+    {"id": "ranking", "text": "Posiciones"}
+]
+MENU_WITH_OFFERS = MessageTemplate(
+    "La subasta está en curso. La oferta más alta es de @@highest_offer@@. ¿Desea realizar la próxima oferta por @@next_offer@@ o configurar próximas notificaciones?",
+    buttons=MENU_BUTTONS
+)
+MENU_WITHOUT_OFFERS = MessageTemplate(
+    f"La subasta está en curso. Hasta el momento no se ha realizado ninguna oferta. ¿Desea ofertar {format_as_money(MIN_BID)} o configurar próximas notificaciones?",
+    buttons=MENU_BUTTONS
+)
+RANKING = MessageTemplate("Las mejores ofertas hasta el momento son:\n@@top_bids@@\n\n@@position@@", buttons=MENU_BUTTONS)
+
+# Número de ofertas mostradas en las posiciones
+RANKING_SIZE = 5
+
+# Estados de la conversación durante la subasta. Sin estado, el usuario está en el menú
+PENDING_OFFER_CONFIRMATION = 'pending_offer_confirmation'
+PENDING_NOTIFICATION_CONFIGURATION = 'pending_notification_configuration'
+
+auction_flow = StateMachine('auction')
+
+def proccess_auction(message, user, changes):
     # Get current time with timezone
     now = datetime.now(timezone)
     
     if now < INITIAL_HOUR:
         logger.info("Auction has not started yet.")
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=f"La subasta aún no ha comenzado. Estará disponible el {INITIAL_HOUR.strftime('%Y-%m-%d a las %H:%M')}."
-        )
+        send_message_template(message.get('from'), AUCTION_NOT_STARTED)
         return
     elif now > FINAL_HOUR:
         logger.info("Auction has already ended.")
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message="La subasta ha concluido. Agradecemos su interés."
-        )
+        send_message_template(message.get('from'), AUCTION_ENDED)
         return
     
-    # Get highest offer from bid_table using GSI partition key "phone" and sort key "amount"
-    response = state_table.get_item(
-        Key={
-            'id': 'HIGHEST_BID'
-        }
-    )
-    highest_offer = float(response.get('Item', {}).get('amount', 0))
-    highest_offer_phone = response.get('Item', {}).get('phone', None)
-    logger.info(f"Highest offer: {highest_offer}")
+    # Get highest offer from the state table. Only the offer paths need it fresh,
+    # menus and notification settings can use the cached value
+    event = get_event(message)
+    highest_offer, highest_offer_phone = get_highest_bid(fresh=event in ("offer", "confirm_offer"))
+    # Hit ratio of the container's cache since it started, as a metric of the invocation
+    measure('highest_bid_cache.hit_ratio', round(get_cache_stats()['hit_ratio'], 4))
 
     # Check user last message
     last_message = user.get("last_message")
@@ -64,262 +107,131 @@ def proccess_auction(message, user):
     # If the last message is older than 15 minutes, update the status to None
     if last_message and (now.timestamp() - int(last_message) > 900):
         user['status'] = None
-        user_table.update_item(
-            Key={'phone': message.get('from')},
-            UpdateExpression="SET #status = :status",
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={':status': None}
-        )
+        changes.set(status=None)
         logger.info("User status updated to None due to inactivity.")
 
-    
+    turn = Turn(message, user, changes, now=now, highest_offer=highest_offer, highest_offer_phone=highest_offer_phone)
+    auction_flow.dispatch(user.get("status"), event, turn)
+
+def is_outbid(turn):
+    return turn.highest_offer > turn.user.get("draft_bid")
+
+def is_out_of_range(turn):
+    return turn.user.get("draft_bid") < MIN_BID or turn.user.get("draft_bid") > MAX_BID
 
-    if user.get("status") == "pending_offer_confirmation":
-        # Get user's draft bid
-        draft_bid = user.get("draft_bid")
-        # Confirm offer
-        if message.get("interactive"):
-            if message.get("interactive").get("button_reply"):
-                button_id = message.get("interactive").get("button_reply").get("id")
-                
-                if button_id == "confirm_offer":
-                    if highest_offer > draft_bid:
-                        # User is not the highest bidder
-                        send_whatsapp_message(
-                            phone_number=message.get('from'),
-                            message=f"Su oferta de {format_as_money(draft_bid)} no es la más alta. La oferta más alta es de {format_as_money(highest_offer)}. Por favor, realice una nueva oferta."
-                        )
-                        # Update user status to None
-                        user_table.update_item(
-                            Key={'phone': message.get('from')},
-                            UpdateExpression="SET #status = :status, #draft_bid = :bid",
-                            ExpressionAttributeNames={'#status': 'status', '#draft_bid': 'draft_bid'},
-                            ExpressionAttributeValues={':status': None, ':bid': None}
-                        )
-                        send_menu(message, user, highest_offer, highest_offer_phone)
-                        return
-                    if draft_bid < MIN_BID or draft_bid > MAX_BID:
-                        # User's bid is out of range
-                        send_whatsapp_message(
-                            phone_number=message.get('from'),
-                            message=f"Su oferta de {format_as_money(draft_bid)} no es válida. Debe estar entre {format_as_money(MIN_BID)} y {format_as_money(MAX_BID)}."
-                        )
-                        # Update user status to None
-                        user_table.update_item(
-                            Key={'phone': message.get('from')},
-                            UpdateExpression="SET #status = :status, #draft_bid = :bid",
-                            ExpressionAttributeNames={'#status': 'status', '#draft_bid': 'draft_bid'},
-                            ExpressionAttributeValues={':status': None, ':bid': None}
-                        )
-                        send_menu(message, user, highest_offer, highest_offer_phone)
-                        return
+@auction_flow.on(PENDING_OFFER_CONFIRMATION, "confirm_offer", guard=is_outbid, target=None)
+def reject_outbid_offer(turn):
+    # User is not the highest bidder
+    send_message_template(turn.phone, OFFER_NOT_HIGHEST, draft_bid=format_as_money(turn.user.get("draft_bid")), highest_offer=format_as_money(turn.highest_offer))
+    turn.changes.set(draft_bid=None)
+    send_menu(turn)
 
-                    # Save the offer in the bid_table
-                    bid_table.put_item(
-                        Item={
-                            'phone': message.get('from'),
-                            'amount': Decimal(str(draft_bid)),
-                            'timestamp': int(now.timestamp()),
-                            'id': str(uuid.uuid4())
-                        }
-                    )
-                    # Save the highest offer in the state_table
-                    state_table.update_item(
-                        Key={
-                            'id': 'HIGHEST_BID'
-                        },
-                        UpdateExpression="SET #amount = :amount, #phone = :phone",
-                        ExpressionAttributeNames={'#amount': 'amount', '#phone': 'phone'},
-                        ExpressionAttributeValues={':amount': Decimal(str(draft_bid)), ':phone': message.get('from')}
-                    )
-                    # Update user status to None
-                    user_table.update_item(
-                        Key={'phone': message.get('from')},
-                        UpdateExpression="SET #status = :status, #draft_bid = :bid",
-                        ExpressionAttributeNames={'#status': 'status', '#draft_bid': 'draft_bid'},
-                        ExpressionAttributeValues={':status': None, ':bid': None}
-                    )
-                    logger.info(f"User {message.get('from')} made an offer of {draft_bid}.")
-                    # Notify users
-                    publish_message(
-                        json_message={
-                            'amount': format_as_money(draft_bid),
-                            'phone': message.get('from')
-                        },
-                        subject="Nueva oferta registrada"
-                    )
-                    send_whatsapp_message(
-                        phone_number=message.get('from'),
-                        message=f"Su oferta de {format_as_money(draft_bid)} ha sido registrada. ¡Buena suerte!"
-                    )
-                    return
-                elif button_id == "cancel_offer":
-                    # Update user status to None
-                    user_table.update_item(
-                        Key={'phone': message.get('from')},
-                        UpdateExpression="SET #status = :status",
-                        ExpressionAttributeNames={'#status': 'status'},
-                        ExpressionAttributeValues={':status': None}
-                    )
-                    send_menu(message, user, highest_offer, highest_offer_phone)
-                    return
-        else:
-            send_whatsapp_message(
-                    phone_number=message.get('from'),
-                    message=f"¿Desea confirmar su oferta de {format_as_money(draft_bid)}?",
-                    buttons=[
-                        {"id": "confirm_offer", "text": "Sí"},
-                        {"id": "cancel_offer", "text": "No"}
-                    ]
-                )
-    elif user.get("status") == "pending_notification_configuration":
-        # Enable or disable notifications
-        if message.get("interactive"):
-            if message.get("interactive").get("button_reply"):
-                button_id = message.get("interactive").get("button_reply").get("id")
-                if button_id == "enable_notifications":
-                    # Update user status to None and enable notifications
-                    if not user.get("sns_subscription"):
-                        sns_subscription = add_subscription(
-                            phone=message.get('from')
-                        )
-                        if not sns_subscription:
-                            send_whatsapp_message(
-                                phone_number=message.get('from'),
-                                message="No se pudo habilitar la suscripción a las notificaciones. Por favor, inténtelo más tarde."
-                            )
-                            return
+@auction_flow.on(PENDING_OFFER_CONFIRMATION, "confirm_offer", guard=is_out_of_range, target=None)
+def reject_out_of_range_offer(turn):
+    # User's bid is out of range
+    send_message_template(turn.phone, OFFER_OUT_OF_RANGE, draft_bid=format_as_money(turn.user.get("draft_bid")))
+    turn.changes.set(draft_bid=None)
+    send_menu(turn)
+
+@auction_flow.on(PENDING_OFFER_CONFIRMATION, "confirm_offer", target=None)
+def confirm_offer(turn):
+    draft_bid = turn.user.get("draft_bid")
+    turn.changes.set(draft_bid=None)
+    # Save the offer in the bid_table and the highest offer in the state_table.
+    # The commit is rejected if another offer was registered in the meantime.
+    if not commit_bid(
+        phone=turn.phone,
+        amount=draft_bid,
+        timestamp=int(turn.now.timestamp())
+    ):
+        turn.highest_offer, turn.highest_offer_phone = get_highest_bid(fresh=True)
+        send_message_template(turn.phone, OFFER_NOT_HIGHEST, draft_bid=format_as_money(draft_bid), highest_offer=format_as_money(turn.highest_offer))
+        send_menu(turn)
+        return
+    logger.info(f"User {turn.phone} made an offer of {draft_bid}.")
+    # Notify users
+    queue_offer_notification(
+        amount=draft_bid,
+        display_amount=format_as_money(draft_bid),
+        phone=turn.phone
+    )
+    send_message_template(turn.phone, OFFER_REGISTERED, draft_bid=format_as_money(draft_bid))
 
-                        user_table.update_item(
-                            Key={'phone': message.get('from')},
-                            UpdateExpression="SET #status = :status, #sns_subscription = :sub",
-                            ExpressionAttributeNames={'#status': 'status', '#sns_subscription': 'sns_subscription'},
-                            ExpressionAttributeValues={':status': None, ':sub': sns_subscription}
-                        )
-                    else:
-                        # Update user status to None
-                        user_table.update_item(
-                            Key={'phone': message.get('from')},
-                            UpdateExpression="SET #status = :status",
-                            ExpressionAttributeNames={'#status': 'status'},
-                            ExpressionAttributeValues={':status': None}
-                        )
-                    send_whatsapp_message(
-                        phone_number=message.get('from'),
-                        message="Las notificaciones han sido habilitadas. ¡Buena suerte!"
-                    )
-                    
-                    return
-                elif button_id == "disable_notifications":
-                    # Remove subscription from SNS
-                    sns_subscription = user.get("sns_subscription")
-                    if sns_subscription:
-                        if not remove_subscription(
-                            subscription_arn=sns_subscription
-                        ):
-                            send_whatsapp_message(
-                                phone_number=message.get('from'),
-                                message="No se pudo deshabilitar la suscripción a las notificaciones. Por favor, inténtelo más tarde."
-                            )
-                            return
-                    # Update user status to None and disable notifications
-                    user_table.update_item(
-                        Key={'phone': message.get('from')},
-                        UpdateExpression="SET #status = :status, #sns_subscription = :sub",
-                        ExpressionAttributeNames={'#status': 'status', '#sns_subscription': 'sns_subscription'},
-                        ExpressionAttributeValues={':status': None, ':sub': None}
-                    )
-                    send_whatsapp_message(
-                        phone_number=message.get('from'),
-                        message="Las notificaciones han sido deshabilitadas. ¡Buena suerte!"
-                    )
-                    return
+@auction_flow.on(PENDING_OFFER_CONFIRMATION, "cancel_offer", target=None)
+def cancel_offer(turn):
+    send_menu(turn)
+
+# Cualquier mensaje que no sea un botón repite la confirmación pendiente
+@auction_flow.on(PENDING_OFFER_CONFIRMATION, guard=lambda turn: not turn.message.get("interactive"))
+def ask_confirmation(turn):
+    send_message_template(turn.phone, CONFIRM_DRAFT_OFFER, draft_bid=format_as_money(turn.user.get("draft_bid")))
+
+@auction_flow.on(PENDING_NOTIFICATION_CONFIGURATION, "enable_notifications", target=None)
+def enable_notifications(turn):
+    if not turn.user.get("sns_subscription"):
+        sns_subscription = add_subscription(
+            phone=turn.phone
+        )
+        if not sns_subscription:
+            send_message_template(turn.phone, SUBSCRIPTION_FAILED)
+            return False
+        turn.changes.set(sns_subscription=sns_subscription)
+    send_message_template(turn.phone, NOTIFICATIONS_ENABLED)
+
+@auction_flow.on(PENDING_NOTIFICATION_CONFIGURATION, "disable_notifications", target=None)
+def disable_notifications(turn):
+    # Remove subscription from SNS
+    sns_subscription = turn.user.get("sns_subscription")
+    if sns_subscription:
+        if not remove_subscription(
+            subscription_arn=sns_subscription
+        ):
+            send_message_template(turn.phone, UNSUBSCRIPTION_FAILED)
+            return False
+    turn.changes.set(sns_subscription=None)
+    send_message_template(turn.phone, NOTIFICATIONS_DISABLED)
+
+@auction_flow.on(ANY, "manage_notifications", target=PENDING_NOTIFICATION_CONFIGURATION)
+def manage_notifications(turn):
+    send_message_template(turn.phone, MANAGE_NOTIFICATIONS)
+
+# Check if the user is the same as the highest offer
+@auction_flow.on(ANY, "offer", guard=lambda turn: turn.user.get("phone") == turn.highest_offer_phone)
+def already_highest(turn):
+    send_message_template(turn.phone, ALREADY_HIGHEST)
+
+@auction_flow.on(ANY, "offer", target=PENDING_OFFER_CONFIRMATION)
+def draft_offer(turn):
+    next_offer = max(turn.highest_offer + MIN_BID_DIFFERENCE, MIN_BID)
+    send_message_template(turn.phone, CONFIRM_NEXT_OFFER, next_offer=format_as_money(next_offer))
+    turn.changes.set(draft_bid=Decimal(str(next_offer)))
+
+@auction_flow.on(ANY, "ranking")
+def show_ranking(turn):
+    top_bids = get_top_bids(RANKING_SIZE)
+    if not top_bids:
+        send_menu(turn)
+        return
+    # Los demás oferentes solo se identifican por los últimos dígitos de su número
+    lines = [
+        f"{position}. {format_as_money(amount)} ({'usted' if bidder == turn.phone else mask_phone(bidder)})"
+        for position, (bidder, amount) in enumerate(top_bids, start=1)
+    ]
+    position, amount = get_bid_position(turn.phone)
+    if position:
+        summary = f"Su mejor oferta, de {format_as_money(amount)}, está en la posición {position}."
     else:
-        # Check if he click some interactive button
-        if message.get("interactive"):
-            if message.get("interactive").get("button_reply"):
-                button_id = message.get("interactive").get("button_reply").get("id")
-                if button_id == "manage_notifications":
-                    send_whatsapp_message(
-                        phone_number=message.get('from'),
-                        message="¿Desea recibir notificaciones cuando haya nuevas ofertas?",
-                        buttons=[
-                            {"id": "enable_notifications", "text": "Sí"},
-                            {"id": "disable_notifications", "text": "No"}
-                        ]
-                    )
-                    # Update user status to pending_notification_configuration
-                    user_table.update_item(
-                        Key={'phone': message.get('from')},
-                        UpdateExpression="SET #status = :status",
-                        ExpressionAttributeNames={'#status': 'status'},
-                        ExpressionAttributeValues={':status': 'pending_notification_configuration'}
-                    )
-                    return
-                elif button_id == "offer":
-                    # Check if the user is the same as the highest offer
-                    if user.get("phone") == highest_offer_phone:
-                        send_whatsapp_message(
-                            phone_number=message.get('from'),
-                            message="Usted es el oferente más alto. ¡Buena suerte!"
-                        )
-                        return
-                    send_whatsapp_message(
-                    phone_number=message.get('from'),
-                    message=f"¿Esta seguro que desea ofertar {format_as_money(max(highest_offer + MIN_BID_DIFFERENCE, MIN_BID))}?",
-                    buttons=[
-                            {"id": "confirm_offer", "text": "Sí"},
-                            {"id": "cancel_offer", "text": "No"}
-                        ]
-                    )
-                    # Update user status to pending_offer_confirmation
-                    user_table.update_item(
-                    Key={'phone': message.get('from')},
-                    UpdateExpression="SET #status = :status, #draft_bid = :bid",
-                    ExpressionAttributeNames={'#status': 'status', '#draft_bid': 'draft_bid'},
-                    ExpressionAttributeValues={':status': 'pending_offer_confirmation', ':bid': Decimal(str(max(highest_offer + MIN_BID_DIFFERENCE, MIN_BID)))}
-                    )
-                    return
-        
-        send_menu(message, user, highest_offer, highest_offer_phone)
+        summary = "Usted aún no ha realizado ofertas."
+    send_message_template(turn.phone, RANKING, top_bids="\n".join(lines), position=summary)
 
-def send_menu(message, user, highest_offer, highest_offer_phone):
+@auction_flow.on(ANY, ANY)
+def send_menu(turn):
     # User is in the auction process
-    if user.get("phone") == highest_offer_phone:
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message="Usted es el oferente más alto. ¡Buena suerte! ¿Desea configurar próximas notificaciones?",
-            buttons=[
-                {"id": "manage_notifications", "text": "Notificaciones"}
-            ]
-        )
-    elif highest_offer > 0:
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=f"La subasta está en curso. La oferta más alta es de {format_as_money(highest_offer)}. ¿Desea realizar la próxima oferta por {format_as_money(highest_offer + MIN_BID_DIFFERENCE)} o configurar próximas notificaciones?",
-            buttons=[
-                {"id": "offer", "text": "Ofertar"},
-                {"id": "manage_notifications", "text": "Notificaciones"}
-            ]
-        )
+    if turn.user.get("phone") == turn.highest_offer_phone:
+        send_message_template(turn.phone, MENU_HIGHEST_BIDDER)
+    elif turn.highest_offer > 0:
+        send_message_template(turn.phone, MENU_WITH_OFFERS, highest_offer=format_as_money(turn.highest_offer), next_offer=format_as_money(turn.highest_offer + MIN_BID_DIFFERENCE))
     else:
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=f"La subasta está en curso. Hasta el momento no se ha realizado ninguna oferta. ¿Desea ofertar {format_as_money(MIN_BID)} o configurar próximas notificaciones?",
-            buttons=[
-                {"id": "offer", "text": "Ofertar"},
-                {"id": "manage_notifications", "text": "Notificaciones"}
-            ]
-        )
+        send_message_template(turn.phone, MENU_WITHOUT_OFFERS)
 
-def format_as_money(value):
-    """
-    Formatea un número como una cadena de dinero en formato colombiano.
-    
-    Args:
-        value (float): El valor a formatear.
-    
-    Returns:
-        str: El valor formateado como cadena de dinero.
-    """
-    return f"${value:,.0f}".replace(",", ".")
\ No newline at end of file
+auction_flow.compile()
@@ -0,0 +1,213 @@
+import logging
+import os
+import time
+import uuid
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from modules.clients import get_dynamodb, get_table, BID_TABLE, STATE_TABLE
+from modules.metrics import count, span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Kept as text and converted where the bid is committed, so the offline scripts can
+# import the module without the bidding settings
+MIN_BID_DIFFERENCE = os.environ.get("MIN_BID_DIFFERENCE")
+
+# Seconds the highest bid read from DynamoDB is reused by a warm container
+HIGHEST_BID_CACHE_TTL = float(os.environ.get("HIGHEST_BID_CACHE_TTL", "2"))
+
+# State row with the best bid of each bidder, one attribute per bidder with this
+# prefix. Every accepted bid is the new highest bid, so it is also the best bid of its
+# bidder and the ranking is kept by the same transaction that registers the bid. It is
+# not kept in HIGHEST_BID, so the reads of the offer paths do not grow with the bidders
+RANKING_ID = 'BID_RANKING'
+BEST_BID_PREFIX = 'best_'
+
+# Highest bid cached by this container, stamped with the version of the state row
+highest_bid_cache = {'amount': 0.0, 'phone': None, 'version': None, 'expires_at': 0}
+# Ranking cached by this container
+ranking_cache = {'ranking': [], 'expires_at': 0}
+cache_stats = {'hits': 0, 'misses': 0, 'changes': 0}
+
+def get_highest_bid(fresh=False):
+    """
+    Gets the current highest bid, from the container cache when it has not expired
+
+    Args:
+        fresh (bool, optional): Skip the cache and do a strongly consistent read.
+            Required when the result is used to register a bid.
+
+    Returns:
+        tuple: (amount, phone) of the highest bid. amount is 0 and phone is None if there are no bids
+    """
+    read_state(fresh)
+    return highest_bid_cache['amount'], highest_bid_cache['phone']
+
+def read_state(fresh=False):
+    # Refreshes the cache from the HIGHEST_BID state row when it has expired
+    now = time.monotonic()
+    if not fresh and highest_bid_cache['expires_at'] > now:
+        cache_stats['hits'] += 1
+        count('highest_bid_cache.hits')
+        return
+
+    cache_stats['misses'] += 1
+    count('highest_bid_cache.misses')
+    with span('dynamodb.read_highest_bid'):
+        response = get_table(STATE_TABLE).get_item(
+            Key={
+                'id': 'HIGHEST_BID'
+            },
+            ConsistentRead=fresh
+        )
+    item = response.get('Item', {})
+    version = int(item.get('version', 0))
+    if highest_bid_cache['version'] is not None and version != highest_bid_cache['version']:
+        cache_stats['changes'] += 1
+        count('highest_bid_cache.changes')
+        logger.info(f"Highest bid changed: version {highest_bid_cache['version']} -> {version}")
+    highest_bid_cache.update(
+        amount=float(item.get('amount', 0)),
+        phone=item.get('phone', None),
+        version=version,
+        expires_at=now + HIGHEST_BID_CACHE_TTL
+    )
+
+def read_ranking(fresh=False):
+    # Refreshes the ranking from the BID_RANKING state row when it has expired
+    now = time.monotonic()
+    if not fresh and ranking_cache['expires_at'] > now:
+        return ranking_cache['ranking']
+    with span('dynamodb.read_ranking'):
+        item = get_table(STATE_TABLE).get_item(Key={'id': RANKING_ID}, ConsistentRead=fresh).get('Item', {})
+    ranking_cache.update(
+        ranking=sorted(
+            ((name[len(BEST_BID_PREFIX):], float(amount)) for name, amount in item.items() if name.startswith(BEST_BID_PREFIX)),
+            key=lambda entry: entry[1],
+            reverse=True
+        ),
+        expires_at=now + HIGHEST_BID_CACHE_TTL
+    )
+    return ranking_cache['ranking']
+
+def get_top_bids(limit=5, fresh=False):
+    """
+    Gets the leaderboard of the auction: the best bid of each bidder, highest first
+
+    Args:
+        limit (int, optional): Number of bidders to return
+        fresh (bool, optional): Skip the cache and do a strongly consistent read
+
+    Returns:
+        list: (phone, amount) of the best bids
+    """
+    return read_ranking(fresh)[:limit]
+
+def get_bid_position(phone, fresh=False):
+    """
+    Gets the position of a bidder in the leaderboard of the auction
+
+    Args:
+        phone (str): Phone number of the bidder
+        fresh (bool, optional): Skip the cache and do a strongly consistent read
+
+    Returns:
+        tuple: (position, amount) of the best bid of the bidder, starting at 1.
+            (None, None) if the bidder has not registered any bid
+    """
+    for position, (bidder, amount) in enumerate(read_ranking(fresh), start=1):
+        if bidder == phone:
+            return position, amount
+    return None, None
+
+def get_cache_stats():
+    """
+    Gets the hit ratio of the highest bid cache of this container
+
+    Returns:
+        dict: Number of hits, misses, detected changes and the hit ratio
+    """
+    total = cache_stats['hits'] + cache_stats['misses']
+    return {**cache_stats, 'hit_ratio': cache_stats['hits'] / total if total else 0.0}
+
+def commit_bid(phone, amount, timestamp):
+    """
+    Registers a bid and makes it the highest bid, and the best bid of its bidder in
+    the BID_RANKING row, in a single transaction.
+
+    The state row is only updated if the bid still beats the current highest bid
+    by at least MIN_BID_DIFFERENCE, so concurrent confirmations can never replace
+    a higher bid with a lower one, and if the auction has not been closed.
+
+    Args:
+        phone (str): Phone number of the bidder
+        amount (Decimal|float): Amount of the bid
+        timestamp (int): Epoch seconds of the bid
+
+    Returns:
+        bool: True if the bid was registered, False if a higher bid was registered
+            first or the auction was closed
+    """
+    amount = Decimal(str(amount))
+    ceiling = amount - Decimal(MIN_BID_DIFFERENCE)
+    try:
+        with span('dynamodb.commit_bid'):
+            get_dynamodb().meta.client.transact_write_items(
+                TransactItems=[
+                    {
+                        'Put': {
+                            'TableName': BID_TABLE,
+                            'Item': {
+                                'phone': phone,
+                                'amount': amount,
+                                'timestamp': timestamp,
+                                'id': str(uuid.uuid4())
+                            }
+                        }
+                    },
+                    {
+                        'Update': {
+                            'TableName': STATE_TABLE,
+                            'Key': {'id': 'HIGHEST_BID'},
+                            'UpdateExpression': "SET #amount = :amount, #phone = :phone ADD #version :one",
+                            'ConditionExpression': "(attribute_not_exists(#amount) OR #amount <= :ceiling) AND attribute_not_exists(#closed)",
+                            'ExpressionAttributeNames': {
+                                '#amount': 'amount',
+                                '#phone': 'phone',
+                                '#version': 'version',
+                                '#closed': 'closed'
+                            },
+                            'ExpressionAttributeValues': {':amount': amount, ':phone': phone, ':ceiling': ceiling, ':one': 1}
+                        }
+                    },
+                    {
+                        'Update': {
+                            'TableName': STATE_TABLE,
+                            'Key': {'id': RANKING_ID},
+                            'UpdateExpression': "SET #best = :amount",
+                            'ExpressionAttributeNames': {'#best': BEST_BID_PREFIX + phone},
+                            'ExpressionAttributeValues': {':amount': amount}
+                        }
+                    }
+                ]
+            )
+        # Write-through: this container already knows the new highest bid
+        highest_bid_cache.update(
+            amount=float(amount),
+            phone=phone,
+            version=None,
+            expires_at=time.monotonic() + HIGHEST_BID_CACHE_TTL
+        )
+        ranking_cache['ranking'] = [(phone, float(amount))] + [entry for entry in ranking_cache['ranking'] if entry[0] != phone]
+        return True
+    except ClientError as e:
+        reasons = e.response.get('CancellationReasons', [])
+        if e.response['Error']['Code'] == 'TransactionCanceledException' and any(
+            reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons
+        ):
+            logger.info(f"Bid of {amount} from {phone} rejected: a higher bid was registered first.")
+            return False
+        raise
@@ -0,0 +1,87 @@
+import os
+import threading
+
+# AWS clients and resources shared by every module of the layer. They are created
+# on first use, so code paths that do not need them do not pay for them on cold start
+
+# "aws" (default) or "memory" for the in-process stand-ins of modules.memory
+BOT_BACKEND = os.environ.get("BOT_BACKEND", "aws")
+
+USER_TABLE = 'cc-prod-bot-user'
+BID_TABLE = 'cc-prod-bot-bid'
+STATE_TABLE = 'cc-prod-bot-state'
+MESSAGE_TABLE = 'cc-prod-bot-messages'
+
+registry = {}
+lock = threading.RLock()
+
+# boto3 resources are not thread safe. The main thread uses the shared ones, and any
+# other thread (e.g. the sender pool of the webhook) gets its own, built from its own session
+thread_registry = threading.local()
+
+def get_or_create(name, factory):
+    # Double-checked so that concurrent threads never build the same client twice
+    if name not in registry:
+        with lock:
+            if name not in registry:
+                registry[name] = create(name, factory)
+    return registry[name]
+
+def get_or_create_per_thread(name, factory):
+    # The in-memory stand-ins are shared, they are guarded by their own locks
+    if BOT_BACKEND == "memory" or threading.current_thread() is threading.main_thread():
+        return get_or_create(name, factory)
+    entries = getattr(thread_registry, 'entries', None)
+    if entries is None:
+        entries = thread_registry.entries = {}
+    if name not in entries:
+        entries[name] = create(name, factory)
+    return entries[name]
+
+def create(name, factory):
+    if BOT_BACKEND == "memory":
+        from modules import memory
+        return memory.create(name, factory)
+    return factory()
+
+def get_client(service):
+    """
+    Gets the shared boto3 client of an AWS service
+
+    Args:
+        service (str): Name of the service, e.g. 'sns'
+
+    Returns:
+        botocore.client.BaseClient: Client of the service
+    """
+    def factory():
+        import boto3
+        return boto3.client(service)
+    return get_or_create(f"client:{service}", factory)
+
+def get_dynamodb():
+    """
+    Gets the DynamoDB resource of the current thread
+
+    Returns:
+        boto3.resources.base.ServiceResource: DynamoDB resource
+    """
+    def factory():
+        import boto3
+        if threading.current_thread() is threading.main_thread():
+            return boto3.resource('dynamodb')
+        # The default session is not thread safe either
+        return boto3.session.Session().resource('dynamodb')
+    return get_or_create_per_thread("resource:dynamodb", factory)
+
+def get_table(name):
+    """
+    Gets a DynamoDB table of the current thread
+
+    Args:
+        name (str): Name of the table
+
+    Returns:
+        Table: DynamoDB table resource
+    """
+    return get_or_create_per_thread(f"table:{name}", lambda: get_dynamodb().Table(name))
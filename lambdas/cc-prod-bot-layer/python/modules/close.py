@@ -0,0 +1,195 @@
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from modules.whatsapp import send_whatsapp_template
+from modules.notifications import RateLimiter, NOTIFICATION_CONCURRENCY, NOTIFICATION_RATE_LIMIT
+from modules.money import format_as_money
+from modules.clients import get_table, USER_TABLE, STATE_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+FINAL_HOUR = datetime.fromisoformat(os.environ.get("FINAL_HOUR")).astimezone(timezone.utc)
+
+# Templates sent to the winner and to the rest of the verified users, with the
+# winning amount as their only parameter
+CLOSE_WINNER_TEMPLATE = os.environ.get("CLOSE_WINNER_TEMPLATE", "auction_winner")
+CLOSE_LOSER_TEMPLATE = os.environ.get("CLOSE_LOSER_TEMPLATE", "auction_closed")
+# Template sent to every verified user when the auction closes without bids, without parameters
+CLOSE_NO_BIDS_TEMPLATE = os.environ.get("CLOSE_NO_BIDS_TEMPLATE", "auction_closed_no_bids")
+CLOSE_TEMPLATE_LANGUAGE = os.environ.get("CLOSE_TEMPLATE_LANGUAGE", "es")
+
+# Announcements sent between two checkpoints of the announced users
+CLOSE_CHECKPOINT_SIZE = int(os.environ.get("CLOSE_CHECKPOINT_SIZE", "100"))
+# State row with the users the close was already announced to
+ANNOUNCEMENTS_ID = 'CLOSE_ANNOUNCEMENTS'
+
+def get_verified_users():
+    """
+    Gets the phone numbers of the users that can take part in the auction
+
+    Returns:
+        list: Phone numbers of the verified users
+    """
+    from boto3.dynamodb.conditions import Attr
+    scan_kwargs = {
+        'FilterExpression': Attr('verified').eq(True),
+        'ProjectionExpression': 'phone'
+    }
+    phones = []
+    while True:
+        with span('dynamodb.scan_verified_users'):
+            response = get_table(USER_TABLE).scan(**scan_kwargs)
+        phones.extend(item['phone'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return phones
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def freeze_auction():
+    """
+    Closes the HIGHEST_BID state row, so no bid can be committed afterwards
+
+    Returns:
+        dict: State row at the close. If the auction was already closed, the current row
+    """
+    try:
+        with span('dynamodb.freeze_auction'):
+            return get_table(STATE_TABLE).update_item(
+                Key={'id': 'HIGHEST_BID'},
+                UpdateExpression="SET #closed = :closed",
+                ConditionExpression="attribute_not_exists(#closed)",
+                ExpressionAttributeNames={'#closed': 'closed'},
+                ExpressionAttributeValues={':closed': int(time.time())},
+                ReturnValues="ALL_NEW"
+            )['Attributes']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    logger.info("Auction already closed, resuming the announcements.")
+    with span('dynamodb.read_state'):
+        return get_table(STATE_TABLE).get_item(Key={'id': 'HIGHEST_BID'}, ConsistentRead=True)['Item']
+
+def get_announced_users():
+    """
+    Gets the users the close was already announced to, by a previous run
+
+    Returns:
+        set: Phone numbers of the users
+    """
+    with span('dynamodb.read_announcements'):
+        item = get_table(STATE_TABLE).get_item(Key={'id': ANNOUNCEMENTS_ID}, ConsistentRead=True).get('Item') or {}
+    return set(item.get('phones', set()))
+
+def record_announced_users(phones):
+    # Checkpoint: a run that fails afterwards does not announce the close to them again
+    with span('dynamodb.record_announcements'):
+        get_table(STATE_TABLE).update_item(
+            Key={'id': ANNOUNCEMENTS_ID},
+            UpdateExpression="ADD #phones :phones",
+            ExpressionAttributeNames={'#phones': 'phones'},
+            ExpressionAttributeValues={':phones': set(phones)}
+        )
+
+def close_auction(wait=True):
+    """
+    Closes the auction at FINAL_HOUR and announces the result to every verified user.
+
+    The users are loaded before the deadline, so the close can be scheduled a little
+    earlier to announce the winner within seconds of FINAL_HOUR. The announced users
+    are recorded as they are sent, so running it again after a failed or timed out
+    run only announces the close to the rest, and does nothing once all were announced.
+
+    Args:
+        wait (bool, optional): Sleep until FINAL_HOUR if it has not been reached
+
+    Returns:
+        dict: Winner, amount and number of announcements sent and failed, or None
+            if the close was already announced
+    """
+    users = get_verified_users()
+    remaining = (FINAL_HOUR - datetime.now(timezone.utc)).total_seconds()
+    if remaining > 0:
+        if not wait:
+            logger.info(f"Auction not closed, {remaining:.0f} seconds left.")
+            return None
+        time.sleep(remaining)
+
+    state = freeze_auction()
+    if state.get('announced') is not None:
+        logger.info("Auction close already announced.")
+        return None
+
+    # The winner is the highest bid, also the first of the ranking. None if there were no bids
+    winner = state.get('phone')
+    display_amount = format_as_money(state.get('amount', 0)) if winner else None
+    if winner:
+        logger.info(f"Auction closed. Winner: {winner} with {display_amount}.")
+    else:
+        logger.info("Auction closed without bids.")
+
+    announced = get_announced_users()
+    pending = [phone for phone in users if phone not in announced]
+    if announced:
+        logger.info(f"Close already announced to {len(announced)} users, {len(pending)} left.")
+
+    limiter = RateLimiter(NOTIFICATION_RATE_LIMIT)
+
+    def announce(phone):
+        limiter.wait()
+        if not winner:
+            return send_whatsapp_template(
+                phone_number=phone,
+                template_name=CLOSE_NO_BIDS_TEMPLATE,
+                template_language=CLOSE_TEMPLATE_LANGUAGE
+            )
+        return send_whatsapp_template(
+            phone_number=phone,
+            template_name=CLOSE_WINNER_TEMPLATE if phone == winner else CLOSE_LOSER_TEMPLATE,
+            template_language=CLOSE_TEMPLATE_LANGUAGE,
+            template_params=[display_amount]
+        )
+
+    sent = 0
+    failed = 0
+    # Every announcement runs in a copy of the invocation context so it is measured
+    with ThreadPoolExecutor(max_workers=NOTIFICATION_CONCURRENCY) as executor:
+        for start in range(0, len(pending), CLOSE_CHECKPOINT_SIZE):
+            chunk = pending[start:start + CLOSE_CHECKPOINT_SIZE]
+            futures = [executor.submit(contextvars.copy_context().run, announce, phone) for phone in chunk]
+            delivered = [phone for phone, future in zip(chunk, futures) if future.result()]
+            if delivered:
+                record_announced_users(delivered)
+            sent += len(delivered)
+            failed += len(chunk) - len(delivered)
+
+    summary = {
+        'winner': winner,
+        'amount': display_amount,
+        'sent': sent,
+        'failed': failed,
+        'already_announced': len(announced)
+    }
+    # The close is only marked as announced when every user got it, so a new run retries the failures
+    names = {'#winner': 'winner', '#failed': 'announce_failed'}
+    values = {':winner': winner, ':failed': failed}
+    update = "SET #winner = :winner, #failed = :failed"
+    if not failed:
+        names['#announced'] = 'announced'
+        values[':announced'] = len(announced) + sent
+        update += ", #announced = :announced"
+    with span('dynamodb.record_close'):
+        get_table(STATE_TABLE).update_item(
+            Key={'id': 'HIGHEST_BID'},
+            UpdateExpression=update,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    logger.info(f"Auction close summary: {summary}")
+    return summary
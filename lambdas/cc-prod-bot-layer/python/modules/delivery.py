@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from botocore.exceptions import ClientError
+from modules.clients import get_dynamodb, get_table, MESSAGE_TABLE, STATE_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Sent messages are tracked unless disabled
+DELIVERY_TRACKING = os.environ.get("DELIVERY_TRACKING", "true").lower() == "true"
+# Seconds a sent message is remembered to correlate its statuses (DynamoDB TTL)
+DELIVERY_TTL = int(os.environ.get("DELIVERY_TTL", "172800"))
+# Upper bounds, in seconds, of the latency histogram buckets
+DELIVERY_BUCKETS = [int(bound) for bound in os.environ.get("DELIVERY_BUCKETS", "1,2,5,10,30,60,300").split(",")]
+
+# State table item with the latency histograms
+DELIVERY_STATS = 'DELIVERY_STATS'
+STATUSES = ('sent', 'delivered', 'read', 'failed')
+
+# Maximum number of items of a BatchWriteItem request
+BATCH_WRITE_LIMIT = 25
+
+# Sent messages not written yet. They are written in batches, not one by one on the send
+# path, and only by the invocation thread: the short-lived threads of a fan-out would
+# each build their own boto3 session and DynamoDB resource to write them
+pending_sent = []
+pending_sent_lock = threading.Lock()
+
+def record_sent(message_id, kind):
+    """
+    Remembers when a message was accepted by the Graph API. The record is buffered
+    and written with the next full batch of the invocation thread or by flush_sent
+
+    Args:
+        message_id (str): WhatsApp message id (wamid) returned by the Graph API
+        kind (str): Kind of message, e.g. 'message' or 'template'
+    """
+    if not DELIVERY_TRACKING or not message_id:
+        return
+    now = time.time()
+    with pending_sent_lock:
+        pending_sent.append({
+            'id': f"sent#{message_id}",
+            'kind': kind,
+            'sent_at': int(now * 1000),
+            'expires_at': int(now) + DELIVERY_TTL
+        })
+        if len(pending_sent) < BATCH_WRITE_LIMIT:
+            return
+    if threading.current_thread() is threading.main_thread():
+        flush_sent()
+
+def flush_sent():
+    """
+    Writes the sent messages still buffered. Called at the end of each invocation
+    """
+    with pending_sent_lock:
+        batch = pending_sent[:]
+        pending_sent.clear()
+    for start in range(0, len(batch), BATCH_WRITE_LIMIT):
+        write_sent(batch[start:start + BATCH_WRITE_LIMIT])
+
+def write_sent(items):
+    # Tracking never fails a send: every error is logged and the records are dropped
+    request_items = {MESSAGE_TABLE: [{'PutRequest': {'Item': item}} for item in items]}
+    try:
+        for attempt in range(3):
+            with span('dynamodb.record_sent'):
+                response = get_dynamodb().batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                return
+        logger.error(f"Sent messages not recorded: {len(request_items.get(MESSAGE_TABLE, []))}")
+    except Exception as e:
+        logger.error(f"Error recording {len(items)} sent messages: {str(e)}")
+
+def bucket_of(latency_ms):
+    for bound in DELIVERY_BUCKETS:
+        if latency_ms <= bound * 1000:
+            return f"le_{bound}"
+    return "le_inf"
+
+def record_statuses(statuses):
+    """
+    Adds the latency from send to each status of the webhook to the histograms of
+    its kind of message. Statuses of unknown messages and repeated statuses are ignored
+
+    Args:
+        statuses (list): 'statuses' entries of a WhatsApp webhook
+    """
+    if not DELIVERY_TRACKING:
+        return
+    increments = Counter()
+    lags = {}
+    for status in statuses:
+        name = status.get('status')
+        if name not in STATUSES or not status.get('id'):
+            continue
+        status_at = int(status.get('timestamp') or time.time()) * 1000
+        try:
+            # Marks the status on the sent message, only the first time it is received
+            with span('dynamodb.record_status'):
+                item = get_table(MESSAGE_TABLE).update_item(
+                    Key={'id': f"sent#{status['id']}"},
+                    UpdateExpression="SET #status_at = :status_at",
+                    ConditionExpression="attribute_exists(sent_at) AND attribute_not_exists(#status_at)",
+                    ExpressionAttributeNames={'#status_at': f"{name}_at"},
+                    ExpressionAttributeValues={':status_at': status_at},
+                    ReturnValues="ALL_NEW"
+                )['Attributes']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(f"Error recording status of {status['id']}: {str(e)}")
+            continue
+        latency_ms = max(0, status_at - int(item['sent_at']))
+        prefix = f"{item.get('kind', 'message')}_{name}"
+        increments[f"{prefix}_{bucket_of(latency_ms)}"] += 1
+        increments[f"{prefix}_count"] += 1
+        increments[f"{prefix}_total_ms"] += latency_ms
+        lags[f"{prefix}_last_ms"] = latency_ms
+        logger.debug("Message %s %s after %s ms", status['id'], name, latency_ms)
+
+    if increments:
+        update_histograms(increments, lags)
+
+def update_histograms(increments, lags):
+    # A single write per webhook, whatever the number of statuses it brings
+    names = {}
+    values = {}
+    for index, (attribute, total) in enumerate(increments.items()):
+        names[f"#i{index}"] = attribute
+        values[f":i{index}"] = total
+    for index, (attribute, lag) in enumerate(lags.items()):
+        names[f"#l{index}"] = attribute
+        values[f":l{index}"] = lag
+    values[':updated_at'] = int(time.time() * 1000)
+    update = "ADD " + ", ".join(f"#i{index} :i{index}" for index in range(len(increments)))
+    update += " SET " + ", ".join([f"#l{index} = :l{index}" for index in range(len(lags))] + ["updated_at = :updated_at"])
+    try:
+        with span('dynamodb.update_histograms'):
+            get_table(STATE_TABLE).update_item(
+                Key={'id': DELIVERY_STATS},
+                UpdateExpression=update,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+    except ClientError as e:
+        logger.error(f"Error updating delivery histograms: {str(e)}")
+
+def get_delivery_stats():
+    """
+    Gets the delivery latency histograms, e.g. to follow the notification lag live
+
+    Returns:
+        dict: By kind and status ('template_delivered', ...), the count, the mean and
+            last latency in milliseconds and the count of each bucket
+    """
+    with span('dynamodb.read_state'):
+        item = get_table(STATE_TABLE).get_item(Key={'id': DELIVERY_STATS}, ConsistentRead=True).get('Item') or {}
+    stats = {}
+    for kind in ('message', 'template'):
+        for name in STATUSES:
+            prefix = f"{kind}_{name}"
+            count = int(item.get(f"{prefix}_count", 0))
+            if not count:
+                continue
+            stats[prefix] = {
+                'count': count,
+                'mean_ms': round(int(item.get(f"{prefix}_total_ms", 0)) / count),
+                'last_ms': int(item.get(f"{prefix}_last_ms", 0)),
+                'buckets': {
+                    bucket: int(item.get(f"{prefix}_{bucket}", 0))
+                    for bucket in [f"le_{bound}" for bound in DELIVERY_BUCKETS] + ["le_inf"]
+                }
+            }
+    return stats
@@ -0,0 +1,171 @@
+import base64
+import binascii
+import logging
+import os
+from botocore.exceptions import ClientError
+from modules.whatsapp import MessageTemplate, send_message_template
+from modules.scheduler import enqueue, job_handler
+from modules.media import stream_media_to_s3
+from modules.clients import get_client, get_table, USER_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+TERMS_AND_CONDITIONS = os.environ.get("TERMS_AND_CONDITIONS")
+
+# Queue of the ingestion jobs, so they can be consumed with their own concurrency.
+# Defaults to the scheduler queue
+INGEST_QUEUE_URL = os.environ.get("INGEST_QUEUE_URL")
+# Attempts to copy a document and seconds before the first retry (doubled on each one)
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_RETRY_DELAY = int(os.environ.get("INGEST_RETRY_DELAY", "30"))
+
+# Catálogo de mensajes, precompilados al importar el módulo
+DOCUMENT_DOWNLOAD_FAILED = MessageTemplate("No se pudo obtener el archivo. Por favor, intente nuevamente.")
+DOCUMENT_RECEIVED = MessageTemplate("El documento ha sido recibido y se está procesando. Le notificaremos cuando esté listo para participar en la subasta.")
+DOCUMENT_DUPLICATE = MessageTemplate(
+    "Este documento ya había sido recibido. Si necesita enviar una versión corregida, "
+    "por favor adjúntela como un único archivo PDF."
+)
+
+def document_hash(document):
+    """
+    Gets the SHA-256 declared by WhatsApp for a document, as lowercase hex
+
+    Args:
+        document (dict): 'document' object of the WhatsApp message
+
+    Returns:
+        str: Hex SHA-256 of the file, or None if it is missing or invalid
+    """
+    declared = (document.get('sha256') or '').strip()
+    if len(declared) == 64:
+        try:
+            bytes.fromhex(declared)
+            return declared.lower()
+        except ValueError:
+            pass
+    # The Cloud API sends it base64 encoded
+    try:
+        digest = base64.b64decode(declared, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest.hex() if len(digest) == 32 else None
+
+def is_duplicate(user, document):
+    """
+    Checks, before downloading it, whether a user already sent a document
+
+    Args:
+        user (dict): User item
+        document (dict): 'document' object of the WhatsApp message
+
+    Returns:
+        bool: True if the declared hash is one of the user's documents
+    """
+    sha256 = document_hash(document)
+    return bool(sha256) and sha256 in (user or {}).get('document_hashes', set())
+
+def queue_document(phone, timestamp, document):
+    """
+    Schedules the ingestion of a terms and conditions document sent by a user
+
+    Args:
+        phone (str): Phone number of the user
+        timestamp (str): Timestamp of the WhatsApp message
+        document (dict): 'document' object of the WhatsApp message
+    """
+    enqueue('ingest_document', {
+        'phone': phone,
+        'timestamp': timestamp,
+        'document': {'id': document['id'], 'mime_type': document['mime_type'], 'sha256': document_hash(document)},
+        'attempt': 1
+    }, queue_url=INGEST_QUEUE_URL)
+
+@job_handler('ingest_document')
+def ingest_document(payload):
+    # Copia el archivo de WhatsApp a S3 sin cargarlo completo en memoria. Los documentos
+    # se guardan por contenido (terms_documents/<phone>/<sha256>.pdf), así un reenvío
+    # del mismo archivo no crea otro objeto. El hash declarado por el cliente no se usa
+    # para la clave: el archivo se copia a una clave temporal y solo se mueve a la de su
+    # contenido con el hash calculado, sin sobrescribir nunca un documento anterior
+    phone = payload['phone']
+    document = payload['document']
+    declared = document.get('sha256')
+    bucket_name, key = TERMS_AND_CONDITIONS.replace("s3://", "").split("/", 1)
+    incoming_key = content_key(phone, f"incoming-{payload['timestamp']}-{document['id']}")
+    uploaded = stream_media_to_s3(
+        document["id"],
+        bucket_name,
+        incoming_key,
+        content_type=document["mime_type"],
+        metadata={
+            'phone': phone,
+            'timestamp': payload['timestamp']
+        }
+    )
+    if not uploaded:
+        attempt = payload.get('attempt', 1)
+        if attempt < INGEST_MAX_ATTEMPTS:
+            logger.info(f"Document {document['id']} not copied, retrying (attempt {attempt})")
+            enqueue('ingest_document', {**payload, 'attempt': attempt + 1},
+                    delay=INGEST_RETRY_DELAY * 2 ** (attempt - 1), queue_url=INGEST_QUEUE_URL)
+            return
+        send_message_template(phone, DOCUMENT_DOWNLOAD_FAILED)
+        return
+
+    sha256 = uploaded['sha256']
+    if declared and sha256 != declared:
+        logger.warning(f"Document {document['id']} declared sha256 {declared} but is {sha256}")
+    s3_key = move_object(bucket_name, incoming_key, content_key(phone, sha256))
+    logger.info(f"File uploaded to S3: s3://{bucket_name}/{s3_key} ({uploaded['size']} bytes, sha256 {sha256})")
+
+    try:
+        with span('dynamodb.append_document'):
+            get_table(USER_TABLE).update_item(
+                Key={
+                    'phone': phone
+                },
+                UpdateExpression="SET terms_document = list_append(if_not_exists(terms_document, :empty_list), :i) ADD document_hashes :hashes",
+                ConditionExpression="attribute_not_exists(document_hashes) OR NOT contains(document_hashes, :sha256)",
+                ExpressionAttributeValues={
+                    ':i': [f"s3://{bucket_name}/{s3_key}"],
+                    ':empty_list': [],
+                    ':hashes': {sha256},
+                    ':sha256': sha256
+                }
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Mismo contenido que un documento anterior: el objeto es idéntico y la lista no crece
+        logger.info(f"Duplicate document {sha256} from {phone}")
+        send_message_template(phone, DOCUMENT_DUPLICATE)
+        return
+    send_message_template(phone, DOCUMENT_RECEIVED)
+
+def content_key(phone, name):
+    return "terms_documents/" + phone + "/" + name + ".pdf"
+
+def move_object(bucket, source, destination):
+    # The destination is named by its content: if it already exists it is the same file
+    s3 = get_client('s3')
+    if not object_exists(bucket, destination):
+        with span('s3.copy_object'):
+            s3.copy_object(Bucket=bucket, Key=destination, CopySource={'Bucket': bucket, 'Key': source}, MetadataDirective='COPY')
+    with span('s3.delete_object'):
+        s3.delete_object(Bucket=bucket, Key=source)
+    return destination
+
+def object_exists(bucket, key):
+    try:
+        with span('s3.head_object'):
+            get_client('s3').head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        return False
@@ -0,0 +1,125 @@
+import logging
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Comodín para estados o eventos: aplica cuando no hay una transición más específica
+ANY = '*'
+# Target of the transitions that leave the user in the same state
+STAY = object()
+
+def get_event(message):
+    """
+    Gets the event of a WhatsApp message
+
+    Args:
+        message (dict): WhatsApp message
+
+    Returns:
+        str: ID of the pressed button, or the type of the message ('text', 'document', ...)
+    """
+    button_id = (message.get('interactive') or {}).get('button_reply', {}).get('id')
+    return button_id or message.get('type')
+
+class Turn:
+    """
+    A message being handled, with everything the guards and actions of its
+    transition need. Extra values (e.g. the highest offer) are set as attributes
+    """
+
+    def __init__(self, message, user, changes=None, **values):
+        self.message = message
+        self.user = user
+        self.phone = message.get('from')
+        self.changes = changes
+        self.__dict__.update(values)
+
+class StateMachine:
+    """
+    Declarative conversation flow. Transitions are registered with `on` as
+    (state, event) -> guard, action, target and compiled into a lookup table, so a
+    message is dispatched with two dict lookups whatever the number of states.
+
+    The target state is not written by the machine: it is added to the turn's
+    UserUpdate, and written together with the rest of the turn's changes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.transitions = []
+        self.table = None
+
+    def on(self, states, events=ANY, guard=None, target=STAY):
+        """
+        Registers the decorated function as the action of a transition. Transitions of
+        the same state and event are tried in the order they are registered, and the
+        first one whose guard passes is taken. An action that returns False cancels
+        the change of state.
+
+        Args:
+            states (str|tuple): State or states the transition leaves, or ANY
+            events (str|tuple, optional): Event or events that trigger it, or ANY
+            guard (callable, optional): Condition on the turn for the transition
+            target (str, optional): State the user is left in. None clears the status
+
+        Returns:
+            callable: Decorator that registers the action
+        """
+        states = states if isinstance(states, tuple) else (states,)
+        events = events if isinstance(events, tuple) else (events,)
+
+        def register(action):
+            for state in states:
+                for event in events:
+                    self.transitions.append((state, event, guard, action, target))
+            self.table = None
+            return action
+        return register
+
+    def compile(self):
+        # state -> event -> handlers. The handlers of ANY event are appended to every
+        # event of the state, so a failed guard falls back to them without another lookup
+        table = {}
+        for state, event, guard, action, target in self.transitions:
+            table.setdefault(state, {}).setdefault(event, []).append((guard, action, target))
+        for events in table.values():
+            fallback = events.get(ANY, [])
+            for event, handlers in events.items():
+                if event != ANY:
+                    handlers.extend(fallback)
+        self.table = {
+            state: {event: tuple(handlers) for event, handlers in events.items()}
+            for state, events in table.items()
+        }
+        return self
+
+    def dispatch(self, state, event, turn):
+        """
+        Takes the transition of the state for the event
+
+        Args:
+            state (str): Current state of the user
+            event (str): Event of the message, see get_event
+            turn (Turn): Message being handled
+
+        Returns:
+            bool: True if a transition was taken
+        """
+        if self.table is None:
+            self.compile()
+        # Un estado sin transiciones propias usa las del estado comodín
+        events = self.table.get(state) or self.table.get(ANY, {})
+        handlers = events.get(event) or events.get(ANY, ())
+        for guard, action, target in handlers:
+            if guard is not None and not guard(turn):
+                continue
+            logger.debug("%s: %s --%s--> %s (%s)", self.name, state, event, target, action.__name__)
+            if action(turn) is not False and target is not STAY and target != state:
+                if turn.changes is None:
+                    raise ValueError(f"{self.name}: transition to {target} without a UserUpdate in the turn")
+                turn.changes.set(status=target)
+            return True
+        logger.debug("%s: no transition from %s for %s", self.name, state, event)
+        return False
@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from modules.clients import get_table, MESSAGE_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Seconds a processed message id is remembered (DynamoDB TTL on "expires_at")
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", "86400"))
+# Seconds a message id is claimed while it is processed. About the function timeout:
+# if the invocation times out or crashes, the retry of the message is processed
+# once the claim expires
+IDEMPOTENCY_CLAIM_TTL = int(os.environ.get("IDEMPOTENCY_CLAIM_TTL", "60"))
+# Message ids remembered by each warm container
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "1024"))
+
+# In-process LRU of claimed message ids and their expiration, shared by the sender threads
+recent_messages = OrderedDict()
+recent_messages_lock = threading.Lock()
+
+def remember(message_id, expires_at):
+    with recent_messages_lock:
+        recent_messages[message_id] = expires_at
+        recent_messages.move_to_end(message_id)
+        while len(recent_messages) > IDEMPOTENCY_CACHE_SIZE:
+            recent_messages.popitem(last=False)
+
+def recall(message_id, now):
+    # Expiration of a message id claimed recently by this container, if it has not expired
+    with recent_messages_lock:
+        expires_at = recent_messages.get(message_id)
+        if not expires_at or expires_at <= now:
+            return None
+        recent_messages.move_to_end(message_id)
+        return expires_at
+
+def claim_message(message_id):
+    """
+    Claims a WhatsApp message id so that it is processed only once. The claim only
+    lasts IDEMPOTENCY_CLAIM_TTL seconds: complete_message keeps it for the full
+    IDEMPOTENCY_TTL once the message has been processed
+
+    Args:
+        message_id (str): Id of the incoming WhatsApp message
+
+    Returns:
+        bool: True if the message was not processed before, False if it is a retry
+    """
+    now = int(time.time())
+    if recall(message_id, now):
+        logger.info(f"Duplicate message ignored (cache): {message_id}")
+        return False
+
+    expires_at = now + IDEMPOTENCY_CLAIM_TTL
+    try:
+        with span('dynamodb.claim_message'):
+            get_table(MESSAGE_TABLE).put_item(
+                Item={
+                    'id': message_id,
+                    'status': 'in_progress',
+                    'expires_at': expires_at
+                },
+                ConditionExpression="attribute_not_exists(id) OR expires_at < :now",
+                ExpressionAttributeValues={':now': now}
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # It may still be in progress elsewhere, so it is only remembered as long as a claim
+        remember(message_id, expires_at)
+        logger.info(f"Duplicate message ignored: {message_id}")
+        return False
+    remember(message_id, expires_at)
+    return True
+
+def complete_message(message_id):
+    """
+    Marks a claimed message id as processed, so that it is remembered for the full
+    IDEMPOTENCY_TTL
+
+    Args:
+        message_id (str): Id of the incoming WhatsApp message
+    """
+    expires_at = int(time.time()) + IDEMPOTENCY_TTL
+    remember(message_id, expires_at)
+    try:
+        with span('dynamodb.complete_message'):
+            get_table(MESSAGE_TABLE).update_item(
+                Key={'id': message_id},
+                UpdateExpression="SET #status = :done, expires_at = :expires_at",
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':done': 'done', ':expires_at': expires_at}
+            )
+    except ClientError as e:
+        # The message was processed: a retry after the claim expires is the only risk
+        logger.error(f"Error completing message {message_id}: {str(e)}")
+
+def release_message(message_id):
+    """
+    Releases a claimed message id so that a retry of the webhook processes it again
+
+    Args:
+        message_id (str): Id of the incoming WhatsApp message
+    """
+    with recent_messages_lock:
+        recent_messages.pop(message_id, None)
+    try:
+        get_table(MESSAGE_TABLE).delete_item(Key={'id': message_id})
+    except ClientError as e:
+        logger.error(f"Error releasing message {message_id}: {str(e)}")
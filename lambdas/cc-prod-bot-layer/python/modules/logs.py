@@ -0,0 +1,140 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+
+# Logging settings, configured independently on every Lambda through its environment
+# Level of the root logger, e.g. "DEBUG", "INFO" or "WARNING"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Fraction of invocations whose event and payloads are logged in full
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+# "text" (default) or "json" for one JSON object per log line
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# Phone numbers are masked in every log line unless disabled
+LOG_REDACT_PHONES = os.environ.get("LOG_REDACT_PHONES", "true").lower() == "true"
+
+# Colombian mobile numbers with country code, as sent by WhatsApp (e.g. 573001234567)
+PHONE_PATTERN = re.compile(os.environ.get("LOG_PHONE_PATTERN", r"(?<!\d)\+?57\d{10}(?!\d)"))
+# Fields of events, payloads and items that always hold a phone number
+PHONE_FIELDS = {'phone', 'from', 'to', 'wa_id', 'input', 'recipient_id', 'phone_number'}
+
+# Whether the current invocation was sampled for full dumps
+sampled = contextvars.ContextVar('sampled', default=False)
+
+def mask_phone(phone):
+    phone = str(phone)
+    return '*' * max(len(phone) - 4, 0) + phone[-4:]
+
+def redact(text):
+    """
+    Masks the phone numbers of a text, keeping their last four digits
+
+    Args:
+        text (str): Text to redact
+
+    Returns:
+        str: Text without phone numbers
+    """
+    if not LOG_REDACT_PHONES:
+        return text
+    return PHONE_PATTERN.sub(lambda match: mask_phone(match.group(0)), text)
+
+def redact_fields(value):
+    if isinstance(value, dict):
+        return {
+            key: mask_phone(item) if key in PHONE_FIELDS and isinstance(item, (str, int)) else redact_fields(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact_fields(item) for item in value]
+    return value
+
+class Dump:
+    """
+    Log argument serialized to JSON only if the record is actually emitted
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        value = self.value
+        if isinstance(value, bytes):
+            # Payload ya serializado
+            value = json.loads(value)
+        if LOG_REDACT_PHONES:
+            value = redact_fields(value)
+        return json.dumps(value, default=str, ensure_ascii=False)
+
+def dump(value):
+    """
+    Wraps a value to be logged as JSON, e.g. logger.debug("Payload: %s", dump(payload))
+
+    Args:
+        value: JSON serializable value (Decimal and datetime are converted with str),
+            or an already serialized JSON document in bytes
+
+    Returns:
+        Dump: Lazy representation of the value
+    """
+    return Dump(value)
+
+def sample_invocation():
+    """
+    Decides whether the current invocation logs its event and payloads in full
+    """
+    sampled.set(random.random() < LOG_SAMPLE_RATE)
+
+def is_sampled():
+    return sampled.get()
+
+def log_sampled(logger, description, value):
+    """
+    Logs a value in full only if the invocation was sampled or DEBUG is enabled
+
+    Args:
+        logger (logging.Logger): Logger of the caller
+        description (str): Description of the value, e.g. "Event received"
+        value: JSON serializable value, e.g. the event of the Lambda
+    """
+    if is_sampled():
+        logger.info("%s (sampled): %s", description, dump(value))
+    else:
+        logger.debug("%s: %s", description, dump(value))
+
+class RedactionFilter(logging.Filter):
+    def filter(self, record):
+        if LOG_REDACT_PHONES:
+            record.msg = redact(record.getMessage())
+            record.args = None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+            'timestamp': self.formatTime(record),
+        }
+        request_id = getattr(record, 'aws_request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        if record.exc_info:
+            entry['exception'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, ensure_ascii=False)
+
+def configure_logging():
+    """
+    Applies the redaction filter and the format of LOG_FORMAT to the handlers of the
+    root logger. Safe to call on every cold start, handlers are only configured once
+    """
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in root.handlers:
+        if not any(isinstance(f, RedactionFilter) for f in handler.filters):
+            handler.addFilter(RedactionFilter())
+        if LOG_FORMAT == "json" and not isinstance(handler.formatter, JsonFormatter):
+            handler.setFormatter(JsonFormatter())
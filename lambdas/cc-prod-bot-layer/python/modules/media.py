@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from modules.whatsapp import get_media_url, get_session, upload_media, TIMEOUT
+from modules.clients import get_client, get_table, STATE_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Largest media file accepted, in bytes
+MEDIA_MAX_BYTES = int(os.environ.get("MEDIA_MAX_BYTES", str(50 * 1024 * 1024)))
+# Bytes buffered before each part is uploaded (S3 requires at least 5 MiB per part)
+MEDIA_PART_SIZE = max(int(os.environ.get("MEDIA_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+# Bytes read from the Graph API at a time
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+# Seconds an uploaded media id is reused. WhatsApp keeps uploaded media for 30 days,
+# so it is uploaded again a few days before
+MEDIA_ID_TTL = int(os.environ.get("MEDIA_ID_TTL", str(25 * 24 * 3600)))
+
+# Seconds between checks of the ETag of a static attachment, so a file replaced in S3
+# stops being sent after at most this time
+MEDIA_CHECK_INTERVAL = int(os.environ.get("MEDIA_CHECK_INTERVAL", "300"))
+# Seconds without retrying the upload of a static attachment after a failure
+MEDIA_FAILURE_BACKOFF = int(os.environ.get("MEDIA_FAILURE_BACKOFF", "60"))
+
+# Media ids known by this container, by S3 URL: (media_id, etag, expires_at, checked_at)
+media_ids = {}
+# End of the failure backoff of each S3 URL
+media_failures = {}
+# Serializes the cache misses, so concurrent threads upload a file only once
+media_lock = threading.Lock()
+
+class MultipartUpload:
+    """
+    S3 upload fed part by part. The multipart upload is only created when the first
+    part is full, so files smaller than a part are uploaded with a single put_object
+    """
+
+    def __init__(self, bucket, key, extra_args):
+        self.bucket = bucket
+        self.key = key
+        self.extra_args = extra_args
+        self.upload_id = None
+        self.parts = []
+
+    def upload_part(self, data):
+        s3 = get_client('s3')
+        if self.upload_id is None:
+            with span('s3.create_multipart_upload'):
+                self.upload_id = s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.extra_args)['UploadId']
+        part_number = len(self.parts) + 1
+        with span('s3.upload_part'):
+            response = s3.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+            )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def complete(self, data):
+        s3 = get_client('s3')
+        if self.upload_id is None:
+            with span('s3.put_object'):
+                s3.put_object(Bucket=self.bucket, Key=self.key, Body=data, **self.extra_args)
+            return
+        if data:
+            self.upload_part(data)
+        with span('s3.complete_multipart_upload'):
+            s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+            )
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+        try:
+            get_client('s3').abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.error(f"Error aborting upload of s3://{self.bucket}/{self.key}: {str(e)}")
+
+def stream_media_to_s3(media_id, bucket, key, content_type, metadata=None):
+    """
+    Copies a WhatsApp media file to S3 without holding it in memory. At most one part
+    (MEDIA_PART_SIZE) is buffered, and the SHA-256 is computed while it is copied
+
+    Args:
+        media_id (str): ID of the media file
+        bucket (str): Destination bucket
+        key (str): Destination key
+        content_type (str): MIME type of the file
+        metadata (dict, optional): S3 metadata of the object
+
+    Returns:
+        dict: 'size' in bytes and hex 'sha256' of the file, or None if it could not
+            be copied or is larger than MEDIA_MAX_BYTES
+    """
+    media_url = get_media_url(media_id)
+    if not media_url:
+        return None
+
+    headers = {"Authorization": f"Bearer {os.environ.get('WHATSAPP_ACCESS_TOKEN')}"}
+    upload = MultipartUpload(bucket, key, {'ContentType': content_type, 'Metadata': metadata or {}})
+    try:
+        with span('graph.download_media'):
+            response = get_session().get(media_url, headers=headers, timeout=TIMEOUT, stream=True)
+        with response:
+            if response.status_code != 200:
+                logger.error(f"Error downloading media {media_id}. Code: {response.status_code}")
+                return None
+            # Rechaza el archivo antes de descargarlo si declara un tamaño mayor al permitido
+            declared = int(response.headers.get('Content-Length') or 0)
+            if declared > MEDIA_MAX_BYTES:
+                logger.warning(f"Media {media_id} rejected: {declared} bytes, the limit is {MEDIA_MAX_BYTES}")
+                return None
+
+            digest = hashlib.sha256()
+            buffer = bytearray()
+            size = 0
+            for chunk in response.iter_content(chunk_size=MEDIA_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MEDIA_MAX_BYTES:
+                    logger.warning(f"Media {media_id} rejected: more than {MEDIA_MAX_BYTES} bytes")
+                    upload.abort()
+                    return None
+                digest.update(chunk)
+                buffer += chunk
+                if len(buffer) >= MEDIA_PART_SIZE:
+                    upload.upload_part(bytes(buffer))
+                    buffer.clear()
+            upload.complete(bytes(buffer))
+    except Exception as e:
+        logger.error(f"Exception copying media {media_id} to S3: {str(e)}")
+        upload.abort()
+        return None
+    return {'size': size, 'sha256': digest.hexdigest()}
+
+def get_static_media_id(s3_url, filename, mime_type='application/pdf'):
+    """
+    Gets the WhatsApp media id of a static attachment stored in S3, uploading it
+    only when there is no valid id for its current version. The id is kept in the
+    state table (MEDIA#<url>#<etag>) and in the container, so the file is not
+    fetched from S3 for every user. The ETag is checked every MEDIA_CHECK_INTERVAL
+    seconds, so a replaced file gets a new id
+
+    Args:
+        s3_url (str): s3://bucket/key of the file
+        filename (str): Name of the file
+        mime_type (str, optional): MIME type of the file
+
+    Returns:
+        str: Media id, or None if the file could not be uploaded
+    """
+    cached = cached_media_id(s3_url, time.time())
+    if cached is not False:
+        return cached
+    with media_lock:
+        # Another thread may have refreshed it while this one waited
+        now = time.time()
+        cached = cached_media_id(s3_url, now)
+        if cached is not False:
+            return cached
+        return refresh_static_media_id(s3_url, filename, mime_type, now)
+
+def cached_media_id(s3_url, now):
+    # Media id known by the container, None during a failure backoff or False if it must be checked
+    cached = media_ids.get(s3_url)
+    if cached and cached[2] > now and cached[3] + MEDIA_CHECK_INTERVAL > now:
+        return cached[0]
+    if media_failures.get(s3_url, 0) > now:
+        return None
+    return False
+
+def refresh_static_media_id(s3_url, filename, mime_type, now):
+    cached = media_ids.get(s3_url)
+    bucket, key = s3_url.replace("s3://", "").split("/", 1)
+    try:
+        with span('s3.head_object'):
+            etag = get_client('s3').head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    except Exception as e:
+        logger.error(f"Error reading {s3_url}: {str(e)}")
+        return media_failed(s3_url, now)
+    if cached and cached[1] == etag and cached[2] > now:
+        media_ids[s3_url] = (cached[0], etag, cached[2], now)
+        return cached[0]
+
+    item_id = f"MEDIA#{s3_url}#{etag}"
+    with span('dynamodb.read_media_id'):
+        item = get_table(STATE_TABLE).get_item(Key={'id': item_id}).get('Item')
+    if item and int(item['uploaded_at']) + MEDIA_ID_TTL > now:
+        media_ids[s3_url] = (item['media_id'], etag, int(item['uploaded_at']) + MEDIA_ID_TTL, now)
+        return item['media_id']
+
+    try:
+        with span('s3.get_object'):
+            response = get_client('s3').get_object(Bucket=bucket, Key=key, IfMatch=etag)
+            content = response['Body'].read()
+    except Exception as e:
+        logger.error(f"Error reading {s3_url}: {str(e)}")
+        return media_failed(s3_url, now)
+    media_id = upload_media(content, filename, mime_type)
+    if not media_id:
+        return media_failed(s3_url, now)
+    logger.info(f"Uploaded {s3_url} ({etag}) to WhatsApp as media {media_id}")
+    with span('dynamodb.write_media_id'):
+        get_table(STATE_TABLE).put_item(Item={'id': item_id, 'media_id': media_id, 'uploaded_at': int(now)})
+    media_ids[s3_url] = (media_id, etag, int(now) + MEDIA_ID_TTL, now)
+    media_failures.pop(s3_url, None)
+    return media_id
+
+def media_failed(s3_url, now):
+    # Durante la espera, los usuarios reciben el enlace en lugar de volver a subir el archivo
+    media_failures[s3_url] = now + MEDIA_FAILURE_BACKOFF
+    return None
@@ -0,0 +1,811 @@
+"""
+In-process backend of the layer: stand-ins for DynamoDB, SNS, S3, SQS and the
+WhatsApp Graph API, selected with BOT_BACKEND=memory (see modules.clients).
+
+The code of the Lambdas runs unchanged against them, deterministically and without
+AWS credentials, which is what the benchmarks and local profiling use. Every call is
+counted, and an optional latency per service simulates the network round trip.
+"""
+import copy
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+# Simulated latency per service, in seconds
+LATENCY = {
+    'dynamodb': 0.0,
+    'sns': 0.0,
+    's3': 0.0,
+    'sqs': 0.0,
+    'graph': 0.0,
+}
+
+# Key attributes of each table. Tables not listed use "id"
+TABLE_KEYS = {
+    'cc-prod-bot-user': ['phone'],
+}
+
+calls = Counter()
+calls_lock = threading.Lock()
+
+def record(service, operation):
+    with calls_lock:
+        calls[f"{service}.{operation}"] += 1
+    if LATENCY.get(service):
+        time.sleep(LATENCY[service])
+
+def client_error(code, operation, message="", **extra):
+    return ClientError({'Error': {'Code': code, 'Message': message}, **extra}, operation)
+
+# ---------------------------------------------------------------------------
+# DynamoDB expressions
+# ---------------------------------------------------------------------------
+
+TOKEN = re.compile(r"\s*(?:(?P<number>\d+)|(?P<name>#\w+)|(?P<value>:\w+)|(?P<op><>|<=|>=|=|<|>)|(?P<punct>[(),.\[\]+-])|(?P<word>[A-Za-z_]\w*))")
+MISSING = object()
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            raise client_error('ValidationException', 'Expression', f"Invalid expression: {expression}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+class Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, text):
+        kind, value = self.next()
+        if value != text and (kind != 'word' or value.upper() != text):
+            raise client_error('ValidationException', 'Expression', f"Expected {text}, got {value}")
+
+    def is_keyword(self, keyword, offset=0):
+        kind, value = self.peek(offset)
+        return kind == 'word' and value.upper() == keyword
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # Paths and operands
+
+    def path(self):
+        kind, value = self.next()
+        if kind == 'name':
+            components = [self.names[value]]
+        elif kind == 'word':
+            components = [value]
+        else:
+            raise client_error('ValidationException', 'Expression', f"Expected attribute, got {value}")
+        while True:
+            kind, value = self.peek()
+            if value == '.':
+                self.next()
+                kind, value = self.next()
+                components.append(self.names[value] if kind == 'name' else value)
+            elif value == '[':
+                self.next()
+                components.append(int(self.next()[1]))
+                self.expect(']')
+            else:
+                return components
+
+    def operand(self):
+        kind, value = self.peek()
+        if kind == 'value':
+            self.next()
+            return ('value', self.values[value])
+        if kind == 'word' and self.peek(1)[1] == '(':
+            function = value.lower()
+            self.next()
+            self.next()
+            arguments = [self.operand()]
+            while self.peek()[1] == ',':
+                self.next()
+                arguments.append(self.operand())
+            self.expect(')')
+            return ('function', function, arguments)
+        return ('path', self.path())
+
+    # Conditions
+
+    def condition(self):
+        left = self.conjunction()
+        while self.is_keyword('OR'):
+            self.next()
+            right = self.conjunction()
+            left = ('or', left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.is_keyword('AND'):
+            self.next()
+            right = self.negation()
+            left = ('and', left, right)
+        return left
+
+    def negation(self):
+        if self.is_keyword('NOT'):
+            self.next()
+            return ('not', self.negation())
+        if self.peek()[1] == '(':
+            self.next()
+            inner = self.condition()
+            self.expect(')')
+            return inner
+        left = self.operand()
+        kind, value = self.peek()
+        if kind == 'op':
+            self.next()
+            return ('compare', value, left, self.operand())
+        if self.is_keyword('BETWEEN'):
+            self.next()
+            low = self.operand()
+            self.expect('AND')
+            return ('between', left, low, self.operand())
+        if self.is_keyword('IN'):
+            self.next()
+            self.expect('(')
+            options = [self.operand()]
+            while self.peek()[1] == ',':
+                self.next()
+                options.append(self.operand())
+            self.expect(')')
+            return ('in', left, options)
+        return ('truthy', left)
+
+    # Update expressions
+
+    def update(self):
+        actions = []
+        while not self.done():
+            kind, clause = self.next()
+            clause = clause.upper()
+            while True:
+                if clause == 'SET':
+                    target = self.path()
+                    self.expect('=')
+                    value = self.operand()
+                    if self.peek()[1] in ('+', '-'):
+                        operator = self.next()[1]
+                        value = ('arithmetic', operator, value, self.operand())
+                    actions.append(('set', target, value))
+                elif clause == 'REMOVE':
+                    actions.append(('remove', self.path()))
+                elif clause in ('ADD', 'DELETE'):
+                    target = self.path()
+                    actions.append((clause.lower(), target, self.operand()))
+                else:
+                    raise client_error('ValidationException', 'UpdateItem', f"Invalid clause: {clause}")
+                if self.peek()[1] != ',':
+                    break
+                self.next()
+        return actions
+
+def resolve(item, components):
+    current = item
+    for component in components:
+        if isinstance(component, int):
+            if not isinstance(current, list) or component >= len(current):
+                return MISSING
+        elif not isinstance(current, dict) or component not in current:
+            return MISSING
+        current = current[component]
+    return current
+
+def evaluate(item, operand):
+    if operand[0] == 'value':
+        return operand[1]
+    if operand[0] == 'path':
+        return resolve(item, operand[1])
+    if operand[0] == 'arithmetic':
+        left, right = evaluate(item, operand[2]), evaluate(item, operand[3])
+        if left is MISSING or right is MISSING:
+            raise client_error('ValidationException', 'UpdateItem', "Operand of arithmetic does not exist")
+        return left + right if operand[1] == '+' else left - right
+    function, arguments = operand[1], operand[2]
+    if function == 'if_not_exists':
+        value = evaluate(item, arguments[0])
+        return evaluate(item, arguments[1]) if value is MISSING else value
+    if function == 'list_append':
+        return list(evaluate(item, arguments[0])) + list(evaluate(item, arguments[1]))
+    if function == 'size':
+        value = evaluate(item, arguments[0])
+        return MISSING if value is MISSING else Decimal(len(value))
+    raise client_error('ValidationException', 'Expression', f"Unsupported function: {function}")
+
+def comparable(left, right):
+    if isinstance(left, Decimal) and isinstance(right, Decimal):
+        return True
+    return type(left) is type(right) and left is not MISSING
+
+def test(item, node):
+    kind = node[0]
+    if kind == 'or':
+        return test(item, node[1]) or test(item, node[2])
+    if kind == 'and':
+        return test(item, node[1]) and test(item, node[2])
+    if kind == 'not':
+        return not test(item, node[1])
+    if kind == 'compare':
+        left, right = evaluate(item, node[2]), evaluate(item, node[3])
+        operator = node[1]
+        if operator == '=':
+            return left is not MISSING and left == right
+        if operator == '<>':
+            return left is MISSING or left != right
+        if not comparable(left, right):
+            return False
+        return {
+            '<': left < right,
+            '<=': left <= right,
+            '>': left > right,
+            '>=': left >= right,
+        }[operator]
+    if kind == 'between':
+        value, low, high = (evaluate(item, operand) for operand in node[1:])
+        return comparable(value, low) and comparable(value, high) and low <= value <= high
+    if kind == 'in':
+        value = evaluate(item, node[1])
+        return value is not MISSING and any(value == evaluate(item, option) for option in node[2])
+    if kind == 'truthy':
+        operand = node[1]
+        if operand[0] != 'function':
+            raise client_error('ValidationException', 'Expression', "Invalid condition")
+        function, arguments = operand[1], operand[2]
+        if function == 'attribute_exists':
+            return evaluate(item, arguments[0]) is not MISSING
+        if function == 'attribute_not_exists':
+            return evaluate(item, arguments[0]) is MISSING
+        if function == 'begins_with':
+            value = evaluate(item, arguments[0])
+            return isinstance(value, str) and value.startswith(evaluate(item, arguments[1]))
+        if function == 'contains':
+            value = evaluate(item, arguments[0])
+            return value is not MISSING and evaluate(item, arguments[1]) in value
+        raise client_error('ValidationException', 'Expression', f"Unsupported function: {function}")
+    raise client_error('ValidationException', 'Expression', f"Unsupported condition: {kind}")
+
+def assign(item, components, value):
+    parent = resolve(item, components[:-1]) if len(components) > 1 else item
+    if parent is MISSING:
+        raise client_error('ValidationException', 'UpdateItem', "The document path provided in the update expression is invalid for update")
+    last = components[-1]
+    if isinstance(last, int):
+        if last >= len(parent):
+            parent.append(value)
+        else:
+            parent[last] = value
+    else:
+        parent[last] = value
+
+def apply_update(item, actions):
+    for action in actions:
+        kind, target = action[0], action[1]
+        if kind == 'set':
+            assign(item, target, evaluate(item, action[2]))
+        elif kind == 'remove':
+            parent = resolve(item, target[:-1]) if len(target) > 1 else item
+            if parent is not MISSING:
+                if isinstance(target[-1], int):
+                    if target[-1] < len(parent):
+                        del parent[target[-1]]
+                else:
+                    parent.pop(target[-1], None)
+        elif kind == 'add':
+            current = resolve(item, target)
+            value = evaluate(item, action[2])
+            if isinstance(value, set):
+                assign(item, target, (set() if current is MISSING else set(current)) | value)
+            else:
+                assign(item, target, (Decimal(0) if current is MISSING else current) + value)
+        elif kind == 'delete':
+            current = resolve(item, target)
+            if current is not MISSING:
+                remaining = set(current) - evaluate(item, action[2])
+                if remaining:
+                    assign(item, target, remaining)
+                else:
+                    item.pop(target[0], None)
+
+def serialize(value):
+    # Mimics the type conversion of the boto3 resource layer
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes, Decimal)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        return {key: serialize(inner) for key, inner in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [serialize(inner) for inner in value]
+    if isinstance(value, set):
+        return {serialize(inner) for inner in value}
+    raise TypeError(f"Unsupported type: {type(value)}")
+
+def build_condition(condition, names, values):
+    # boto3 condition objects (Attr, Key) are rendered as expressions
+    if condition is None or isinstance(condition, str):
+        return condition, names, values
+    from boto3.dynamodb.conditions import ConditionExpressionBuilder
+    built = ConditionExpressionBuilder().build_expression(condition)
+    return (
+        built.condition_expression,
+        {**(names or {}), **built.attribute_name_placeholders},
+        {**(values or {}), **built.attribute_value_placeholders},
+    )
+
+# ---------------------------------------------------------------------------
+# DynamoDB tables
+# ---------------------------------------------------------------------------
+
+class FakeTable:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.key_names = TABLE_KEYS.get(name, ['id'])
+        self.items = {}
+
+    def key_of(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def check(self, item, condition, names, values, operation):
+        if not condition:
+            return
+        expression = Parser(condition, names, serialize(values or {})).condition()
+        if not test(item or {}, expression):
+            raise client_error('ConditionalCheckFailedException', operation, "The conditional request failed")
+
+    def get_item(self, Key, ConsistentRead=False, ProjectionExpression=None, ExpressionAttributeNames=None):
+        record('dynamodb', 'get_item')
+        with self.database.lock:
+            item = copy.deepcopy(self.items.get(self.key_of(serialize(Key))))
+        if item is None:
+            return {}
+        return {'Item': project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        record('dynamodb', 'put_item')
+        item = serialize(Item)
+        with self.database.lock:
+            key = self.key_of(item)
+            self.check(self.items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, 'PutItem')
+            self.items[key] = copy.deepcopy(item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE'):
+        record('dynamodb', 'update_item')
+        key = serialize(Key)
+        with self.database.lock:
+            item = self.apply(key, UpdateExpression, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, 'UpdateItem')
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': copy.deepcopy(item)}
+        return {}
+
+    def apply(self, key, update, condition, names, values, operation):
+        current = self.items.get(self.key_of(key))
+        self.check(current, condition, names, values, operation)
+        item = copy.deepcopy(current) if current else dict(key)
+        apply_update(item, Parser(update, names, serialize(values or {})).update())
+        self.items[self.key_of(key)] = item
+        return item
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        record('dynamodb', 'delete_item')
+        key = self.key_of(serialize(Key))
+        with self.database.lock:
+            self.check(self.items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, 'DeleteItem')
+            self.items.pop(key, None)
+        return {}
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+             ExpressionAttributeValues=None, ExclusiveStartKey=None, Limit=1000, Segment=0, TotalSegments=1):
+        record('dynamodb', 'scan')
+        condition, names, values = build_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        expression = Parser(condition, names, serialize(values or {})).condition() if condition else None
+        with self.database.lock:
+            keys = [key for key in self.items if hash(key) % TotalSegments == Segment]
+            if ExclusiveStartKey:
+                keys = keys[keys.index(self.key_of(serialize(ExclusiveStartKey))) + 1:]
+            page = keys[:Limit]
+            items = [copy.deepcopy(self.items[key]) for key in page]
+        response = {
+            'Items': [
+                project(item, ProjectionExpression, names)
+                for item in items
+                if expression is None or test(item, expression)
+            ],
+        }
+        response['Count'] = len(response['Items'])
+        if len(keys) > Limit:
+            response['LastEvaluatedKey'] = dict(zip(self.key_names, page[-1]))
+        return response
+
+def project(item, projection, names):
+    if not projection:
+        return item
+    attributes = [names.get(name.strip(), name.strip()) if names else name.strip() for name in projection.split(',')]
+    return {name: item[name] for name in attributes if name in item}
+
+class FakeDynamoDBClient:
+    def __init__(self, database):
+        self.database = database
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        record('dynamodb', 'transact_write_items')
+        with self.database.lock:
+            reasons = []
+            for operation in TransactItems:
+                (kind, request), = operation.items()
+                table = self.database.Table(request['TableName'])
+                key = serialize(request.get('Key') or request.get('Item'))
+                try:
+                    table.check(
+                        table.items.get(table.key_of(key)),
+                        request.get('ConditionExpression'),
+                        request.get('ExpressionAttributeNames'),
+                        request.get('ExpressionAttributeValues'),
+                        'TransactWriteItems'
+                    )
+                    reasons.append({'Code': 'None'})
+                except ClientError:
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise client_error('TransactionCanceledException', 'TransactWriteItems', "Transaction cancelled", CancellationReasons=reasons)
+            for operation in TransactItems:
+                (kind, request), = operation.items()
+                table = self.database.Table(request['TableName'])
+                if kind == 'Put':
+                    item = serialize(request['Item'])
+                    table.items[table.key_of(item)] = copy.deepcopy(item)
+                elif kind == 'Update':
+                    table.apply(serialize(request['Key']), request['UpdateExpression'], None,
+                                request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'), 'TransactWriteItems')
+                elif kind == 'Delete':
+                    table.items.pop(table.key_of(serialize(request['Key'])), None)
+        return {}
+
+    def batch_get_item(self, RequestItems):
+        return self.database.batch_get_item(RequestItems)
+
+class FakeMeta:
+    def __init__(self, client):
+        self.client = client
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {}
+        self.meta = FakeMeta(FakeDynamoDBClient(self))
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = FakeTable(self, name)
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        record('dynamodb', 'batch_get_item')
+        responses = {}
+        with self.lock:
+            for name, request in RequestItems.items():
+                table = self.Table(name)
+                responses[name] = [
+                    copy.deepcopy(table.items[table.key_of(serialize(key))])
+                    for key in request['Keys']
+                    if table.key_of(serialize(key)) in table.items
+                ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems):
+        record('dynamodb', 'batch_write_item')
+        with self.lock:
+            for name, requests in RequestItems.items():
+                table = self.Table(name)
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = serialize(request['PutRequest']['Item'])
+                        table.items[table.key_of(item)] = copy.deepcopy(item)
+                    else:
+                        table.items.pop(table.key_of(serialize(request['DeleteRequest']['Key'])), None)
+        return {'UnprocessedItems': {}}
+
+# ---------------------------------------------------------------------------
+# SNS, S3 and SQS
+# ---------------------------------------------------------------------------
+
+class FakeSNS:
+    def __init__(self):
+        self.subscriptions = {}
+        self.published = []
+        self.handlers = {}
+        self.deliveries = []
+        self.lock = threading.Lock()
+
+    def confirm_subscription(self, TopicArn, Token):
+        record('sns', 'confirm_subscription')
+        return {'SubscriptionArn': f"{TopicArn}:{uuid.uuid4()}"}
+
+    def subscribe(self, TopicArn, Protocol, Endpoint, ReturnSubscriptionArn=False):
+        record('sns', 'subscribe')
+        arn = f"{TopicArn}:{uuid.uuid4()}"
+        with self.lock:
+            self.subscriptions[arn] = Endpoint
+        return {'SubscriptionArn': arn}
+
+    def unsubscribe(self, SubscriptionArn):
+        record('sns', 'unsubscribe')
+        with self.lock:
+            self.subscriptions.pop(SubscriptionArn, None)
+        return {}
+
+    def publish(self, TopicArn, Message, Subject=None):
+        record('sns', 'publish')
+        message_id = str(uuid.uuid4())
+        event = {
+            'Records': [{
+                'EventSource': 'aws:sns',
+                'Sns': {'MessageId': message_id, 'TopicArn': TopicArn, 'Subject': Subject, 'Message': Message}
+            }]
+        }
+        with self.lock:
+            self.published.append({'TopicArn': TopicArn, 'Message': Message, 'Subject': Subject})
+            # Fan-out to the subscriptions whose endpoint has a registered handler
+            for endpoint in self.subscriptions.values():
+                if endpoint in self.handlers:
+                    self.deliveries.append((self.handlers[endpoint], event))
+        return {'MessageId': message_id}
+
+    def register_handler(self, endpoint, handler):
+        """
+        Delivers the messages of the subscriptions to an endpoint to a Lambda handler
+
+        Args:
+            endpoint (str): Endpoint of the subscriptions, e.g. the name of a Lambda
+            handler (callable): Lambda handler, called with an SNS event and no context
+        """
+        with self.lock:
+            self.handlers[endpoint] = handler
+
+    def drain(self):
+        """
+        Runs the pending deliveries, including the ones published while draining
+
+        Returns:
+            int: Number of deliveries run
+        """
+        delivered = 0
+        while True:
+            with self.lock:
+                if not self.deliveries:
+                    return delivered
+                handler, event = self.deliveries.pop(0)
+            handler(event, None)
+            delivered += 1
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        record('s3', 'generate_presigned_url')
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature={uuid.uuid4().hex}"
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        record('s3', 'upload_fileobj')
+        self.objects[(Bucket, Key)] = {'Body': Fileobj.read(), **(ExtraArgs or {})}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        record('s3', 'put_object')
+        self.objects[(Bucket, Key)] = {'Body': Body, **kwargs}
+        return {}
+
+    def get_object(self, Bucket, Key, IfMatch=None):
+        record('s3', 'get_object')
+        if (Bucket, Key) not in self.objects:
+            raise client_error('NoSuchKey', 'GetObject', "The specified key does not exist.")
+        body = self.objects[(Bucket, Key)]['Body']
+        etag = hashlib.md5(body).hexdigest()
+        if IfMatch is not None and IfMatch.strip('"') != etag:
+            raise client_error('PreconditionFailed', 'GetObject', "At least one of the pre-conditions you specified did not hold")
+        return {'Body': io.BytesIO(body), 'ETag': f'"{etag}"'}
+
+    def head_object(self, Bucket, Key):
+        record('s3', 'head_object')
+        if (Bucket, Key) not in self.objects:
+            raise client_error('404', 'HeadObject', "Not Found")
+        body = self.objects[(Bucket, Key)]['Body']
+        return {'ContentLength': len(body), 'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        record('s3', 'copy_object')
+        self.objects[(Bucket, Key)] = dict(self.objects[(CopySource['Bucket'], CopySource['Key'])])
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        record('s3', 'delete_object')
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        record('s3', 'create_multipart_upload')
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'Parts': {}, 'Args': kwargs}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        record('s3', 'upload_part')
+        self.uploads[UploadId]['Parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        record('s3', 'complete_multipart_upload')
+        upload = self.uploads.pop(UploadId)
+        body = b"".join(upload['Parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        self.objects[(Bucket, Key)] = {'Body': body, **upload['Args']}
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        record('s3', 'abort_multipart_upload')
+        self.uploads.pop(UploadId, None)
+        return {}
+
+class FakeSQS:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        record('sqs', 'send_message')
+        self.messages.append({'QueueUrl': QueueUrl, 'Body': MessageBody, 'DelaySeconds': DelaySeconds, **kwargs})
+        return {'MessageId': str(uuid.uuid4())}
+
+# ---------------------------------------------------------------------------
+# WhatsApp Graph API
+# ---------------------------------------------------------------------------
+
+# Content returned for every downloaded media file
+MEDIA_CONTENT = b"%PDF-1.4\n" + b"0" * 200_000 + b"\n%%EOF\n"
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, content=None):
+        self.status_code = status_code
+        self.body = body
+        self.content = content if content is not None else json.dumps(body).encode()
+        self.headers = {'Content-Length': str(len(self.content))}
+
+    @property
+    def text(self):
+        return self.content.decode(errors='replace')
+
+    def json(self):
+        return self.body
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FakeGraphSession:
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def post(self, url, headers=None, json=None, data=None, files=None, timeout=None):
+        if url.endswith('/media'):
+            record('graph', 'upload_media')
+            return FakeResponse(body={'id': f"media-{uuid.uuid4().hex[:12]}"})
+        record('graph', 'send_message')
+        message_id = f"wamid.{uuid.uuid4().hex}"
+        with self.lock:
+            self.sent.append(json if json is not None else data)
+        return FakeResponse(body={
+            'messaging_product': 'whatsapp',
+            'contacts': [{'input': '', 'wa_id': ''}],
+            'messages': [{'id': message_id}]
+        })
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        if url.startswith('https://lookaside.'):
+            record('graph', 'download_media')
+            return FakeResponse(content=MEDIA_CONTENT)
+        record('graph', 'get_media_url')
+        media_id = url.rsplit('/', 1)[-1]
+        return FakeResponse(body={
+            'url': f"https://lookaside.fbsbx.com/whatsapp_business/attachments/?mid={media_id}",
+            'mime_type': 'application/pdf',
+            'file_size': len(MEDIA_CONTENT),
+            'id': media_id
+        })
+
+# ---------------------------------------------------------------------------
+
+# Shared stand-ins of the process, created by reset()
+backend = {}
+
+def reset():
+    """
+    Replaces every stand-in with an empty one and clears the call counters
+
+    Returns:
+        dict: The new stand-ins by service
+    """
+    from modules import clients
+    with clients.lock:
+        backend.clear()
+        create_backend()
+        clients.registry.clear()
+    with calls_lock:
+        calls.clear()
+    return backend
+
+def create_backend():
+    backend.update({
+        'dynamodb': FakeDynamoDB(),
+        'sns': FakeSNS(),
+        's3': FakeS3(),
+        'sqs': FakeSQS(),
+        'graph': FakeGraphSession(),
+    })
+
+def create(name, factory):
+    """
+    Creates the in-memory version of a registry entry of modules.clients
+
+    Args:
+        name (str): Name of the registry entry, e.g. 'client:sns'
+        factory (callable): Production factory, used for entries derived from others
+
+    Returns:
+        object: The stand-in
+    """
+    if not backend:
+        create_backend()
+    services = {
+        'resource:dynamodb': 'dynamodb',
+        'client:sns': 'sns',
+        'client:s3': 's3',
+        'client:sqs': 'sqs',
+        'session:whatsapp': 'graph',
+    }
+    if name in services:
+        return backend[services[name]]
+    if name.startswith('client:'):
+        raise ValueError(f"No in-memory backend for {name}")
+    return factory()
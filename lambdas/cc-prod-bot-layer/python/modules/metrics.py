@@ -0,0 +1,137 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# CloudWatch namespace of the embedded metric records
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "cc-prod-bot")
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+# Invocation being measured. Threads started by an invocation must run with a copy
+# of its context (contextvars.copy_context) for their spans to be recorded
+current_invocation = contextvars.ContextVar('current_invocation', default=None)
+
+class Invocation:
+    """
+    Accumulated duration and count of each stage of a Lambda invocation, and the
+    other values recorded during it, by name: (value, unit)
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, elapsed_ms):
+        with self.lock:
+            total_ms, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total_ms + elapsed_ms, count + 1)
+
+def start_invocation(function):
+    """
+    Starts measuring an invocation. Spans opened afterwards are added to it
+
+    Args:
+        function (str): Name of the Lambda, used as the metric dimension
+    """
+    if METRICS_ENABLED:
+        current_invocation.set(Invocation(function))
+
+def count(name, value=1):
+    """
+    Adds to a counter of the current invocation, emitted with its summary
+
+    Args:
+        name (str): Name of the metric, e.g. 'highest_bid_cache.hits'
+        value (int, optional): Amount to add
+    """
+    invocation = current_invocation.get()
+    if invocation is None:
+        return
+    with invocation.lock:
+        total, _ = invocation.values.get(name, (0, 'Count'))
+        invocation.values[name] = (total + value, 'Count')
+
+def measure(name, value, unit='None'):
+    """
+    Records a value of the current invocation, emitted with its summary. The last
+    value recorded with a name is the one emitted
+
+    Args:
+        name (str): Name of the metric, e.g. 'highest_bid_cache.hit_ratio'
+        value (float): Value of the metric
+        unit (str, optional): CloudWatch unit of the value
+    """
+    invocation = current_invocation.get()
+    if invocation is None:
+        return
+    with invocation.lock:
+        invocation.values[name] = (value, unit)
+
+@contextmanager
+def span(stage):
+    """
+    Measures the duration of a stage of the current invocation
+
+    Args:
+        stage (str): Name of the stage, e.g. 'graph.send_message'
+    """
+    invocation = current_invocation.get()
+    if invocation is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        invocation.add(stage, (time.perf_counter() - started) * 1000)
+
+def emit_summary():
+    """
+    Emits the stages of the current invocation as a CloudWatch embedded metric
+    record, plus a readable summary line, and stops measuring it
+    """
+    invocation = current_invocation.get()
+    if invocation is None:
+        return
+    current_invocation.set(None)
+    total_ms = (time.perf_counter() - invocation.started) * 1000
+    with invocation.lock:
+        stages = dict(invocation.stages)
+        values = dict(invocation.values)
+
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Function']],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in ['total', *stages]]
+                + [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()]
+            }]
+        },
+        'Function': invocation.function,
+        'total': round(total_ms, 2),
+        'counts': {stage: count for stage, (_, count) in stages.items()},
+    }
+    for stage, (stage_ms, _) in stages.items():
+        record[stage] = round(stage_ms, 2)
+    for name, (value, _) in values.items():
+        record[name] = value
+    # Embedded metric records must be printed as plain JSON lines
+    print(json.dumps(record), flush=True)
+
+    summary = " ".join(f"{stage}={stage_ms:.1f}ms/{count}" for stage, (stage_ms, count) in stages.items())
+    if values:
+        summary += " " + " ".join(f"{name}={value}" for name, (value, _) in values.items())
+    logger.info(f"Invocation summary: total={total_ms:.1f}ms {summary}")
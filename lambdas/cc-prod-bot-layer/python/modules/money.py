@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+@lru_cache(maxsize=1024)
+def format_as_money(value):
+    """
+    Formatea un número como una cadena de dinero en formato colombiano.
+    
+    Args:
+        value (float): El valor a formatear.
+    
+    Returns:
+        str: El valor formateado como cadena de dinero.
+    """
+    return f"${value:,.0f}".replace(",", ".")
@@ -0,0 +1,308 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from modules.whatsapp import send_whatsapp_template
+from modules.sns import publish_message, BATCH_SUBSCRIPTION
+from modules.scheduler import enqueue, job_handler
+from modules.clients import get_table, USER_TABLE, STATE_TABLE, MESSAGE_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Maximum number of templates in flight and sent per second
+NOTIFICATION_CONCURRENCY = int(os.environ.get("NOTIFICATION_CONCURRENCY", "20"))
+NOTIFICATION_RATE_LIMIT = float(os.environ.get("NOTIFICATION_RATE_LIMIT", "50"))
+
+# Offers registered less than NOTIFICATION_WINDOW seconds after the last notification
+# are collapsed into a single notification with the latest amount (0 disables it)
+NOTIFICATION_WINDOW = float(os.environ.get("NOTIFICATION_WINDOW", "0"))
+
+# Notifications sent between two checkpoints of the notified subscribers
+NOTIFICATION_CHECKPOINT_SIZE = int(os.environ.get("NOTIFICATION_CHECKPOINT_SIZE", "100"))
+
+class RateLimiter:
+    """
+    Spaces calls evenly so that no more than `rate` calls start per second,
+    shared between all the threads of a fan-out.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def get_subscribers():
+    """
+    Gets the phone numbers of the users with notifications enabled in batch mode.
+    Users that still have their own SNS subscription are notified by it, so they
+    are not included
+
+    Returns:
+        list: Phone numbers of the subscribed users
+    """
+    from boto3.dynamodb.conditions import Attr
+    scan_kwargs = {
+        'FilterExpression': Attr('sns_subscription').eq(BATCH_SUBSCRIPTION),
+        'ProjectionExpression': 'phone'
+    }
+    phones = []
+    while True:
+        with span('dynamodb.scan_subscribers'):
+            response = get_table(USER_TABLE).scan(**scan_kwargs)
+        phones.extend(item['phone'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return phones
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def get_notified_users(claim_id):
+    """
+    Gets the subscribers a notification was already sent to, by a previous attempt
+
+    Args:
+        claim_id (str): Idempotency claim of the notification
+
+    Returns:
+        set: Phone numbers of the subscribers
+    """
+    with span('dynamodb.read_notified'):
+        item = get_table(MESSAGE_TABLE).get_item(Key={'id': claim_id}, ConsistentRead=True).get('Item') or {}
+    return set(item.get('phones', set()))
+
+def record_notified_users(claim_id, phones):
+    # Checkpoint on the claim of the notification, so it expires with it
+    with span('dynamodb.record_notified'):
+        get_table(MESSAGE_TABLE).update_item(
+            Key={'id': claim_id},
+            UpdateExpression="ADD #phones :phones",
+            ExpressionAttributeNames={'#phones': 'phones'},
+            ExpressionAttributeValues={':phones': set(phones)}
+        )
+
+def notify_new_offer(amount, phone, subscribers=None, claim_id=None):
+    """
+    Sends the new_offer template to every subscriber except the bidder, concurrently.
+    With a claim id, the notified subscribers are recorded as they are sent, so a
+    retry of the fan-out only notifies the rest
+
+    Args:
+        amount (str): Formatted amount of the new offer
+        phone (str): Phone number of the bidder
+        subscribers (list, optional): Phone numbers to notify. Loaded from the user table if not given
+        claim_id (str, optional): Idempotency claim of the notification, see queue_offer_fanout
+
+    Returns:
+        dict: Number of delivered, failed, skipped and already notified subscribers
+    """
+    if subscribers is None:
+        subscribers = get_subscribers()
+    notified = get_notified_users(claim_id) if claim_id else set()
+    recipients = [subscriber for subscriber in subscribers if subscriber != phone and subscriber not in notified]
+    limiter = RateLimiter(NOTIFICATION_RATE_LIMIT)
+
+    def send(recipient):
+        limiter.wait()
+        return send_whatsapp_template(
+            phone_number=recipient,
+            template_name="new_offer",
+            template_language="es",
+            template_params=[amount]
+        )
+
+    delivered = 0
+    # Every send runs in a copy of the invocation context so it is measured
+    with ThreadPoolExecutor(max_workers=NOTIFICATION_CONCURRENCY) as executor:
+        for start in range(0, len(recipients), NOTIFICATION_CHECKPOINT_SIZE):
+            chunk = recipients[start:start + NOTIFICATION_CHECKPOINT_SIZE]
+            futures = [executor.submit(contextvars.copy_context().run, send, recipient) for recipient in chunk]
+            sent = [recipient for recipient, future in zip(chunk, futures) if future.result()]
+            if sent and claim_id:
+                record_notified_users(claim_id, sent)
+            delivered += len(sent)
+
+    summary = {
+        'delivered': delivered,
+        'failed': len(recipients) - delivered,
+        'skipped': sum(1 for subscriber in subscribers if subscriber == phone),
+        'already_notified': len(notified)
+    }
+    logger.info(f"New offer notification summary for {amount}: {summary}")
+    return summary
+
+def queue_offer_fanout(message, message_id=None):
+    """
+    Schedules the batch fan-out of a new offer notification in the worker, so the
+    SNS delivery is acknowledged right away instead of waiting for every send.
+    Redeliveries of the same SNS message are ignored
+
+    Args:
+        message (dict): Notification published by queue_offer_notification
+        message_id (str, optional): SNS message id, used to ignore redeliveries
+    """
+    from modules.idempotency import claim_message, complete_message, release_message
+    claim_id = f"notification#{message_id}" if message_id else None
+    if claim_id and not claim_message(claim_id):
+        return
+    try:
+        enqueue('offer_notification', {'amount': message.get('amount'), 'phone': message.get('phone'), 'claim_id': claim_id})
+    except Exception:
+        # Permite que el reintento de SNS programe la notificación
+        if claim_id:
+            release_message(claim_id)
+        raise
+    if claim_id:
+        complete_message(claim_id)
+
+@job_handler('offer_notification')
+def send_offer_notification(payload):
+    notify_new_offer(payload['amount'], payload['phone'], claim_id=payload.get('claim_id'))
+
+def queue_offer_notification(amount, display_amount, phone):
+    """
+    Publishes a new offer notification, collapsing bursts of offers.
+
+    The first offer after a quiet window is published right away. Offers inside the
+    window are stored as pending in the OFFER_NOTIFICATION state row, and only the
+    latest one is published by a delayed worker job once the window ends.
+
+    Args:
+        amount (Decimal|float): Amount of the offer
+        display_amount (str): Formatted amount sent to the subscribers
+        phone (str): Phone number of the bidder
+    """
+    json_message = {'amount': display_amount, 'phone': phone}
+    if NOTIFICATION_WINDOW <= 0:
+        publish_message(json_message=json_message, subject="Nueva oferta registrada")
+        return
+
+    now = int(time.time() * 1000)
+    values = {
+        ':amount': Decimal(str(amount)),
+        ':display': display_amount,
+        ':phone': phone,
+        ':window_start': now - int(NOTIFICATION_WINDOW * 1000)
+    }
+    names = {'#amount': 'amount', '#display': 'display', '#phone': 'phone', '#pending': 'pending', '#sent_at': 'sent_at'}
+    try:
+        # Leading edge: nothing was sent during the last window
+        get_table(STATE_TABLE).update_item(
+            Key={'id': 'OFFER_NOTIFICATION'},
+            UpdateExpression="SET #amount = :amount, #display = :display, #phone = :phone, #pending = :false, #sent_at = :now",
+            ConditionExpression="(attribute_not_exists(#sent_at) OR #sent_at <= :window_start) AND (attribute_not_exists(#amount) OR #amount < :amount)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={**values, ':false': False, ':now': now}
+        )
+        publish_message(json_message=json_message, subject="Nueva oferta registrada")
+        return
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    try:
+        # Inside the window: keep the offer as pending unless a higher one is already stored
+        del values[':window_start']
+        response = get_table(STATE_TABLE).update_item(
+            Key={'id': 'OFFER_NOTIFICATION'},
+            UpdateExpression="SET #amount = :amount, #display = :display, #phone = :phone, #pending = :true",
+            ConditionExpression="attribute_not_exists(#amount) OR #amount < :amount",
+            ExpressionAttributeNames={k: v for k, v in names.items() if k != '#sent_at'},
+            ExpressionAttributeValues={**values, ':true': True},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    logger.info(f"Offer notification of {display_amount} coalesced.")
+    schedule_offer_flush(int(response['Attributes'].get('sent_at', 0)), response['Attributes'].get('flush_scheduled'))
+
+def schedule_offer_flush(sent_at, flush_scheduled=None):
+    """
+    Schedules the publication of the pending offer notification at the end of the
+    window that started at sent_at, as a delayed worker job. Only one job is
+    scheduled per window
+
+    Args:
+        sent_at (int): Start of the window, in milliseconds
+        flush_scheduled (int, optional): Window whose job was already scheduled, as
+            stored in the OFFER_NOTIFICATION state row
+    """
+    remaining = sent_at / 1000 + NOTIFICATION_WINDOW - time.time()
+    # The window may have ended between both updates, in which case no one else will flush it
+    if remaining <= 0:
+        flush_offer_notification(sent_at)
+        return
+    if flush_scheduled is not None and int(flush_scheduled) == sent_at:
+        return
+    try:
+        get_table(STATE_TABLE).update_item(
+            Key={'id': 'OFFER_NOTIFICATION'},
+            UpdateExpression="SET #flush_scheduled = :sent_at",
+            ConditionExpression="#sent_at = :sent_at AND (attribute_not_exists(#flush_scheduled) OR #flush_scheduled <> :sent_at)",
+            ExpressionAttributeNames={'#flush_scheduled': 'flush_scheduled', '#sent_at': 'sent_at'},
+            ExpressionAttributeValues={':sent_at': sent_at}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    enqueue('flush_offer_notification', {'sent_at': sent_at}, delay=math.ceil(remaining))
+
+@job_handler('flush_offer_notification')
+def flush_offer_job(payload):
+    flush_offer_notification(int(payload['sent_at']))
+
+def flush_offer_notification(sent_at):
+    """
+    Publishes the pending offer notification of the window that started at sent_at.
+    Nothing is published if it was already flushed or a new window started
+
+    Args:
+        sent_at (int): Start of the window, in milliseconds
+
+    Returns:
+        bool: True if a pending notification was published
+    """
+    try:
+        response = get_table(STATE_TABLE).update_item(
+            Key={'id': 'OFFER_NOTIFICATION'},
+            UpdateExpression="SET #pending = :false, #sent_at = :now",
+            ConditionExpression="#pending = :true AND #sent_at = :sent_at",
+            ExpressionAttributeNames={'#pending': 'pending', '#sent_at': 'sent_at'},
+            ExpressionAttributeValues={
+                ':true': True,
+                ':false': False,
+                ':now': int(time.time() * 1000),
+                ':sent_at': sent_at
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    item = response['Attributes']
+    publish_message(
+        json_message={'amount': item['display'], 'phone': item['phone']},
+        subject="Nueva oferta registrada"
+    )
+    logger.info(f"Coalesced offer notification of {item['display']} published.")
+    return True
@@ -0,0 +1,183 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from modules.clients import get_client, get_table, STATE_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL, dump
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Queue consumed by the cc-prod-bot-sender Lambda. When it is not set, messages are
+# sent inline by the Lambda that produces them. A FIFO queue (".fifo") keeps the
+# messages of each recipient in order
+OUTBOX_QUEUE_URL = os.environ.get("OUTBOX_QUEUE_URL")
+
+# Throughput of the WhatsApp business number (messages per second) and of each
+# recipient (messages per second, with a burst). Buckets are kept per container,
+# so the account rate should be divided by the sender's reserved concurrency
+OUTBOX_ACCOUNT_RATE = float(os.environ.get("OUTBOX_ACCOUNT_RATE", "80"))
+OUTBOX_NUMBER_RATE = float(os.environ.get("OUTBOX_NUMBER_RATE", "1"))
+OUTBOX_NUMBER_BURST = float(os.environ.get("OUTBOX_NUMBER_BURST", "5"))
+# Deliveries of a message before a transient failure is given up
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "5"))
+# Recipients of a batch sent concurrently
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", "10"))
+
+# State table item with the delivery outcome counters
+OUTBOX_STATS = 'OUTBOX_STATS'
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average and bursts of up to `capacity` calls,
+    shared between all the threads of the container
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # The token is reserved even if it is not available yet, so waiting
+            # threads are served in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+account_bucket = TokenBucket(OUTBOX_ACCOUNT_RATE, max(OUTBOX_ACCOUNT_RATE, 1))
+number_buckets = {}
+number_buckets_lock = threading.Lock()
+
+def get_number_bucket(phone_number):
+    with number_buckets_lock:
+        bucket = number_buckets.get(phone_number)
+        if bucket is None:
+            bucket = number_buckets[phone_number] = TokenBucket(OUTBOX_NUMBER_RATE, OUTBOX_NUMBER_BURST)
+        return bucket
+
+def enqueue_message(phone_number, body, span_name, description):
+    """
+    Queues a serialized WhatsApp message to be sent by the sender worker
+
+    Args:
+        phone_number (str): Phone number of the recipient
+        body (bytes): JSON payload of the message
+        span_name (str): Name of the measured stage of the delivery
+        description (str): Description of the message for the logs
+
+    Returns:
+        bool: True if the message was queued
+    """
+    params = {
+        'QueueUrl': OUTBOX_QUEUE_URL,
+        'MessageBody': json.dumps({
+            'phone': phone_number,
+            'body': body.decode('utf-8'),
+            'span': span_name,
+            'description': description
+        })
+    }
+    if OUTBOX_QUEUE_URL.endswith('.fifo'):
+        params['MessageGroupId'] = phone_number
+        params['MessageDeduplicationId'] = uuid.uuid4().hex
+    try:
+        with span('sqs.enqueue_message'):
+            get_client('sqs').send_message(**params)
+        return True
+    except Exception as e:
+        logger.error("Error queueing whatsapp %s: %s. Payload: %s", description, str(e), dump(body))
+        return False
+
+def process_outbox_records(records):
+    """
+    Sends a batch of queued messages. Recipients are served concurrently and the
+    messages of each recipient in order, within the account and number rates
+
+    Args:
+        records (list): SQS records of the outbox queue
+
+    Returns:
+        list: Message ids of the records to be delivered again by SQS
+    """
+    from modules.whatsapp import deliver_message, SENT, RETRY
+
+    records_by_phone = {}
+    for record in records:
+        message = json.loads(record['body'])
+        records_by_phone.setdefault(message.get('phone'), []).append((record, message))
+
+    outcomes = {'sent': 0, 'failed': 0, 'retried': 0}
+    outcomes_lock = threading.Lock()
+
+    def count(outcome):
+        with outcomes_lock:
+            outcomes[outcome] += 1
+
+    def send(phone_number, phone_records):
+        retry_ids = []
+        for record, message in phone_records:
+            if retry_ids:
+                # A previous message of the recipient will be delivered again, the
+                # following ones are too so the order is preserved
+                retry_ids.append(record['messageId'])
+                continue
+            account_bucket.take()
+            get_number_bucket(phone_number).take()
+            outcome = deliver_message(message['body'].encode('utf-8'), message['span'], message['description'])
+            if outcome == SENT:
+                count('sent')
+            elif outcome == RETRY and int(record.get('attributes', {}).get('ApproximateReceiveCount', 1)) < OUTBOX_MAX_ATTEMPTS:
+                count('retried')
+                retry_ids.append(record['messageId'])
+            else:
+                count('failed')
+                logger.error("Whatsapp %s to %s dropped after %s attempts", message['description'], phone_number,
+                             record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+        return retry_ids
+
+    with ThreadPoolExecutor(max_workers=max(1, min(OUTBOX_CONCURRENCY, len(records_by_phone)))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, send, phone_number, phone_records)
+            for phone_number, phone_records in records_by_phone.items()
+        ]
+    retry_ids = [message_id for future in futures for message_id in future.result()]
+    record_outcomes(outcomes)
+    return retry_ids
+
+def record_outcomes(outcomes):
+    """
+    Adds the delivery outcomes of a batch to the counters of the state table
+
+    Args:
+        outcomes (dict): Number of messages by outcome ('sent', 'failed', 'retried')
+    """
+    outcomes = {outcome: total for outcome, total in outcomes.items() if total}
+    if not outcomes:
+        return
+    logger.info(f"Outbox batch outcomes: {outcomes}")
+    try:
+        with span('dynamodb.record_outcomes'):
+            get_table(STATE_TABLE).update_item(
+                Key={'id': OUTBOX_STATS},
+                UpdateExpression="ADD " + ", ".join(f"#{outcome} :{outcome}" for outcome in outcomes),
+                ExpressionAttributeNames={f"#{outcome}": outcome for outcome in outcomes},
+                ExpressionAttributeValues={f":{outcome}": total for outcome, total in outcomes.items()}
+            )
+    except Exception as e:
+        logger.error(f"Error recording outbox outcomes: {str(e)}")
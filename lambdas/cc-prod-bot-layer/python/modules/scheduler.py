@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+from modules.whatsapp import send_whatsapp_message
+from modules.clients import get_client
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Queue consumed by the cc-prod-bot-worker Lambda. When it is not set, jobs run
+# inline in the calling process without delays (local stand-in for tests)
+SCHEDULER_QUEUE_URL = os.environ.get("SCHEDULER_QUEUE_URL")
+
+# Maximum delay supported by SQS, in seconds
+MAX_DELAY = 900
+
+# Job handlers by job type
+handlers = {}
+
+def job_handler(job_type):
+    """
+    Registers a function as the handler of a job type
+
+    Args:
+        job_type (str): Type of the job
+    """
+    def register(function):
+        handlers[job_type] = function
+        return function
+    return register
+
+def enqueue(job_type, payload, delay=0, queue_url=None):
+    """
+    Schedules a job to be processed by the worker
+
+    Args:
+        job_type (str): Type of the job, must have a registered handler
+        payload (dict): JSON serializable data passed to the handler
+        delay (int, optional): Seconds to wait before the job is processed
+        queue_url (str, optional): Queue of the job, SCHEDULER_QUEUE_URL by default
+    """
+    job = {'type': job_type, 'payload': payload}
+    queue_url = queue_url or SCHEDULER_QUEUE_URL
+    if not queue_url:
+        process_job(job)
+        return
+    with span('sqs.send_message'):
+        get_client('sqs').send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps(job),
+            DelaySeconds=min(int(delay), MAX_DELAY)
+        )
+
+def process_job(job):
+    """
+    Runs the handler registered for a job
+
+    Args:
+        job (dict): Job with keys 'type' and 'payload'
+    """
+    handler = handlers.get(job.get('type'))
+    if not handler:
+        logger.error(f"No handler registered for job type: {job.get('type')}")
+        return
+    handler(job.get('payload'))
+
+def schedule_message_sequence(steps):
+    """
+    Schedules an ordered sequence of WhatsApp messages
+
+    Each message is only enqueued after the previous one was sent, so the order is
+    preserved without keeping a Lambda waiting between messages.
+
+    Args:
+        steps (list): Dictionaries with keys 'delay' (seconds to wait after the previous
+            message) and 'message' (keyword arguments for send_whatsapp_message)
+    """
+    if steps:
+        enqueue('message_sequence', {'steps': steps}, delay=steps[0].get('delay', 0))
+
+@job_handler('message_sequence')
+def send_message_sequence(payload):
+    steps = payload['steps']
+    send_whatsapp_message(**steps[0]['message'])
+    schedule_message_sequence(steps[1:])
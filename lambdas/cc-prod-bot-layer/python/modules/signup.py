@@ -1,166 +1,150 @@
-import boto3
 import logging
-from modules.whatsapp import send_whatsapp_message, get_media_content
+from modules.whatsapp import MessageTemplate, send_message_template
+from modules.documents import queue_document, is_duplicate, DOCUMENT_DUPLICATE
+from modules.media import get_static_media_id
+from modules.scheduler import schedule_message_sequence
+from modules.clients import get_client, get_table, USER_TABLE
+from modules.users import UserUpdate
+from modules.metrics import span
+from modules.fsm import StateMachine, Turn, get_event, ANY
 import os
-import time
-from io import BytesIO
 from datetime import datetime
 import pytz
+from modules.logs import LOG_LEVEL
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
 
 PROPERTY_ADDRESS = os.environ.get("PROPERTY_ADDRESS")
 TERMS_AND_CONDITIONS = os.environ.get("TERMS_AND_CONDITIONS")
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-user_table = dynamodb.Table('cc-prod-bot-user')
-s3 = boto3.client('s3')
-
 # Set timezone (adjust to your local timezone)
 timezone = pytz.timezone('America/Bogota')
 SIGNUP_INITIAL_HOUR = datetime.fromisoformat(os.environ.get("SIGNUP_INITIAL_HOUR")).astimezone(timezone)
 SIGNUP_FINAL_HOUR = datetime.fromisoformat(os.environ.get("SIGNUP_FINAL_HOUR")).astimezone(timezone)
 
+# Catálogo de mensajes, precompilados al importar el módulo
+SIGNUP_NOT_STARTED = MessageTemplate(f"El periodo para registrarse en la subasta aún no ha comenzado. Estará disponible a partir del {SIGNUP_INITIAL_HOUR.strftime('%Y-%m-%d a las %H:%M')}.")
+SIGNUP_ENDED = MessageTemplate("El proceso de registro para participar en la subasta ha terminado. Agradecemos su interés.")
+WELCOME = MessageTemplate(f"¡Bienvenido(a) a la subasta del canon de arrendamiento de {PROPERTY_ADDRESS}!")
+DOCUMENT_ONLY = MessageTemplate(
+    "En este momento solo debe enviar el documento de términos y condiciones como un único archivo PDF. "
+    "No envíe otros mensajes o archivos. "
+)
+DOCUMENT_ALREADY_RECEIVED = MessageTemplate(
+    "Ya hemos recibido un documento anteriormente. Si necesita enviar una versión corregida, "
+    "por favor adjúntela como un único archivo PDF. Si ya envió la versión correcta, "
+    "le notificaremos próximas acciones una vez hayamos revisado su documentación."
+)
+
+# Estado de quien escribe por primera vez, antes de que exista su usuario
+NEW_USER = 'new_user'
+
+signup_flow = StateMachine('signup')
+
 def proccess_signup(message, user):
     now = datetime.now(timezone)
     if now < SIGNUP_INITIAL_HOUR:
         logger.info("Auction has not started yet.")
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=f"El periodo para registrarse en la subasta aún no ha comenzado. Estará disponible a partir del {SIGNUP_INITIAL_HOUR.strftime('%Y-%m-%d a las %H:%M')}."
-        )
+        send_message_template(message.get('from'), SIGNUP_NOT_STARTED)
         return
     elif now > SIGNUP_FINAL_HOUR:
         logger.info("Auction has already ended.")
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message="El proceso de registro para participar en la subasta ha terminado. Agradecemos su interés."
-        )
+        send_message_template(message.get('from'), SIGNUP_ENDED)
         return
-    if not user:
-        # Create a new user in DynamoDB
-        user_table.put_item(
+    state = user.get('status') if user else NEW_USER
+    # The target state of the transition is written with the rest of the turn's changes
+    changes = UserUpdate(message.get('from'))
+    signup_flow.dispatch(state, get_event(message), Turn(message, user, changes))
+    changes.flush()
+
+@signup_flow.on(NEW_USER)
+def welcome(turn):
+    # Create a new user in DynamoDB
+    with span('dynamodb.create_user'):
+        get_table(USER_TABLE).put_item(
             Item={
-                'phone': message.get('from'),
+                'phone': turn.phone,
                 'terms_document': [],
                 'status': 'pending_terms',
-                'created_at': message.get('timestamp'),
-                'last_message': message.get('timestamp')
+                'created_at': turn.message.get('timestamp'),
+                'last_message': turn.message.get('timestamp')
             }
         )
-        logger.info(f"New user created: {message.get('from')}")
-        # Mensaje de bienvenida
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=f"¡Bienvenido(a) a la subasta del canon de arrendamiento de {PROPERTY_ADDRESS}!"
-        )
+    logger.info(f"New user created: {turn.phone}")
+    # Mensaje de bienvenida
+    send_message_template(turn.phone, WELCOME)
 
-        # Get S3 presigned url
+    # Terms document, sent by its WhatsApp media id (uploaded once). A presigned
+    # URL, valid long enough for the scheduled message, is only used if the upload failed
+    attachment = {'filename': "Formato de Oferta.pdf"}
+    media_id = get_static_media_id(TERMS_AND_CONDITIONS, attachment['filename'])
+    if media_id:
+        attachment['media_id'] = media_id
+    else:
         bucket_name, key = TERMS_AND_CONDITIONS.replace("s3://", "").split("/", 1)
-        file_url = s3.generate_presigned_url(
+        attachment['file'] = get_client('s3').generate_presigned_url(
             'get_object',
             Params={'Bucket': bucket_name, 'Key': key},
-            ExpiresIn=60
+            ExpiresIn=900
         )
 
-        # Esperar 1 segundo antes de enviar el siguiente mensaje
-        time.sleep(1)
-
-        # Enviar política de privacidad y términos
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=(
-                "Antes de participar en la subasta, es necesario que lea y acepte los términos y condiciones sobre el uso de este bot "
-                "y el proceso de subasta. Para ello, debe diligenciar a mano el documento adjunto."
-            ),
-            file=file_url,
-            filename="Formato de Oferta.pdf"
-        )
+    # Los siguientes mensajes se programan en orden, con una pausa entre cada uno
+    schedule_message_sequence([
+        {
+            # Enviar política de privacidad y términos
+            'delay': 1,
+            'message': {
+                'phone_number': turn.phone,
+                'message': (
+                    "Antes de participar en la subasta, es necesario que lea y acepte los términos y condiciones sobre el uso de este bot "
+                    "y el proceso de subasta. Para ello, debe diligenciar a mano el documento adjunto."
+                ),
+                **attachment
+            }
+        },
+        {
+            'delay': 3,
+            'message': {
+                'phone_number': turn.phone,
+                'message': (
+                    "Recuerde que debe diligenciar un único documento, incluyendo a todas las personas a cuyo nombre se elaborará el contrato de arrendamiento en caso de resultar ganadores. "
+                    "Las pujas durante la subasta deberán realizarse exclusivamente desde el número de WhatsApp desde el cual se envió dicho documento."
+                )
+            }
+        },
+        {
+            'delay': 3,
+            'message': {
+                'phone_number': turn.phone,
+                'message': (
+                    f"Una vez haya diligenciado el documento, por favor escanee todas sus páginas y adjúntelas en un único archivo PDF en este chat. Recuerde que el plazo máximo para enviar el documento es {SIGNUP_FINAL_HOUR.strftime('%Y-%m-%d a las %H:%M')}."
+                )
+            }
+        }
+    ])
 
-        # Esperar 3 segundos antes de enviar el siguiente mensaje
-        time.sleep(3)
+def is_pdf(turn):
+    document = turn.message.get('document')
+    return bool(document) and document["mime_type"] == 'application/pdf'
 
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=(
-                "Recuerde que debe diligenciar un único documento, incluyendo a todas las personas a cuyo nombre se elaborará el contrato de arrendamiento en caso de resultar ganadores. "
-                "Las pujas durante la subasta deberán realizarse exclusivamente desde el número de WhatsApp desde el cual se envió dicho documento."
-            )
-        )
+# Un reenvío del mismo archivo se detecta por su hash, sin descargarlo
+@signup_flow.on(ANY, 'document', guard=lambda turn: is_pdf(turn) and is_duplicate(turn.user, turn.message['document']))
+def reject_duplicate_document(turn):
+    send_message_template(turn.phone, DOCUMENT_DUPLICATE)
 
-        time.sleep(3)
-        send_whatsapp_message(
-            phone_number=message.get('from'),
-            message=(
-                f"Una vez haya diligenciado el documento, por favor escanee todas sus páginas y adjúntelas en un único archivo PDF en este chat. Recuerde que el plazo máximo para enviar el documento es {SIGNUP_FINAL_HOUR.strftime('%Y-%m-%d a las %H:%M')}."
-            )
-        )
+# La copia a S3 se hace en segundo plano, el webhook responde de inmediato
+@signup_flow.on(ANY, 'document', guard=is_pdf)
+def receive_document(turn):
+    queue_document(turn.phone, turn.message.get('timestamp'), turn.message['document'])
 
-    else:
-        # Check if message has a file
-        document = message.get('document')
-        if message.get('type') == 'document'  and document and document["mime_type"] == 'application/pdf':
-            # get media url
-            file_content = get_media_content(document["id"])
-            if not file_content:
-                send_whatsapp_message(
-                    phone_number=message.get('from'),
-                    message=(
-                        "No se pudo obtener el archivo. Por favor, intente nuevamente."
-                    )
-                )
-                return
-        
-            # upload file to S3
-            bucket_name, key = TERMS_AND_CONDITIONS.replace("s3://", "").split("/", 1)
-            s3_key = "terms_documents/" + message.get('from') + "/" + message.get('timestamp') + ".pdf"
-            file_data = BytesIO(file_content)
-            s3.upload_fileobj(
-                file_data,
-                bucket_name,
-                s3_key,
-                ExtraArgs={
-                    'ContentType': document["mime_type"],
-                    'Metadata': {
-                        'phone': message.get('from'),
-                        'timestamp': message.get('timestamp')
-                    }
-                }
-            )
-            logger.info(f"File uploaded to S3: s3://{bucket_name}/{s3_key}")
-            user_table.update_item(
-                Key={
-                    'phone': message.get('from')
-                },
-                UpdateExpression="SET terms_document = list_append(if_not_exists(terms_document, :empty_list), :i)",
-                ExpressionAttributeValues={
-                    ':i': [f"s3://{bucket_name}/{s3_key}"],
-                    ':empty_list': []
-                }
-            )
-            send_whatsapp_message(
-                phone_number=message.get('from'),
-                message="El documento ha sido recibido y se está procesando. Le notificaremos cuando esté listo para participar en la subasta."
-            )
-        else:
-            documents = user.get('terms_document', [])
-            if len(documents) == 0:
-                send_whatsapp_message(
-                    phone_number=message.get('from'),
-                    message=(
-                        "En este momento solo debe enviar el documento de términos y condiciones como un único archivo PDF. "
-                        "No envíe otros mensajes o archivos. "
-                    )
-                )
-            else:
-                send_whatsapp_message(
-                    phone_number=message.get('from'),
-                    message=(
-                        "Ya hemos recibido un documento anteriormente. Si necesita enviar una versión corregida, "
-                        "por favor adjúntela como un único archivo PDF. Si ya envió la versión correcta, "
-                        "le notificaremos próximas acciones una vez hayamos revisado su documentación."
-                    )
-                )
\ No newline at end of file
+@signup_flow.on(ANY, guard=lambda turn: len(turn.user.get('terms_document', [])) == 0)
+def ask_document(turn):
+    send_message_template(turn.phone, DOCUMENT_ONLY)
+
+@signup_flow.on(ANY)
+def document_already_received(turn):
+    send_message_template(turn.phone, DOCUMENT_ALREADY_RECEIVED)
+
+signup_flow.compile()
@@ -1,26 +1,35 @@
-import boto3
 import os
 import json
 from botocore.exceptions import ClientError
 import logging
+from modules.clients import get_client
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-sns_client = boto3.client('sns')
+logger.setLevel(LOG_LEVEL)
+
+# "subscription": one HTTPS subscription per phone, "batch": a single notifications
+# Lambda invocation per offer that reads the subscribers from the user table
+NOTIFICATION_MODE = os.environ.get("NOTIFICATION_MODE", "subscription")
+BATCH_SUBSCRIPTION = "batch"
 
 def verify_subscription(event):
     body = json.loads(event['body'])
-    sns_client.confirm_subscription(
+    get_client('sns').confirm_subscription(
             TopicArn=os.environ['SNS_TOPIC_ARN'],
             Token=body.get('Token'),
     )
     return True
     
 def add_subscription(phone):
+    if NOTIFICATION_MODE == "batch":
+        # No SNS subscription needed, the flag in the user table is enough
+        return BATCH_SUBSCRIPTION
     
     try:
         # Crear la suscripción
-        response = sns_client.subscribe(
+        response = get_client('sns').subscribe(
             TopicArn=os.environ['SNS_TOPIC_ARN'],
             Protocol='https',
             Endpoint=f"https://dvkd7854vh.execute-api.us-east-1.amazonaws.com/v1/notify?phone={phone}",
@@ -34,8 +43,10 @@ def add_subscription(phone):
     
 def remove_subscription(subscription_arn):
     # Eliminar la suscripción
+    if subscription_arn == BATCH_SUBSCRIPTION:
+        return True
     try:
-        sns_client.unsubscribe(
+        get_client('sns').unsubscribe(
             SubscriptionArn=subscription_arn
         )
         return True
@@ -46,11 +57,12 @@ def remove_subscription(subscription_arn):
 def publish_message(json_message, subject):
     # Publicar un mensaje en el tema SNS
     try:
-        response = sns_client.publish(
-            TopicArn=os.environ['SNS_TOPIC_ARN'],
-            Message=json.dumps(json_message),
-            Subject=subject
-        )
+        with span('sns.publish'):
+            response = get_client('sns').publish(
+                TopicArn=os.environ['SNS_TOPIC_ARN'],
+                Message=json.dumps(json_message),
+                Subject=subject
+            )
         return response
     except ClientError as e:
         logger.error(f"Error al publicar el mensaje: {str(e)}")
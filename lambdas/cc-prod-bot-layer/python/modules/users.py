@@ -0,0 +1,119 @@
+import logging
+import os
+import random
+import time
+from botocore.exceptions import ClientError
+from modules.clients import get_dynamodb, get_table, USER_TABLE
+from modules.metrics import span
+from modules.logs import LOG_LEVEL
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+# Maximum number of keys accepted by BatchGetItem
+BATCH_GET_LIMIT = 100
+# Calls of BatchGetItem for the unprocessed keys of a batch, and seconds of the first
+# backoff (doubled on each retry, with full jitter). The keys still unprocessed
+# afterwards are read one by one
+BATCH_GET_MAX_ATTEMPTS = int(os.environ.get("BATCH_GET_MAX_ATTEMPTS", "4"))
+BATCH_GET_BACKOFF = float(os.environ.get("BATCH_GET_BACKOFF", "0.05"))
+
+def get_user(phone):
+    """
+    Gets a user from the user table
+
+    Args:
+        phone (str): Phone number of the user
+
+    Returns:
+        dict: User item, or None if the user does not exist
+    """
+    with span('dynamodb.get_user'):
+        return get_table(USER_TABLE).get_item(Key={'phone': phone}).get('Item')
+
+def get_users(phones):
+    """
+    Gets several users from the user table with BatchGetItem
+
+    Args:
+        phones (list): Phone numbers of the users
+
+    Returns:
+        dict: User items by phone number. Users that do not exist are not included
+    """
+    phones = list(dict.fromkeys(phones))
+    users = {}
+    for start in range(0, len(phones), BATCH_GET_LIMIT):
+        request_items = {
+            USER_TABLE: {
+                'Keys': [{'phone': phone} for phone in phones[start:start + BATCH_GET_LIMIT]]
+            }
+        }
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt:
+                # Throttled: wait before asking again for the unprocessed keys
+                time.sleep(random.uniform(0, BATCH_GET_BACKOFF * 2 ** (attempt - 1)))
+            with span('dynamodb.batch_get_users'):
+                response = get_dynamodb().batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(USER_TABLE, []):
+                users[item['phone']] = item
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+        else:
+            keys = request_items[USER_TABLE]['Keys']
+            logger.warning(f"{len(keys)} users unprocessed by BatchGetItem, reading them one by one")
+            for key in keys:
+                item = get_user(key['phone'])
+                if item:
+                    users[item['phone']] = item
+    return users
+
+class UserUpdate:
+    """
+    Accumulates the attribute changes of a user during a turn, so that they are
+    written with a single conditional UpdateItem at the end of the turn.
+    """
+
+    def __init__(self, phone):
+        self.phone = phone
+        self.changes = {}
+
+    def set(self, **attributes):
+        # Later changes of the same attribute replace earlier ones
+        self.changes.update(attributes)
+
+    def flush(self):
+        """
+        Writes the accumulated changes, only if the user still exists
+
+        Returns:
+            bool: True if there was nothing to write or the changes were written
+        """
+        if not self.changes:
+            return True
+        names = {}
+        values = {}
+        assignments = []
+        for index, (attribute, value) in enumerate(self.changes.items()):
+            names[f"#a{index}"] = attribute
+            values[f":v{index}"] = value
+            assignments.append(f"#a{index} = :v{index}")
+        try:
+            with span('dynamodb.update_user'):
+                get_table(USER_TABLE).update_item(
+                    Key={'phone': self.phone},
+                    UpdateExpression="SET " + ", ".join(assignments),
+                    ConditionExpression="attribute_exists(phone)",
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.error(f"User {self.phone} no longer exists, changes discarded: {list(self.changes)}")
+            return False
+        finally:
+            self.changes = {}
+        return True
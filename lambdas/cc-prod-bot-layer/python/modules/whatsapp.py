@@ -1,11 +1,75 @@
 import json
 import os
 import logging
-import requests
+import re
+from modules.clients import get_or_create
+from modules.metrics import span
+from modules.logs import LOG_LEVEL, log_sampled, dump
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
+
+WHATSAPP_API_URL = 'https://graph.facebook.com/v22.0'
+
+# HTTP client settings (seconds for timeouts)
+WHATSAPP_CONNECT_TIMEOUT = float(os.environ.get("WHATSAPP_CONNECT_TIMEOUT", "3"))
+WHATSAPP_READ_TIMEOUT = float(os.environ.get("WHATSAPP_READ_TIMEOUT", "10"))
+WHATSAPP_MAX_RETRIES = int(os.environ.get("WHATSAPP_MAX_RETRIES", "2"))
+WHATSAPP_BACKOFF_FACTOR = float(os.environ.get("WHATSAPP_BACKOFF_FACTOR", "0.3"))
+WHATSAPP_POOL_SIZE = int(os.environ.get("WHATSAPP_POOL_SIZE", "10"))
+
+def create_session():
+    """
+    Creates an HTTP session with a keep-alive connection pool for the Graph API
+
+    Connection errors and throttling/unavailable responses are retried with
+    exponential backoff, honoring the Retry-After header sent by Meta. A POST may
+    have been accepted when the response is lost or is a 5xx, so it is only
+    retried on connection errors and 429, which Meta returns before processing it.
+
+    Returns:
+        requests.Session: Session to reuse across warm Lambda invocations
+    """
+    # Imported here so that verification requests do not load requests on cold start
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class GraphRetry(Retry):
+        def is_retry(self, method, status_code, has_retry_after=False):
+            if method and method.upper() == 'POST':
+                return status_code == 429 and bool(self.total)
+            return super().is_retry(method, status_code, has_retry_after)
+
+    # Read errors are only retried for the methods in allowed_methods, that is, not for POST
+    retry = GraphRetry(
+        total=WHATSAPP_MAX_RETRIES,
+        backoff_factor=WHATSAPP_BACKOFF_FACTOR,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=WHATSAPP_POOL_SIZE,
+        pool_maxsize=WHATSAPP_POOL_SIZE,
+        max_retries=retry
+    )
+    http = requests.Session()
+    http.mount('https://', adapter)
+    return http
+
+TIMEOUT = (WHATSAPP_CONNECT_TIMEOUT, WHATSAPP_READ_TIMEOUT)
+
+def get_session():
+    """
+    Gets the module-level session, kept alive between invocations of the same container
+
+    Returns:
+        requests.Session: Shared Graph API session
+    """
+    return get_or_create("session:whatsapp", create_session)
 
 def process_verification_webhook(event):
     # Para verificación de webhook (requerido por WhatsApp Business API)
@@ -72,50 +136,40 @@ def create_button_message(text, buttons):
         }
     }
 
-def create_file_message(file_url, caption, filename=None):
+def create_file_message(file_url, caption, filename=None, media_id=None):
     """
     Crea un mensaje con archivo para WhatsApp Business API
     
     Args:
         file_url (str): URL del archivo a enviar
         caption (str): Texto de la leyenda del archivo
+        media_id (str, optional): ID del archivo ya subido a WhatsApp, se usa en lugar de la URL
     
     Returns:
         dict: Estructura de mensaje con archivo para la API de WhatsApp
     """
+    document = {"id": media_id} if media_id else {"link": file_url}
+    document.update(caption=caption, filename=filename)
     return {
         "type": "document",
-        "document": {
-            "link": file_url,
-            "caption": caption,
-            "filename": filename
-        }
+        "document": document
     }
 
-def send_whatsapp_message(phone_number, message, file=None, buttons=None, filename=None):
+def build_message_payload(phone_number, message, file=None, buttons=None, filename=None, media_id=None):
     """
-    Envía un mensaje a través de la API de WhatsApp Business
-    
+    Construye el payload de un mensaje para WhatsApp Business API
+
     Args:
         phone_number (str): Número de teléfono del destinatario
         message (str): Mensaje de texto a enviar
+        file (str, optional): URL del archivo a enviar
         buttons (list, optional): Lista de botones para incluir
+        filename (str, optional): Nombre del archivo
+        media_id (str, optional): ID del archivo ya subido a WhatsApp
+
+    Returns:
+        dict: Payload del mensaje
     """
-    
-    # Configuración de la API de WhatsApp Business
-    whatsapp_api_url = 'https://graph.facebook.com/v22.0'
-    phone_number_id = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
-    whatsapp_token = os.environ.get('WHATSAPP_ACCESS_TOKEN')
-    
-    # URL para enviar mensajes
-    url = f"{whatsapp_api_url}/{phone_number_id}/messages"
-    
-    # Encabezados para la llamada HTTP
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {whatsapp_token}"
-    }
-    
     # Estructura base del payload
     payload = {
         "messaging_product": "whatsapp",
@@ -130,32 +184,162 @@ def send_whatsapp_message(phone_number, message, file=None, buttons=None, filena
         message_data = create_button_message(message, buttons)
         payload["type"] = "interactive"
         payload["interactive"] = message_data["interactive"]
-    elif file:
+    elif file or media_id:
         # Mensaje con archivo
-        message_data = create_file_message(file, message, filename)
+        message_data = create_file_message(file, message, filename, media_id)
         payload["type"] = "document"
         payload["document"] = message_data["document"]
     else:
         # Mensaje de texto simple
         payload["type"] = "text"
         payload["text"] = {"body": message}
+    return payload
+
+# Slots of a MessageTemplate, written as @@name@@ in its text
+SLOT_PATTERN = re.compile(r'@@(\w+)@@')
+
+def escape_slot(value):
+    # Contenido de una cadena JSON, sin las comillas
+    return json.dumps(str(value), ensure_ascii=False)[1:-1].encode('utf-8')
+
+class MessageTemplate:
+    """
+    Mensaje precompilado a los bytes de su payload JSON. Los valores de sus slots
+    (@@name@@ en el texto) se rellenan en cada envío, sin construir ni codificar el payload
+    """
+
+    def __init__(self, message, file=None, buttons=None, filename=None):
+        payload = build_message_payload('@@to@@', message, file, buttons, filename)
+        parts = SLOT_PATTERN.split(json.dumps(payload, ensure_ascii=False))
+        # Partes pares: bytes literales. Partes impares: nombres de los slots
+        self.chunks = [part.encode('utf-8') for part in parts[0::2]]
+        self.slots = parts[1::2]
+
+    def render(self, phone_number, **values):
+        """
+        Rellena los slots del mensaje
+
+        Args:
+            phone_number (str): Número de teléfono del destinatario
+            **values: Valor de cada slot del texto
+
+        Returns:
+            bytes: Payload JSON del mensaje
+        """
+        values['to'] = phone_number
+        body = [self.chunks[0]]
+        for slot, chunk in zip(self.slots, self.chunks[1:]):
+            body.append(escape_slot(values[slot]))
+            body.append(chunk)
+        return b''.join(body)
+
+# Resultados de un envío a la API de WhatsApp
+SENT = 'sent'
+RETRY = 'retry'
+FAILED = 'failed'
+
+def post_message(phone_number, body, span_name, description):
+    """
+    Envía un payload JSON ya serializado a la API de WhatsApp, a través de la cola
+    de salida si está configurada (OUTBOX_QUEUE_URL) o directamente si no
+
+    Args:
+        phone_number (str): Número de teléfono del destinatario
+        body (bytes): Payload JSON del mensaje
+        span_name (str): Nombre de la etapa medida
+        description (str): Descripción del mensaje para los logs
+
+    Returns:
+        bool: True si el mensaje fue aceptado o encolado
+    """
+    from modules.outbox import OUTBOX_QUEUE_URL, enqueue_message
+    if OUTBOX_QUEUE_URL:
+        return enqueue_message(phone_number, body, span_name, description)
+    return deliver_message(body, span_name, description) == SENT
+
+def deliver_message(body, span_name, description):
+    """
+    Envía un payload JSON ya serializado al endpoint de mensajes de la API de WhatsApp
+
+    Args:
+        body (bytes): Payload JSON del mensaje
+        span_name (str): Nombre de la etapa medida
+        description (str): Descripción del mensaje para los logs
+
+    Returns:
+        str: SENT si el mensaje fue aceptado, RETRY si no llegó a Meta (429 o error
+            al conectar) o FAILED si no debe reintentarse. Un timeout de lectura o un
+            5xx pueden ocurrir con el mensaje ya aceptado, así que no se reintentan
+    """
+    # Configuración de la API de WhatsApp Business
+    phone_number_id = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
+    whatsapp_token = os.environ.get('WHATSAPP_ACCESS_TOKEN')
     
+    # URL para enviar mensajes
+    url = f"{WHATSAPP_API_URL}/{phone_number_id}/messages"
+    
+    # Encabezados para la llamada HTTP
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {whatsapp_token}"
+    }
+
     try:
         # Realizar la llamada HTTP a la API de WhatsApp
-        logger.info("Sending whatsapp message: %s", json.dumps(payload))
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # Procesar la respuesta
-        if response.status_code == 200:
-            logger.info(f"Mensaje enviado exitosamente: {response.text}")
-            return True
-        else:
-            logger.error(f"Error al enviar mensaje. Código: {response.status_code}, Respuesta: {response.text}")
-            return False
-    
+        log_sampled(logger, f"Sending whatsapp {description}", body)
+        with span(span_name):
+            response = get_session().post(url, headers=headers, data=body, timeout=TIMEOUT)
     except Exception as e:
-        logger.error(f"Excepción al enviar mensaje de WhatsApp: {str(e)}")
+        logger.error("Excepción al enviar %s de WhatsApp: %s. Payload: %s", description, str(e), dump(body))
+        return RETRY if is_connect_error(e) else FAILED
+
+    # Procesar la respuesta
+    if response.status_code != 200:
+        logger.error("Error al enviar %s. Código: %s, Respuesta: %s, Payload: %s", description, response.status_code, response.text, dump(body))
+        return RETRY if response.status_code == 429 else FAILED
+
+    # El mensaje ya fue aceptado: un error al registrarlo no debe provocar un reenvío
+    logger.debug("Envío exitoso (%s): %s", description, response.text)
+    try:
+        # Id del mensaje, para correlacionar las confirmaciones de entrega del webhook
+        from modules.delivery import record_sent
+        messages = response.json().get('messages') or [{}]
+        record_sent(messages[0].get('id'), description)
+    except Exception as e:
+        logger.error("Error al registrar el envío de %s: %s", description, str(e))
+    return SENT
+
+def is_connect_error(error):
+    # Solo los errores al establecer la conexión garantizan que Meta no recibió el mensaje
+    from requests.exceptions import ConnectionError, ReadTimeout
+    from urllib3.exceptions import ProtocolError
+    if not isinstance(error, ConnectionError) or isinstance(error, ReadTimeout):
         return False
+    return not (error.args and isinstance(error.args[0], ProtocolError))
+
+def send_whatsapp_message(phone_number, message, file=None, buttons=None, filename=None, media_id=None):
+    """
+    Envía un mensaje a través de la API de WhatsApp Business
+    
+    Args:
+        phone_number (str): Número de teléfono del destinatario
+        message (str): Mensaje de texto a enviar
+        buttons (list, optional): Lista de botones para incluir
+        media_id (str, optional): ID de un archivo ya subido a WhatsApp
+    """
+    payload = build_message_payload(phone_number, message, file, buttons, filename, media_id)
+    return post_message(phone_number, json.dumps(payload).encode('utf-8'), 'graph.send_message', "message")
+
+def send_message_template(phone_number, template, **values):
+    """
+    Envía un mensaje precompilado a través de la API de WhatsApp Business
+
+    Args:
+        phone_number (str): Número de teléfono del destinatario
+        template (MessageTemplate): Mensaje del catálogo
+        **values: Valor de cada slot del mensaje
+    """
+    return post_message(phone_number, template.render(phone_number, **values), 'graph.send_message', "message")
     
 def send_whatsapp_template(phone_number, template_name, template_language, template_params=None):
     """
@@ -168,20 +352,6 @@ def send_whatsapp_template(phone_number, template_name, template_language, templ
         template_params (list, optional): Parámetros para la plantilla
     """
     
-    # Configuración de la API de WhatsApp Business
-    whatsapp_api_url = 'https://graph.facebook.com/v22.0'
-    phone_number_id = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
-    whatsapp_token = os.environ.get('WHATSAPP_ACCESS_TOKEN')
-    
-    # URL para enviar mensajes
-    url = f"{whatsapp_api_url}/{phone_number_id}/messages"
-    
-    # Encabezados para la llamada HTTP
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {whatsapp_token}"
-    }
-    
     # Estructura base del payload
     payload = {
         "messaging_product": "whatsapp",
@@ -204,23 +374,40 @@ def send_whatsapp_template(phone_number, template_name, template_language, templ
             }
         ]
     
+    return post_message(phone_number, json.dumps(payload).encode('utf-8'), 'graph.send_template', "template")
+    
+def upload_media(content, filename, mime_type):
+    """
+    Uploads a file to the WhatsApp media endpoint, so it can be sent by id
+
+    Args:
+        content (bytes): Content of the file
+        filename (str): Name of the file
+        mime_type (str): MIME type of the file
+
+    Returns:
+        str: Media id, valid for 30 days, or None if the upload failed
+    """
+    phone_number_id = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
+    url = f"{WHATSAPP_API_URL}/{phone_number_id}/media"
+    headers = {"Authorization": f"Bearer {os.environ.get('WHATSAPP_ACCESS_TOKEN')}"}
     try:
-        # Realizar la llamada HTTP a la API de WhatsApp
-        logger.info("Sending whatsapp template: %s", json.dumps(payload))
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # Procesar la respuesta
+        with span('graph.upload_media'):
+            response = get_session().post(
+                url,
+                headers=headers,
+                data={'messaging_product': 'whatsapp', 'type': mime_type},
+                files={'file': (filename, content, mime_type)},
+                timeout=TIMEOUT
+            )
         if response.status_code == 200:
-            logger.info(f"Plantilla enviada exitosamente: {response.text}")
-            return True
-        else:
-            logger.error(f"Error al enviar plantilla. Código: {response.status_code}, Respuesta: {response.text}")
-            return False
-    
+            return response.json()['id']
+        logger.error(f"Error uploading media. Code: {response.status_code}, Response: {response.text}")
+        return None
     except Exception as e:
-        logger.error(f"Excepción al enviar plantilla de WhatsApp: {str(e)}")
-        return False
-    
+        logger.error(f"Exception uploading media: {str(e)}")
+        return None
+
 def get_media_url(media_id):
     """
     Gets the URL of a media file from its ID
@@ -231,13 +418,13 @@ def get_media_url(media_id):
     Returns:
         str: URL of the media file
     """
-    whatsapp_api_url = 'https://graph.facebook.com/v22.0'
     whatsapp_token = os.environ.get('WHATSAPP_ACCESS_TOKEN')
-    url = f"{whatsapp_api_url}/{media_id}"
+    url = f"{WHATSAPP_API_URL}/{media_id}"
     headers = {"Authorization": f"Bearer {whatsapp_token}"}
     
     try:
-        response = requests.get(url, headers=headers)
+        with span('graph.get_media_url'):
+            response = get_session().get(url, headers=headers, timeout=TIMEOUT)
         if response.status_code == 200:
             return response.json()['url']
         logger.error(f"Error getting media URL. Code: {response.status_code}, Response: {response.text}")
@@ -245,25 +432,3 @@ def get_media_url(media_id):
     except Exception as e:
         logger.error(f"Exception getting media URL: {str(e)}")
         return None
-
-def get_media_content(media_id):
-    """
-    Gets the content of a media file from its ID
-    
-    Args:
-        media_id (str): ID of the media file
-    
-    Returns:
-        bytes: Content of the media file
-    """
-    media_url = get_media_url(media_id)
-    if not media_url:
-        return None
-        
-    headers = {"Authorization": f"Bearer {os.environ.get('WHATSAPP_ACCESS_TOKEN')}"}
-    try:
-        response = requests.get(media_url, headers=headers)
-        return response.content if response.status_code == 200 else None
-    except Exception as e:
-        logger.error(f"Exception downloading media content: {str(e)}")
-        return None
\ No newline at end of file
@@ -1,13 +1,32 @@
 import json
 from modules.sns import verify_subscription
 from modules.whatsapp import send_whatsapp_template
+from modules.notifications import queue_offer_fanout
+from modules.delivery import flush_sent
+from modules.metrics import start_invocation, emit_summary
+from modules.logs import LOG_LEVEL, configure_logging, sample_invocation, log_sampled
 import logging
 
 # Configure logging
 logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+configure_logging()
 
 def lambda_handler(event, context):
+    start_invocation("notifications")
+    sample_invocation()
+    try:
+        return handle_event(event)
+    finally:
+        # Sent messages still buffered for delivery tracking
+        flush_sent()
+        emit_summary()
+
+def handle_event(event):
     # Endpoint that acts as SNS subscription confirmation and message processor
+    # Direct SNS -> Lambda invocation, always processed in batch mode
+    if event.get('Records'):
+        return process_records(event)
     # Check if the event is a subscription confirmation
     if event.get('body') and 'Token' in event['body']:
         return verify_subscription(event)
@@ -16,14 +35,21 @@ def lambda_handler(event, context):
         return process_post(event)
 
 def process_post(event):
-    logger.info("Event received: %s", json.dumps(event))
+    log_sampled(logger, "Event received", event)
 
     # get the phone number from the query string
-    phone_number = event['queryStringParameters'].get('phone')
+    phone_number = (event.get('queryStringParameters') or {}).get('phone')
 
     # get the topic message from the body
     body = json.loads(event['body'])
     message = json.loads(body.get('Message'))
+    if not phone_number:
+        # Batch mode: a single subscription notifies every subscriber, from the worker
+        queue_offer_fanout(message, body.get('MessageId'))
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'status': 'success'})
+        }
     if phone_number != message.get('phone'):
         send_whatsapp_template(
             phone_number=phone_number,
@@ -34,4 +60,13 @@ def process_post(event):
     return {
         'statusCode': 200,
         'body': json.dumps({'status': 'success'})
-    }
\ No newline at end of file
+    }
+
+def process_records(event):
+    for record in event['Records']:
+        message = json.loads(record['Sns']['Message'])
+        queue_offer_fanout(message, record['Sns'].get('MessageId'))
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'status': 'success'})
+    }
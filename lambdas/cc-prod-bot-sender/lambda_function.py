@@ -0,0 +1,26 @@
+import logging
+from modules.outbox import process_outbox_records
+from modules.delivery import flush_sent
+from modules.metrics import start_invocation, emit_summary
+from modules.logs import LOG_LEVEL, configure_logging, sample_invocation
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+configure_logging()
+
+def lambda_handler(event, context):
+    # Sends the WhatsApp messages queued in the outbox queue (OUTBOX_QUEUE_URL).
+    # The event source mapping must enable ReportBatchItemFailures, so only the
+    # messages with transient failures are delivered again
+    start_invocation("sender")
+    sample_invocation()
+    try:
+        retry_ids = process_outbox_records(event.get('Records', []))
+    finally:
+        # Sent messages still buffered for delivery tracking
+        flush_sent()
+        emit_summary()
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in retry_ids]
+    }
@@ -1,87 +1,157 @@
+# Start of the initialization, taken before the imports so that their cost is
+# measured too. The Lambda runtime reports the full Init Duration
+import time
+INIT_STARTED = time.perf_counter()
+
 import json
-import boto3
 import logging
 from modules.whatsapp import process_verification_webhook
-from modules.auction import proccess_auction
-from modules.signup import proccess_signup
-from modules.whatsapp import send_whatsapp_message
-from datetime import datetime
-import pytz
+from modules.whatsapp import MessageTemplate, send_message_template
+from modules.metrics import start_invocation, emit_summary, span
+from datetime import datetime, timezone
 import os
+from modules.logs import LOG_LEVEL, configure_logging, sample_invocation, log_sampled, dump
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
+configure_logging()
+
+# Modules only needed by POST requests (boto3, pytz, requests) are imported where
+# they are used, so that verification requests start faster
+FINAL_HOUR = datetime.fromisoformat(os.environ.get("FINAL_HOUR")).astimezone(timezone.utc)
+
+# Cold start budget, in milliseconds, of the module initialization and first request
+COLD_START_BUDGET_MS = float(os.environ.get("COLD_START_BUDGET_MS", "500"))
+cold_start = True
+
+# Maximum number of senders of the same webhook processed concurrently
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", "10"))
+# Sender pool, kept between invocations so that its threads, and the DynamoDB
+# resources each thread builds, are reused by the warm container
+sender_pool = None
+
+AUCTION_ENDED = MessageTemplate("La subasta ha concluido. Agradecemos su interés.")
+
+def process_message(message, item):
+    phone_number = message.get('from', '')
+    logger.info(f"Message from: {phone_number}")
+
+    # Get current time with timezone
+    now = datetime.now(timezone.utc)
+
+    if now > FINAL_HOUR:
+        logger.info(f"Final hour reached: {FINAL_HOUR}. Now is {now}.")
+        send_message_template(message.get('from'), AUCTION_ENDED)
+        return
+
+    logger.debug("User info: %s", dump(item))
+    if item and item.get("verified"):
+        from modules.auction import proccess_auction
+        from modules.users import UserUpdate
+        logger.info(f"User is already verified: {phone_number}")
+        # Update last message timestamp, written with the rest of the turn's changes.
+        # If the turn fails its changes are discarded, and the webhook retry processes it again
+        changes = UserUpdate(phone_number)
+        changes.set(last_message=message.get('timestamp'))
+        proccess_auction(message, item, changes)
+        changes.flush()
+    else:
+        from modules.signup import proccess_signup
+        logger.info(f"User in signup process: {phone_number}")
+        proccess_signup(message, item)
+
+def process_sender_messages(messages, user):
+    from modules.idempotency import claim_message, complete_message, release_message
+    from modules.users import get_user
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-user_table = dynamodb.Table('cc-prod-bot-user')
-message_table = dynamodb.Table('cc-prod-bot-messages')
+    # Messages of the same sender are processed in order. Each one can change the
+    # user, so only the first one uses the item of the batch read
+    for index, message in enumerate(messages):
+        # Ignora reintentos de mensajes ya procesados
+        message_id = message.get('id')
+        if message_id and not claim_message(message_id):
+            continue
+        try:
+            item = user if index == 0 else get_user(message.get('from', ''))
+            process_message(message, item)
+        except Exception:
+            # Permite que el reintento del webhook procese el mensaje
+            if message_id:
+                release_message(message_id)
+            raise
+        if message_id:
+            complete_message(message_id)
 
-# Set timezone (adjust to your local timezone)
-timezone = pytz.timezone('America/Bogota')
-FINAL_HOUR = datetime.fromisoformat(os.environ.get("FINAL_HOUR")).astimezone(timezone)
+def get_sender_pool():
+    global sender_pool
+    if sender_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        sender_pool = ThreadPoolExecutor(max_workers=WEBHOOK_CONCURRENCY)
+    return sender_pool
+
+def process_messages(messages):
+    import contextvars
+    from concurrent.futures import wait
+    from modules.users import get_users
+
+    # Group messages by sender, keeping the order in which they were received
+    messages_by_sender = {}
+    for message in messages:
+        messages_by_sender.setdefault(message.get('from', ''), []).append(message)
+
+    users = get_users(list(messages_by_sender))
+    if len(messages_by_sender) == 1:
+        for phone_number, sender_messages in messages_by_sender.items():
+            process_sender_messages(sender_messages, users.get(phone_number))
+        return
+
+    # Distinct senders are processed concurrently, each one in a copy of the
+    # invocation context so its downstream calls are measured
+    futures = [
+        get_sender_pool().submit(contextvars.copy_context().run, process_sender_messages, sender_messages, users.get(phone_number))
+        for phone_number, sender_messages in messages_by_sender.items()
+    ]
+    wait(futures)
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        raise errors[0]
 
 def process_whatsapp_webhook(event):
     # Verify if user is signup with all fields or if he need to continue signup
     try:
         # Analiza el cuerpo del evento
-        body = json.loads(event.get('body', '{}'))
+        with span('parse'):
+            body = json.loads(event.get('body', '{}'))
         
         # Extrae datos de WhatsApp
         # Esta estructura dependerá de tu proveedor de API de WhatsApp Business
         # Ajusta según el formato de webhook de tu proveedor
         
         if 'object' in body and body['object'] == 'whatsapp_business_account':
+            messages = []
+            statuses = []
             for entry in body.get('entry', []):
                 for change in entry.get('changes', []):
                     if change.get('field') == 'messages':
                         value = change.get('value', {})
                         
-                        # Procesa mensaje entrante
+                        # Mensajes entrantes, se procesan juntos al final
                         if 'messages' in value:
-                            for message in value.get('messages', []):
-                                phone_number = message.get('from', '')
-                                logger.info(f"Message from: {phone_number}")
-
-                                # Get current time with timezone
-                                now = datetime.now(timezone)
-
-                                if now > FINAL_HOUR:
-                                    logger.info(f"Final hour reached: {FINAL_HOUR}. Now is {now}.")
-                                    send_whatsapp_message(
-                                        phone_number=message.get('from'),
-                                        message="La subasta ha concluido. Agradecemos su interés."
-                                    )
-                                    continue
-                                
-                                user = user_table.get_item(
-                                    Key={'phone': phone_number}
-                                )
-                                item = user.get('Item')
-                                logger.info(f"User info: {item}")
-                                if item and item.get("verified"):
-                                    logger.info(f"User is already verified: {phone_number}")
-                                    # Update last message timestamp
-                                    user_table.update_item(
-                                        Key={'phone': phone_number},
-                                        UpdateExpression='SET last_message = :val1',
-                                        ExpressionAttributeValues={
-                                            ':val1': message.get('timestamp')
-                                        }
-                                    )
-                                    proccess_auction(message, item)
-                                else:
-                                    logger.info(f"User in signup process: {phone_number}")
-                                    proccess_signup(message, item)
+                            messages.extend(value.get('messages', []))
 
-                        
-                        # Procesa confirmaciones de entrega o lectura si es necesario
+                        # Confirmaciones de entrega o lectura, se registran juntas al final
                         if 'statuses' in value:
-                            for status in value.get('statuses', []):
-                                # Aquí puedes manejar estados de mensajes
-                                # Por ejemplo, registrar si se entregó o leyó
-                                logger.info(f"Message status: {status.get('id')} - {status.get('status')}")
+                            statuses.extend(value.get('statuses', []))
+
+            # Procesa mensajes entrantes
+            if messages:
+                process_messages(messages)
+
+            # Latencia de entrega de los mensajes enviados
+            if statuses:
+                from modules.delivery import record_statuses
+                record_statuses(statuses)
         
         # Devuelve una respuesta exitosa al webhook
         return {
@@ -90,17 +160,44 @@ def process_whatsapp_webhook(event):
         }
     
     except Exception as e:
-        logger.error(f"Error al procesar webhook: {str(e)}")
+        logger.error("Error al procesar webhook: %s. Event: %s", str(e), dump(event))
         # Devuelve un error HTTP 500 en caso de excepción
         return {
             'statusCode': 500,
             'body': json.dumps({'status': 'error', 'message': str(e)})
         }
+    finally:
+        # Mensajes enviados pendientes de registrar, para la latencia de entrega
+        from modules.delivery import flush_sent
+        flush_sent()
 
 
 def lambda_handler(event, context):
-    # Registra el evento recibido (para debugging)
-    logger.info("Event received: %s", json.dumps(event))
+    start_invocation("webhook")
+    sample_invocation()
+    try:
+        return measure_cold_start(event)
+    finally:
+        emit_summary()
+
+def measure_cold_start(event):
+    global cold_start
+    if not cold_start:
+        return handle_request(event)
+
+    # Mide la inicialización y la primera solicitud del contenedor
+    cold_start = False
+    init_ms = (time.perf_counter() - INIT_STARTED) * 1000
+    started = time.perf_counter()
+    response = handle_request(event)
+    request_ms = (time.perf_counter() - started) * 1000
+    log = logger.warning if init_ms + request_ms > COLD_START_BUDGET_MS else logger.info
+    log(f"Cold start: init {init_ms:.1f} ms, first request {request_ms:.1f} ms (budget {COLD_START_BUDGET_MS:.0f} ms)")
+    return response
+
+def handle_request(event):
+    # Registra el evento recibido (para debugging), solo en las invocaciones muestreadas
+    log_sampled(logger, "Event received", event)
     
     # Extrae el método HTTP de la estructura correcta del evento
     if 'requestContext' in event and 'http' in event['requestContext']:
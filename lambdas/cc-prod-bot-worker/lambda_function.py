@@ -0,0 +1,37 @@
+import json
+import logging
+from modules.scheduler import process_job
+# Imported so that the ingest_document and offer_notification jobs are registered
+from modules import documents, notifications
+from modules.delivery import flush_sent
+from modules.metrics import start_invocation, emit_summary
+from modules.logs import LOG_LEVEL, configure_logging, sample_invocation
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+configure_logging()
+
+def lambda_handler(event, context):
+    # Processes the jobs scheduled in the SQS queues (SCHEDULER_QUEUE_URL, INGEST_QUEUE_URL).
+    # The event source mapping must enable ReportBatchItemFailures, so only the
+    # failed jobs are delivered again and the rest of the batch is not redone
+    start_invocation("worker")
+    sample_invocation()
+    failures = []
+    try:
+        for record in event.get('Records', []):
+            try:
+                job = json.loads(record['body'])
+                logger.info(f"Processing job: {job.get('type')}")
+                process_job(job)
+            except Exception as e:
+                logger.error(f"Error processing job {record.get('messageId')}: {str(e)}")
+                failures.append({'itemIdentifier': record['messageId']})
+    finally:
+        # Sent messages still buffered for delivery tracking
+        flush_sent()
+        emit_summary()
+    return {
+        'batchItemFailures': failures
+    }
@@ -0,0 +1,165 @@
+"""
+Export of the bid history of an auction for the post-auction audit.
+
+The bid table is read with parallel segmented scans. Each segment sorts its pages
+in bounded runs written to temporary files, and the runs are merged into the CSV
+(timestamp, time, phone, amount, id) sorted by time and amount, so memory only
+depends on --run-size. The maximum bid of the log is checked against the
+HIGHEST_BID state row and the best bid of each bidder against its BID_RANKING entry.
+
+Usage:
+    python scripts/export_bids.py [--output bids.csv[.gz]] [--segments 4] [--run-size 50000]
+
+Exits with status 1 if the log does not match the state row.
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lambdas', 'cc-prod-bot-layer', 'python'))
+
+from modules.clients import get_table, BID_TABLE, STATE_TABLE  # noqa: E402
+from modules.bids import BEST_BID_PREFIX, RANKING_ID  # noqa: E402
+
+COLUMNS = ['timestamp', 'time', 'phone', 'amount', 'id']
+
+def sort_key(row):
+    return int(row['timestamp']), Decimal(row['amount'])
+
+class Summary:
+    """
+    Totals of the exported bids, shared by the scanning threads
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.highest = None
+        self.best_by_phone = {}
+        self.lock = threading.Lock()
+
+    def add(self, rows):
+        with self.lock:
+            for row in rows:
+                self.count += 1
+                amount = Decimal(row['amount'])
+                if self.highest is None or amount > Decimal(self.highest['amount']):
+                    self.highest = row
+                if amount > self.best_by_phone.get(row['phone'], Decimal(-1)):
+                    self.best_by_phone[row['phone']] = amount
+
+def write_run(rows, directory):
+    rows.sort(key=sort_key)
+    run = tempfile.NamedTemporaryFile('w', newline='', dir=directory, suffix='.csv', delete=False)
+    with run:
+        writer = csv.DictWriter(run, fieldnames=COLUMNS)
+        writer.writerows(rows)
+    return run.name
+
+def scan_segment(segment, total_segments, run_size, directory, summary):
+    # Sorted runs of at most run_size bids of one segment
+    runs = []
+    rows = []
+    scan_kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+    while True:
+        response = get_table(BID_TABLE).scan(**scan_kwargs)
+        page = [
+            {
+                'timestamp': int(item['timestamp']),
+                'time': datetime.fromtimestamp(int(item['timestamp']), timezone.utc).isoformat(),
+                'phone': item['phone'],
+                'amount': str(item['amount']),
+                'id': item['id']
+            }
+            for item in response.get('Items', [])
+        ]
+        summary.add(page)
+        rows.extend(page)
+        if len(rows) >= run_size:
+            runs.append(write_run(rows, directory))
+            rows = []
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    if rows:
+        runs.append(write_run(rows, directory))
+    return runs
+
+def read_run(path):
+    with open(path, newline='') as run:
+        for row in csv.DictReader(run, fieldnames=COLUMNS):
+            yield row
+
+def export(output, segments, run_size):
+    summary = Summary()
+    with tempfile.TemporaryDirectory() as directory:
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [
+                executor.submit(scan_segment, segment, segments, run_size, directory, summary)
+                for segment in range(segments)
+            ]
+        runs = [run for future in futures for run in future.result()]
+
+        opener = gzip.open if output.endswith('.gz') else open
+        with opener(output, 'wt', newline='') as destination:
+            writer = csv.DictWriter(destination, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(heapq.merge(*(read_run(run) for run in runs), key=sort_key))
+    return summary
+
+def reconcile(summary):
+    """
+    Compares the exported bids with the HIGHEST_BID and BID_RANKING state rows
+
+    Returns:
+        list: Description of every mismatch found
+    """
+    state = get_table(STATE_TABLE).get_item(Key={'id': 'HIGHEST_BID'}, ConsistentRead=True).get('Item', {})
+    problems = []
+    highest = summary.highest
+    if highest is None:
+        if state.get('amount') is not None:
+            problems.append(f"HIGHEST_BID is {state['amount']} but the bid table is empty")
+        return problems
+    if Decimal(str(state.get('amount', 0))) != Decimal(highest['amount']):
+        problems.append(f"HIGHEST_BID amount is {state.get('amount')} but the maximum bid is {highest['amount']}")
+    if state.get('phone') != highest['phone']:
+        problems.append(f"HIGHEST_BID phone is {state.get('phone')} but the maximum bid is from {highest['phone']}")
+    ranking = get_table(STATE_TABLE).get_item(Key={'id': RANKING_ID}, ConsistentRead=True).get('Item', {})
+    for name, amount in ranking.items():
+        if not name.startswith(BEST_BID_PREFIX):
+            continue
+        phone = name[len(BEST_BID_PREFIX):]
+        best = summary.best_by_phone.get(phone)
+        if best is None or Decimal(str(amount)) != best:
+            problems.append(f"Ranking of {phone} is {amount} but the best bid of the log is {best}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bids.csv', help="CSV file, compressed if it ends with .gz")
+    parser.add_argument('--segments', type=int, default=4, help="Parallel scan segments")
+    parser.add_argument('--run-size', type=int, default=50000, help="Bids sorted in memory at once by each segment")
+    args = parser.parse_args()
+
+    summary = export(args.output, args.segments, args.run_size)
+    print(f"{summary.count} bids exported to {args.output}")
+    if summary.highest:
+        print(f"Maximum bid: {summary.highest['amount']} from {summary.highest['phone']} at {summary.highest['time']}")
+    problems = reconcile(summary)
+    for problem in problems:
+        print(f"MISMATCH: {problem}")
+    if problems:
+        sys.exit(1)
+    print("The bid log matches HIGHEST_BID")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Shared setup of the tests: the layer runs against the in-memory backend
+(modules.memory), with the settings every module reads at import time.
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, 'lambdas', 'cc-prod-bot-layer', 'python')
+
+now = datetime.now(timezone.utc)
+defaults = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'MIN_BID': '1000000',
+    'MIN_BID_DIFFERENCE': '50000',
+    'MAX_BID': '100000000',
+    'PROPERTY_ADDRESS': 'Calle 1 # 2-3',
+    'TERMS_AND_CONDITIONS': 's3://cc-prod-bot/terms.pdf',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:cc-prod-bot',
+    'WHATSAPP_PHONE_NUMBER_ID': '000000000',
+    'WHATSAPP_ACCESS_TOKEN': 'token',
+    # The auction and the signup are open
+    'INITIAL_HOUR': (now - timedelta(hours=2)).isoformat(),
+    'FINAL_HOUR': (now + timedelta(hours=2)).isoformat(),
+    'SIGNUP_INITIAL_HOUR': (now - timedelta(days=2)).isoformat(),
+    'SIGNUP_FINAL_HOUR': (now + timedelta(hours=2)).isoformat(),
+    'BOT_BACKEND': 'memory',
+    'METRICS_ENABLED': 'false',
+}
+for name, value in defaults.items():
+    os.environ.setdefault(name, value)
+sys.path.insert(0, LAYER)
+
+@pytest.fixture(autouse=True)
+def backend():
+    """
+    Empty in-memory stand-ins and container caches for every test
+    """
+    from modules import memory, bids, idempotency, delivery
+    stand_ins = memory.reset()
+    bids.highest_bid_cache.update(amount=0.0, phone=None, version=None, expires_at=0)
+    bids.ranking_cache.update(ranking=[], expires_at=0)
+    with idempotency.recent_messages_lock:
+        idempotency.recent_messages.clear()
+    yield stand_ins
+    delivery.flush_sent()
+
+@pytest.fixture
+def sent(backend):
+    """
+    Payloads posted to the Graph API messages endpoint, decoded
+    """
+    import json
+
+    def decoded():
+        return [json.loads(body) if isinstance(body, (bytes, str)) else body for body in backend['graph'].sent]
+    return decoded
@@ -0,0 +1,53 @@
+"""
+Conditional commit of bids on the HIGHEST_BID state row.
+"""
+import threading
+from decimal import Decimal
+
+from modules import bids
+from modules.clients import get_table, BID_TABLE, STATE_TABLE
+
+def state(item_id='HIGHEST_BID'):
+    return get_table(STATE_TABLE).get_item(Key={'id': item_id}).get('Item', {})
+
+def test_commit_registers_the_bid_and_the_ranking():
+    assert bids.commit_bid('1', Decimal(1000000), 1)
+    assert bids.commit_bid('2', Decimal(1050000), 2)
+    assert state()['amount'] == Decimal(1050000) and state()['phone'] == '2'
+    assert state('BID_RANKING') == {'id': 'BID_RANKING', 'best_1': Decimal(1000000), 'best_2': Decimal(1050000)}
+    assert bids.get_top_bids(fresh=True) == [('2', 1050000.0), ('1', 1000000.0)]
+    assert bids.get_bid_position('1', fresh=True) == (2, 1000000.0)
+
+def test_bid_below_the_minimum_difference_is_rejected():
+    assert bids.commit_bid('1', Decimal(1000000), 1)
+    assert not bids.commit_bid('2', Decimal(1049999), 2)
+    assert state()['phone'] == '1'
+    assert len(get_table(BID_TABLE).scan()['Items']) == 1
+
+def test_closed_auction_rejects_bids():
+    get_table(STATE_TABLE).put_item(Item={'id': 'HIGHEST_BID', 'closed': 1})
+    assert not bids.commit_bid('1', Decimal(1000000), 1)
+    assert 'amount' not in state()
+
+def test_concurrent_confirmations_never_replace_a_higher_bid():
+    # Every bidder read the same highest bid and confirms its own amount at once
+    amounts = [Decimal(1000000 + 50000 * index) for index in range(20)]
+    results = {}
+    start = threading.Barrier(len(amounts))
+
+    def confirm(index, amount):
+        start.wait()
+        results[index] = bids.commit_bid(str(index), amount, index)
+
+    threads = [threading.Thread(target=confirm, args=(index, amount)) for index, amount in enumerate(reversed(amounts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert state()['amount'] == max(amounts)
+    registered = get_table(BID_TABLE).scan()['Items']
+    # Only the accepted bids are in the log, and the highest one is always accepted
+    assert len(registered) == sum(results.values())
+    assert max(item['amount'] for item in registered) == max(amounts)
+    assert int(state()['version']) == len(registered)
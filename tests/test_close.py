@@ -0,0 +1,89 @@
+"""
+Close of the auction and announcement of the result, resumable after a failure.
+"""
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+from modules import close
+from modules.clients import get_table, STATE_TABLE, USER_TABLE
+
+PHONES = [f"57300000000{index}" for index in range(5)]
+
+@pytest.fixture
+def announcements(monkeypatch):
+    # Templates sent by the close, by phone. A phone in `failing` raises, as a crash
+    # of the run would, and a phone in `rejected` is not accepted by the Graph API
+    sent = []
+    failing = set()
+    rejected = set()
+
+    def send(phone_number, template_name, template_language, template_params=None):
+        if phone_number in failing:
+            failing.discard(phone_number)
+            raise RuntimeError("Lambda timed out")
+        if phone_number in rejected:
+            return False
+        sent.append((phone_number, template_name))
+        return True
+
+    monkeypatch.setattr(close, 'send_whatsapp_template', send)
+    monkeypatch.setattr(close, 'FINAL_HOUR', datetime.now(timezone.utc) - timedelta(seconds=1))
+    monkeypatch.setattr(close, 'CLOSE_CHECKPOINT_SIZE', 2)
+    monkeypatch.setattr(close, 'NOTIFICATION_CONCURRENCY', 1)
+    for phone in PHONES:
+        get_table(USER_TABLE).put_item(Item={'phone': phone, 'verified': True})
+    get_table(USER_TABLE).put_item(Item={'phone': '573999999999', 'verified': False})
+    return sent, failing, rejected
+
+def highest_bid():
+    return get_table(STATE_TABLE).get_item(Key={'id': 'HIGHEST_BID'})['Item']
+
+def test_close_announces_the_winner(announcements):
+    sent, _, _ = announcements
+    get_table(STATE_TABLE).put_item(Item={'id': 'HIGHEST_BID', 'amount': Decimal(2000000), 'phone': PHONES[1]})
+    summary = close.close_auction(wait=False)
+    assert summary['winner'] == PHONES[1] and summary['sent'] == len(PHONES)
+    assert sorted(sent) == sorted(
+        (phone, close.CLOSE_WINNER_TEMPLATE if phone == PHONES[1] else close.CLOSE_LOSER_TEMPLATE) for phone in PHONES
+    )
+    assert highest_bid()['closed'] and highest_bid()['announced'] == Decimal(len(PHONES))
+    # A new run announces nothing
+    assert close.close_auction(wait=False) is None
+    assert len(sent) == len(PHONES)
+
+def test_close_without_bids(announcements):
+    sent, _, _ = announcements
+    summary = close.close_auction(wait=False)
+    assert summary['winner'] is None
+    assert {template for _, template in sent} == {close.CLOSE_NO_BIDS_TEMPLATE}
+
+def test_close_resumes_after_a_crash(announcements):
+    sent, failing, _ = announcements
+    get_table(STATE_TABLE).put_item(Item={'id': 'HIGHEST_BID', 'amount': Decimal(2000000), 'phone': PHONES[0]})
+    # The run dies in the second chunk, after the first one was checkpointed
+    failing.add(PHONES[3])
+    with pytest.raises(RuntimeError):
+        close.close_auction(wait=False)
+    assert 'announced' not in highest_bid()
+
+    summary = close.close_auction(wait=False)
+    assert summary['already_announced'] == 2
+    phones = [phone for phone, _ in sent]
+    # Only the chunk that was interrupted can be announced twice
+    assert phones.count(PHONES[0]) == 1 and phones.count(PHONES[1]) == 1
+    assert set(phones) == set(PHONES)
+    assert highest_bid()['announced'] == Decimal(len(PHONES))
+
+def test_failed_announcements_are_retried(announcements):
+    sent, _, rejected = announcements
+    rejected.add(PHONES[4])
+    summary = close.close_auction(wait=False)
+    assert summary['failed'] == 1
+    assert 'announced' not in highest_bid()
+
+    rejected.clear()
+    summary = close.close_auction(wait=False)
+    assert summary['sent'] == 1 and summary['failed'] == 0
+    assert [phone for phone, _ in sent].count(PHONES[4]) == 1
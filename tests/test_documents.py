@@ -0,0 +1,60 @@
+"""
+Ingestion of signup documents, stored by content hash.
+"""
+import base64
+import hashlib
+import json
+
+from modules import documents, memory
+from modules.clients import get_table, USER_TABLE
+
+PHONE = '573000000001'
+SHA256 = hashlib.sha256(memory.MEDIA_CONTENT).hexdigest()
+
+def ingest(media_id, sha256=SHA256, timestamp='1700000000'):
+    documents.ingest_document({
+        'phone': PHONE,
+        'timestamp': timestamp,
+        'document': {'id': media_id, 'mime_type': 'application/pdf', 'sha256': sha256},
+        'attempt': 1
+    })
+
+def stored_keys(backend):
+    return sorted(key for _, key in backend['s3'].objects)
+
+def user():
+    return get_table(USER_TABLE).get_item(Key={'phone': PHONE})['Item']
+
+def rendered(*templates):
+    return [json.loads(template.render(PHONE)) for template in templates]
+
+def test_document_is_stored_under_its_hash(backend, sent):
+    get_table(USER_TABLE).put_item(Item={'phone': PHONE, 'status': 'pending_terms'})
+    ingest('media-1')
+    assert stored_keys(backend) == [f"terms_documents/{PHONE}/{SHA256}.pdf"]
+    assert user()['terms_document'] == [f"s3://cc-prod-bot/terms_documents/{PHONE}/{SHA256}.pdf"]
+    assert user()['document_hashes'] == {SHA256}
+    assert sent() == rendered(documents.DOCUMENT_RECEIVED)
+
+def test_resent_document_is_a_duplicate(backend, sent):
+    get_table(USER_TABLE).put_item(Item={'phone': PHONE, 'status': 'pending_terms'})
+    ingest('media-1')
+    ingest('media-2', timestamp='1700000100')
+    assert stored_keys(backend) == [f"terms_documents/{PHONE}/{SHA256}.pdf"]
+    assert len(user()['terms_document']) == 1
+    assert sent() == rendered(documents.DOCUMENT_RECEIVED, documents.DOCUMENT_DUPLICATE)
+
+def test_declared_hash_is_not_trusted_for_the_key(backend):
+    get_table(USER_TABLE).put_item(Item={'phone': PHONE, 'status': 'pending_terms'})
+    ingest('media-1', sha256='0' * 64)
+    # The computed hash names the object, and the temporary key is removed
+    assert stored_keys(backend) == [f"terms_documents/{PHONE}/{SHA256}.pdf"]
+    assert user()['document_hashes'] == {SHA256}
+
+def test_duplicate_is_detected_before_downloading():
+    declared = base64.b64encode(hashlib.sha256(memory.MEDIA_CONTENT).digest()).decode()
+    document = {'id': 'media-1', 'sha256': declared}
+    assert documents.document_hash(document) == SHA256
+    assert documents.is_duplicate({'document_hashes': {SHA256}}, document)
+    assert not documents.is_duplicate({}, document)
+    assert not documents.is_duplicate({'document_hashes': {SHA256}}, {'id': 'media-2', 'sha256': 'invalid'})
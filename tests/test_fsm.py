@@ -0,0 +1,92 @@
+"""
+Transition tables of the conversation state machine.
+"""
+import json
+
+import pytest
+
+from modules import signup
+from modules.fsm import StateMachine, Turn, get_event, ANY
+from modules.users import UserUpdate
+
+def build():
+    machine = StateMachine('test')
+    taken = []
+
+    def action(name, result=None):
+        def run(turn):
+            taken.append(name)
+            return result
+        run.__name__ = name
+        return run
+
+    machine.on('menu', 'offer', guard=lambda turn: turn.open, target='offering')(action('offer'))
+    machine.on('menu', 'offer', target='menu')(action('auction_closed'))
+    machine.on('menu', ANY)(action('menu_fallback'))
+    machine.on('offering', 'confirm', target=None)(action('confirm'))
+    machine.on('offering', 'cancel', target='menu')(action('cancel', result=False))
+    machine.on(ANY, ANY)(action('any_state'))
+    return machine, taken
+
+def dispatch(machine, state, event, **values):
+    turn = Turn({'from': '1'}, {}, UserUpdate('1'), **values)
+    return machine.dispatch(state, event, turn), turn.changes.changes
+
+def test_first_transition_whose_guard_passes_is_taken():
+    machine, taken = build()
+    assert dispatch(machine, 'menu', 'offer', open=True) == (True, {'status': 'offering'})
+    # Same target as the current state: the status is not written
+    assert dispatch(machine, 'menu', 'offer', open=False) == (True, {})
+    assert taken == ['offer', 'auction_closed']
+
+def test_unknown_event_falls_back_to_any_event_of_the_state():
+    machine, taken = build()
+    assert dispatch(machine, 'menu', 'text') == (True, {})
+    assert taken == ['menu_fallback']
+
+def test_state_without_transitions_uses_the_any_state():
+    machine, taken = build()
+    assert dispatch(machine, 'pending_terms', 'document') == (True, {})
+    assert taken == ['any_state']
+
+def test_none_target_clears_the_status_and_false_cancels_it():
+    machine, taken = build()
+    assert dispatch(machine, 'offering', 'confirm') == (True, {'status': None})
+    assert dispatch(machine, 'offering', 'cancel') == (True, {})
+    assert taken == ['confirm', 'cancel']
+
+def test_no_transition():
+    machine = StateMachine('test')
+    machine.on('menu', 'offer')(lambda turn: None)
+    assert dispatch(machine, 'menu', 'text') == (False, {})
+    assert dispatch(machine, 'other', 'offer') == (False, {})
+
+def test_transitions_registered_after_compiling_are_used():
+    machine, taken = build()
+    machine.compile()
+    machine.on('menu', 'ranking')(lambda turn: taken.append('ranking'))
+    dispatch(machine, 'menu', 'ranking')
+    assert taken == ['ranking']
+
+def test_target_transition_needs_a_change_set():
+    machine, _ = build()
+    with pytest.raises(ValueError):
+        machine.dispatch('offering', 'confirm', Turn({'from': '1'}, {}))
+
+def test_event_of_a_message():
+    assert get_event({'type': 'interactive', 'interactive': {'button_reply': {'id': 'offer'}}}) == 'offer'
+    assert get_event({'type': 'document'}) == 'document'
+
+@pytest.mark.parametrize('user, message, expected', [
+    ({'status': 'pending_terms', 'terms_document': []}, {'type': 'text'}, 'DOCUMENT_ONLY'),
+    ({'status': 'pending_terms', 'terms_document': ['s3://x']}, {'type': 'text'}, 'DOCUMENT_ALREADY_RECEIVED'),
+    (
+        {'status': 'pending_terms', 'terms_document': ['s3://x'], 'document_hashes': {'a' * 64}},
+        {'type': 'document', 'document': {'id': 'm', 'mime_type': 'application/pdf', 'sha256': 'a' * 64}},
+        'DOCUMENT_DUPLICATE'
+    ),
+    ({'status': 'pending_terms', 'terms_document': []}, {'type': 'document', 'document': {'id': 'm', 'mime_type': 'image/png'}}, 'DOCUMENT_ONLY'),
+])
+def test_signup_flow(sent, user, message, expected):
+    signup.proccess_signup({'from': '1', 'timestamp': '1700000000', **message}, {'phone': '1', **user})
+    assert sent() == [json.loads(getattr(signup, expected).render('1'))]
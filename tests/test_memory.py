@@ -0,0 +1,121 @@
+"""
+Condition and update expressions of the in-memory DynamoDB stand-in.
+"""
+from decimal import Decimal
+
+import pytest
+from botocore.exceptions import ClientError
+
+from modules.clients import get_dynamodb, get_table, STATE_TABLE, USER_TABLE
+
+def conditional_failure(call):
+    with pytest.raises(ClientError) as error:
+        call()
+    return error.value.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def test_put_if_not_exists():
+    table = get_table(STATE_TABLE)
+    table.put_item(Item={'id': 'a', 'value': 1}, ConditionExpression="attribute_not_exists(id)")
+    assert conditional_failure(lambda: table.put_item(Item={'id': 'a', 'value': 2}, ConditionExpression="attribute_not_exists(id)"))
+    assert table.get_item(Key={'id': 'a'})['Item']['value'] == Decimal(1)
+
+def test_comparison_and_boolean_operators():
+    table = get_table(STATE_TABLE)
+    table.put_item(Item={'id': 'a', 'amount': 100, 'closed': True})
+    condition = "(attribute_not_exists(#amount) OR #amount <= :ceiling) AND NOT #closed = :true"
+    names = {'#amount': 'amount', '#closed': 'closed'}
+
+    def update(ceiling):
+        table.update_item(
+            Key={'id': 'a'},
+            UpdateExpression="SET #amount = :ceiling",
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={':ceiling': ceiling, ':true': True}
+        )
+    assert conditional_failure(lambda: update(200))
+    table.update_item(Key={'id': 'a'}, UpdateExpression="REMOVE #closed", ExpressionAttributeNames={'#closed': 'closed'})
+    assert conditional_failure(lambda: update(50))
+    update(200)
+    assert table.get_item(Key={'id': 'a'})['Item']['amount'] == Decimal(200)
+
+def test_missing_attribute_comparisons():
+    table = get_table(STATE_TABLE)
+    table.put_item(Item={'id': 'a'})
+    # A missing attribute is different from any value and not comparable to it
+    table.update_item(Key={'id': 'a'}, UpdateExpression="SET x = :one", ConditionExpression="y <> :one",
+                      ExpressionAttributeValues={':one': 1})
+    assert conditional_failure(lambda: table.update_item(
+        Key={'id': 'a'}, UpdateExpression="SET x = :one", ConditionExpression="y < :one", ExpressionAttributeValues={':one': 1}))
+
+def test_functions_in_conditions():
+    table = get_table(USER_TABLE)
+    table.put_item(Item={'phone': '1', 'document_hashes': {'abc'}, 'status': 'pending_terms'})
+    assert conditional_failure(lambda: table.update_item(
+        Key={'phone': '1'},
+        UpdateExpression="SET x = :x",
+        ConditionExpression="attribute_not_exists(document_hashes) OR NOT contains(document_hashes, :hash)",
+        ExpressionAttributeValues={':x': 1, ':hash': 'abc'}
+    ))
+    table.update_item(
+        Key={'phone': '1'},
+        UpdateExpression="SET x = :x",
+        ConditionExpression="begins_with(#status, :prefix) AND #status IN (:a, :b)",
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={':x': 1, ':prefix': 'pending', ':a': 'new_user', ':b': 'pending_terms'}
+    )
+    assert table.get_item(Key={'phone': '1'})['Item']['x'] == Decimal(1)
+
+def test_update_actions():
+    table = get_table(USER_TABLE)
+    table.put_item(Item={'phone': '1', 'draft_bid': 5, 'tags': {'a', 'b'}})
+    response = table.update_item(
+        Key={'phone': '1'},
+        UpdateExpression=(
+            "SET docs = list_append(if_not_exists(docs, :empty), :doc), hits = if_not_exists(hits, :zero) + :one "
+            "REMOVE draft_bid ADD version :one, hashes :hashes DELETE tags :a"
+        ),
+        ExpressionAttributeValues={':empty': [], ':doc': ['s3://x'], ':zero': 0, ':one': 1, ':hashes': {'h'}, ':a': {'a'}},
+        ReturnValues='ALL_NEW'
+    )
+    item = response['Attributes']
+    assert item['docs'] == ['s3://x']
+    assert item['hits'] == Decimal(1) and item['version'] == Decimal(1)
+    assert 'draft_bid' not in item
+    assert item['hashes'] == {'h'} and item['tags'] == {'b'}
+
+def test_deleting_the_last_element_removes_the_set():
+    table = get_table(STATE_TABLE)
+    table.put_item(Item={'id': 'a', 'phones': {'1'}})
+    table.update_item(Key={'id': 'a'}, UpdateExpression="DELETE phones :p", ExpressionAttributeValues={':p': {'1'}})
+    assert 'phones' not in table.get_item(Key={'id': 'a'})['Item']
+
+def test_floats_are_rejected():
+    with pytest.raises(TypeError):
+        get_table(STATE_TABLE).put_item(Item={'id': 'a', 'amount': 1.5})
+
+def test_transaction_is_all_or_nothing():
+    client = get_dynamodb().meta.client
+    get_table(STATE_TABLE).put_item(Item={'id': 'a', 'amount': 10})
+    with pytest.raises(ClientError) as error:
+        client.transact_write_items(TransactItems=[
+            {'Put': {'TableName': STATE_TABLE, 'Item': {'id': 'b'}}},
+            {'Update': {
+                'TableName': STATE_TABLE,
+                'Key': {'id': 'a'},
+                'UpdateExpression': "SET amount = :amount",
+                'ConditionExpression': "amount > :amount",
+                'ExpressionAttributeValues': {':amount': 20}
+            }}
+        ])
+    assert error.value.response['Error']['Code'] == 'TransactionCanceledException'
+    assert [reason['Code'] for reason in error.value.response['CancellationReasons']] == ['None', 'ConditionalCheckFailed']
+    assert get_table(STATE_TABLE).get_item(Key={'id': 'b'}) == {}
+
+def test_scan_with_boto3_conditions():
+    from boto3.dynamodb.conditions import Attr
+    table = get_table(USER_TABLE)
+    for phone, verified in (('1', True), ('2', False), ('3', True)):
+        table.put_item(Item={'phone': phone, 'verified': verified})
+    items = table.scan(FilterExpression=Attr('verified').eq(True), ProjectionExpression='phone')['Items']
+    assert sorted(item['phone'] for item in items) == ['1', '3']
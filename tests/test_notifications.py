@@ -0,0 +1,76 @@
+"""
+Coalescing of new offer notifications within NOTIFICATION_WINDOW.
+"""
+import json
+from decimal import Decimal
+
+import pytest
+
+from modules import notifications
+from modules.clients import get_table, STATE_TABLE
+
+@pytest.fixture
+def jobs(monkeypatch):
+    # Delayed jobs are kept instead of running inline, to be run when the test decides
+    scheduled = []
+    monkeypatch.setattr(notifications, 'NOTIFICATION_WINDOW', 60.0)
+    monkeypatch.setattr(notifications, 'enqueue', lambda job_type, payload, delay=0, queue_url=None: scheduled.append((job_type, payload, delay)))
+    return scheduled
+
+def published(backend):
+    return [json.loads(message['Message'])['amount'] for message in backend['sns'].published]
+
+def offer(amount):
+    notifications.queue_offer_notification(Decimal(amount), f"${amount}", f"phone-{amount}")
+
+def test_first_offer_is_published_right_away(backend, jobs):
+    offer(1000000)
+    assert published(backend) == ['$1000000']
+    assert jobs == []
+
+def test_offers_inside_the_window_are_collapsed(backend, jobs):
+    offer(1000000)
+    offer(1050000)
+    offer(1100000)
+    assert published(backend) == ['$1000000']
+    # A single delayed flush per window, with the latest offer pending
+    assert [(job_type, delay > 0) for job_type, _, delay in jobs] == [('flush_offer_notification', True)]
+    row = get_table(STATE_TABLE).get_item(Key={'id': 'OFFER_NOTIFICATION'})['Item']
+    assert row['pending'] is True and row['display'] == '$1100000'
+
+    _, payload, _ = jobs[0]
+    notifications.flush_offer_job(payload)
+    assert published(backend) == ['$1000000', '$1100000']
+    # A redelivered job publishes nothing
+    notifications.flush_offer_job(payload)
+    assert published(backend) == ['$1000000', '$1100000']
+
+def test_lower_offer_does_not_replace_the_pending_one(backend, jobs):
+    offer(1000000)
+    offer(1100000)
+    offer(1050000)
+    row = get_table(STATE_TABLE).get_item(Key={'id': 'OFFER_NOTIFICATION'})['Item']
+    assert row['display'] == '$1100000'
+    assert len(jobs) == 1
+
+def test_window_ended_before_scheduling_flushes_inline(backend, jobs):
+    offer(1000000)
+    offer(1050000)
+    sent_at = int(jobs[0][1]['sent_at'])
+    # An ended window that is not the current one publishes nothing
+    notifications.schedule_offer_flush(sent_at - 120000)
+    assert published(backend) == ['$1000000']
+    get_table(STATE_TABLE).update_item(
+        Key={'id': 'OFFER_NOTIFICATION'},
+        UpdateExpression="SET sent_at = :old",
+        ExpressionAttributeValues={':old': sent_at - 120000}
+    )
+    notifications.schedule_offer_flush(sent_at - 120000)
+    assert published(backend) == ['$1000000', '$1050000']
+
+def test_disabled_window_publishes_every_offer(backend, jobs, monkeypatch):
+    monkeypatch.setattr(notifications, 'NOTIFICATION_WINDOW', 0.0)
+    offer(1000000)
+    offer(1050000)
+    assert published(backend) == ['$1000000', '$1050000']
+    assert get_table(STATE_TABLE).get_item(Key={'id': 'OFFER_NOTIFICATION'}) == {}